@@ -0,0 +1 @@
+# Soak harness and offline stand-ins for the Streamlit app, kept out of the app itself
@@ -0,0 +1,49 @@
+import os
+import sys
+import argparse
+
+# "python -m soak run ..." load tests the app, "python -m soak ingest ..." runs the app's ingestion offline
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from soak.harness import run_soak, run_stand_in_ingest
+
+def build_soak_parser():
+    parser = argparse.ArgumentParser(prog="soak", description="Run the wybe.ai app against S3 and model stand-ins.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="load test main() with simulated sessions against S3 and model stand-ins")
+    run_parser.add_argument("--ramp", default="1,2,4,8,16", help="comma separated session counts to step through")
+    run_parser.add_argument("--stage-seconds", type=float, default=60, help="how long each ramp stage runs")
+    run_parser.add_argument("--duration", type=float, default=0, help="seconds to hold the top concurrency afterwards, hours for a leak hunt")
+    run_parser.add_argument("--sample-seconds", type=float, default=300, help="length of each soak sample window")
+    run_parser.add_argument("--think-time", type=float, default=5.0, help="mean pause between clicks in seconds")
+    run_parser.add_argument("--timeout", type=float, default=120, help="seconds before a single rerun counts as hung")
+    run_parser.add_argument("--funds", type=int, default=12, help="number of stand-in funds")
+    run_parser.add_argument("--letter-kb", type=int, default=40, help="size of each stand-in letter")
+    run_parser.add_argument("--s3-latency", type=float, default=0.05, help="median stand-in S3 latency in seconds")
+    run_parser.add_argument("--model-latency", type=float, default=1.5, help="median stand-in model latency before output in seconds")
+    run_parser.add_argument("--model-tps", type=float, default=80.0, help="stand-in model output tokens per second")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--state-dir", help="scratch directory for the job store and shared cache (default: a fresh one under .wybeai)")
+    run_parser.add_argument("--out", default=os.path.join(".wybeai", "soak_report.json"), help="where to write the JSON report")
+
+    # Everything after "ingest" other than these goes to the app's ingest command, e.g. --storage-dir
+    ingest_parser = subparsers.add_parser("ingest", help="the app's ingest command with the stand-in model filling the datasets instead of the API")
+    ingest_parser.add_argument("--json", action="store_true", help="print the full result as JSON")
+    ingest_parser.add_argument("--seed", type=int, default=0)
+
+    return parser
+
+def soak_main(argv=None):
+    parser = build_soak_parser()
+    args, rest = parser.parse_known_args(argv)
+    if args.command == "ingest":
+        run_stand_in_ingest(args, rest)
+        return 0
+    if rest:
+        parser.error(f"unrecognized arguments: {' '.join(rest)}")
+    run_soak(args)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(soak_main())
@@ -0,0 +1,312 @@
+# Load test of the app: simulated sessions click through main() in this process against the stand-ins
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import threading
+
+import numpy as np
+import streamlit as st
+
+import testv14_without_API as app
+from soak.stand_ins import SOAK_THEMES, SOAK_QUESTIONS, StandInS3, StandInModel, StandInExtractionModel
+
+def soak_widget(widgets, label):
+    for widget in widgets:
+        if widget.label == label:
+            return widget
+    raise LookupError(f"No widget labelled {label!r} on the page")
+
+# Each flow is a click-path through main(), yielding once per rerun the browser would trigger
+def soak_birds_eye_flow(at, rng, fund_names):
+    soak_widget(at.sidebar.radio, "Navigation").set_value("Bird's-Eye View")
+    yield "birds_eye"
+    soak_widget(at.sidebar.multiselect, "Select Funds").set_value(rng.sample(fund_names, min(len(fund_names), rng.randint(1, 3))))
+    soak_widget(at.sidebar.selectbox, "Select an option").set_value("Performance Pulse")
+    yield "performance_pulse"
+    soak_widget(at.selectbox, "Select an option").set_value(rng.choice(app.PERFORMANCE_OPTIONS))
+    soak_widget(at.button, "Submit").click()
+    yield "performance_pulse_submit"
+    soak_widget(at.sidebar.selectbox, "Select an option").set_value("Market Mood Monitor")
+    yield "market_mood"
+    soak_widget(at.multiselect, "Select market commentary themes:").set_value(rng.sample(SOAK_THEMES["Macro"], 2))
+    yield "market_mood_themes"
+    soak_widget(at.button, "Submit").click()
+    yield "market_mood_submit"
+    soak_widget(at.sidebar.selectbox, "Select an option").set_value("Opportunity Scout")
+    yield "opportunity_scout"
+
+def soak_specific_funds_flow(at, rng, fund_names):
+    soak_widget(at.sidebar.radio, "Navigation").set_value("Specific Funds")
+    yield "specific_funds"
+    soak_widget(at.sidebar.selectbox, "Select a Hedge Funds").set_value(rng.choice(fund_names))
+    yield "specific_funds_fund"
+    soak_widget(at.selectbox, "Select an option to extract insights from the partner letters:").set_value("Performance")
+    yield "performance"
+    soak_widget(at.selectbox, "Select a performance option").set_value(rng.choice(app.PERFORMANCE_OPTIONS))
+    soak_widget(at.button, "Submit").click()
+    yield "specific_funds_submit"
+    soak_widget(at.selectbox, "Select an option to extract insights from the partner letters:").set_value("Ask Anything")
+    yield "ask_anything"
+    soak_widget(at.text_input, "Enter your question:").set_value(f"{rng.choice(SOAK_QUESTIONS)} ({rng.randint(1, 1000)})")
+    soak_widget(at.button, "Submit").click()
+    yield "ask_anything_submit"
+
+def soak_sources_flow(at, rng, fund_names):
+    soak_widget(at.sidebar.radio, "Navigation").set_value("Sources")
+    yield "sources"
+    soak_widget(at.sidebar.radio, "Navigation").set_value("Home")
+    yield "home"
+
+SOAK_FLOWS = (soak_birds_eye_flow, soak_specific_funds_flow, soak_sources_flow)
+
+def process_rss_mb():
+    # Current resident set size, /proc is exact on Linux, getrusage only knows the peak elsewhere
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def share_app_test_runtime():
+    # AppTest drives one session at a time, around every rerun it compiles the script, flips a config flag and
+    # installs a mock runtime. The soak sessions share one of each instead, the way sessions share a real server
+    import streamlit
+    from unittest.mock import MagicMock
+    from streamlit.runtime import Runtime
+    from streamlit.testing.v1 import app_test, local_script_runner
+
+    script_cache = app_test.ScriptCache()
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: script_cache
+    streamlit.config.set_option("global.appTest", True)
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = app_test.MediaFileManager(app_test.MemoryMediaFileStorage("/mock/media"))
+    runtime.dataframe_source_mgr = app_test.DataframeSourceManager()
+    runtime.cache_storage_manager = app_test.MemoryCacheStorageManager()
+    Runtime._instance = runtime
+    # Reruns now install and tear down their own runtime on a subclass, leaving the shared one in place
+    app_test.Runtime = type("SoakRuntime", (Runtime,), {})
+
+def soak_session(s3_client, model_client):
+    # The script every session runs, main() as the server would run it but with the stand-ins as its clients
+    import testv14_without_API
+    testv14_without_API.main(s3_client=s3_client, model_client=model_client)
+
+class SoakHarness:
+    def __init__(self, s3_client, model_client, fund_names, think_time=5.0, timeout=120, seed=0):
+        self.s3_client = s3_client
+        self.model_client = model_client
+        self.fund_names = fund_names
+        self.think_time = think_time
+        self.timeout = timeout
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.samples = []
+        self.sessions = []
+        self.stop = threading.Event()
+
+    def record(self, step, latency, failed):
+        with self.lock:
+            self.samples.append((time.time(), step, latency, failed))
+
+    def open(self):
+        from streamlit.testing.v1 import AppTest
+        at = AppTest.from_function(soak_session, default_timeout=self.timeout, kwargs={"s3_client": self.s3_client, "model_client": self.model_client})
+        self.rerun(at, "open")
+        return at
+
+    def rerun(self, at, step):
+        started_at = time.time()
+        failed = False
+        try:
+            at.run()
+            failed = bool(at.exception)
+        except Exception as e:
+            print(f"Soak session failed at {step}")
+            print(f"Error: {str(e)}")
+            failed = True
+        self.record(step, time.time() - started_at, failed)
+        return not failed
+
+    def session(self, index):
+        # One browser tab, opening the app and then clicking through random flows until told to stop
+        rng = random.Random(self.seed * 10007 + index)
+        at = self.open()
+        while not self.stop.is_set():
+            try:
+                for step in rng.choice(SOAK_FLOWS)(at, rng, self.fund_names):
+                    failed = not self.rerun(at, step)
+                    if self.stop.wait(rng.expovariate(1.0 / self.think_time)) or failed:
+                        break
+            except LookupError as e:
+                # The page was not in the state the flow expected, start over like a user would
+                self.record("navigation", 0.0, True)
+                print("Soak session lost its place, reopening the app")
+                print(f"Error: {str(e)}")
+                at = self.open()
+
+    def scale_to(self, concurrency):
+        while len(self.sessions) < concurrency:
+            thread = threading.Thread(target=self.session, args=(len(self.sessions),), name=f"soak-session-{len(self.sessions)}", daemon=True)
+            self.sessions.append(thread)
+            thread.start()
+
+    def window(self, started_at, ended_at, concurrency):
+        with self.lock:
+            samples = [sample for sample in self.samples if started_at <= sample[0] < ended_at]
+        latencies = np.array([latency for _, _, latency, _ in samples]) if samples else np.zeros(1)
+        return {
+            "concurrency": concurrency,
+            "started_at": round(started_at, 1),
+            "seconds": round(ended_at - started_at, 1),
+            "interactions": len(samples),
+            "errors": sum(1 for *_, failed in samples if failed),
+            "throughput": round(len(samples) / max(ended_at - started_at, 1e-9), 3),
+            "p50": round(float(np.percentile(latencies, 50)), 3),
+            "p99": round(float(np.percentile(latencies, 99)), 3),
+            "analyses_active": sum(1 for job in app.get_job_runner().list_jobs("analysis") if job.is_active()),
+            "threads": threading.active_count(),
+            "rss_mb": round(process_rss_mb(), 1),
+        }
+
+    def run(self, ramp, stage_seconds, duration, sample_seconds):
+        stages, soak = [], []
+        try:
+            # Ramp: add sessions stage by stage and measure each plateau
+            for concurrency in ramp:
+                self.scale_to(concurrency)
+                started_at = time.time()
+                self.stop.wait(stage_seconds)
+                stages.append(self.window(started_at, time.time(), concurrency))
+                print(format_soak_window(stages[-1]))
+
+            # Soak: hold the top concurrency and sample, growth across these windows is what a leak looks like
+            ends_at = time.time() + duration
+            while time.time() < ends_at:
+                started_at = time.time()
+                self.stop.wait(min(sample_seconds, max(ends_at - started_at, 0)))
+                soak.append(self.window(started_at, time.time(), len(self.sessions)))
+                print(format_soak_window(soak[-1]))
+        finally:
+            self.stop.set()
+            for thread in self.sessions:
+                thread.join(self.timeout)
+        return {"stages": stages, "soak": soak, "steps": self.steps(), "saturation": soak_saturation(stages), "trend": soak_trend(soak)}
+
+    def steps(self):
+        # Latency per click across the whole run, to tell which page the time goes to
+        latencies = {}
+        with self.lock:
+            for _, step, latency, _ in self.samples:
+                latencies.setdefault(step, []).append(latency)
+        return {
+            step: {"count": len(values), "p50": round(float(np.percentile(values, 50)), 3), "p99": round(float(np.percentile(values, 99)), 3)}
+            for step, values in sorted(latencies.items())
+        }
+
+def soak_saturation(stages):
+    # Saturated once more sessions stop buying throughput, the tail blows up or analyses pile up faster than they finish
+    if not stages:
+        return None
+    baseline = stages[0]
+    previous = None
+    for stage in stages:
+        if stage["analyses_active"] > 2 * stage["concurrency"]:
+            return {"concurrency": stage["concurrency"], "reason": f"{stage['analyses_active']} analyses waiting or running"}
+        if previous and stage["throughput"] < previous["throughput"] * 1.1:
+            return {"concurrency": stage["concurrency"], "reason": f"throughput {previous['throughput']} -> {stage['throughput']} interactions/s"}
+        if baseline["p99"] and stage["p99"] > 2 * baseline["p99"]:
+            return {"concurrency": stage["concurrency"], "reason": f"p99 {baseline['p99']}s -> {stage['p99']}s"}
+        previous = stage
+    return None
+
+def soak_trend(windows):
+    # Least squares slope per hour, a steady climb in RSS or threads under constant load is a leak
+    if len(windows) < 3:
+        return None
+    hours = np.array([window["started_at"] for window in windows]) / 3600.0
+    hours -= hours[0]
+    return {
+        key: round(float(np.polyfit(hours, [window[key] for window in windows], 1)[0]), 3)
+        for key in ("rss_mb", "threads", "analyses_active", "p99", "throughput")
+    }
+
+def format_soak_window(window):
+    return f"{window['concurrency']:>3} sessions  {window['throughput']:>7.2f}/s  p50 {window['p50']:>6.2f}s  p99 {window['p99']:>6.2f}s  errors {window['errors']:>3}  analyses {window['analyses_active']:>3}  threads {window['threads']:>4}  rss {window['rss_mb']:>7.1f} MB"
+
+# Every on-disk state location the app reads from the environment, and where a soak puts it under its scratch directory.
+# The optional ones are only redirected when configured, so the soak doesn't switch on modes the host runs without
+SOAK_STATE_DIRS = {"WYBEAI_JOB_DIR": "jobs", "WYBEAI_SHARED_CACHE": "shared_cache.db", "WYBEAI_SNAPSHOT_DIR": "snapshots", "WYBEAI_PROFILE_DIR": "profiles"}
+SOAK_OPTIONAL_STATE_DIRS = {"WYBEAI_LETTER_MIRROR": "letters", "WYBEAI_RATE_STATE": "rate_state.db"}
+
+def run_soak(args):
+    # Point every bit of on-disk state at a scratch directory before main() ever runs
+    scratch = args.state_dir or os.path.join(".wybeai", f"soak-{uuid.uuid4().hex[:8]}")
+    os.makedirs(scratch, exist_ok=True)
+    previous_env = {name: os.environ.get(name) for name in list(SOAK_STATE_DIRS) + list(SOAK_OPTIONAL_STATE_DIRS) + ["WYBEAI_LOCAL_STORAGE"]}
+    for name, path in SOAK_STATE_DIRS.items():
+        os.environ[name] = os.path.join(scratch, path)
+    for name, path in SOAK_OPTIONAL_STATE_DIRS.items():
+        if os.environ.get(name):
+            os.environ[name] = os.path.join(scratch, path)
+    os.environ.pop("WYBEAI_LOCAL_STORAGE", None)
+
+    try:
+        return soak(args, scratch)
+    finally:
+        # Nothing built against the scratch state or the stand-in data may outlive the soak
+        st.cache_resource.clear()
+        for name, value in previous_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+def soak(args, scratch):
+    s3 = StandInS3(funds=args.funds, latency=args.s3_latency, letter_kb=args.letter_kb, seed=args.seed)
+    model = StandInModel(latency=args.model_latency, tokens_per_second=args.model_tps, seed=args.seed)
+
+    share_app_test_runtime()
+
+    # The sessions run main() in this process and hand it the stand-ins, the real clients are never built
+    ramp = [int(value) for value in args.ramp.split(",")]
+    harness = SoakHarness(s3, model, s3.fund_names, think_time=args.think_time, timeout=args.timeout, seed=args.seed)
+    report = harness.run(ramp, args.stage_seconds, args.duration, args.sample_seconds)
+    report["settings"] = {key: value for key, value in vars(args).items() if key != "command"}
+    report["state_dir"] = scratch
+    report["stand_ins"] = {"s3": dict(s3.counters), "model": dict(model.counters)}
+
+    saturation = report["saturation"]
+    print(f"Saturation: {saturation['reason']} at {saturation['concurrency']} sessions" if saturation else "Saturation: not reached")
+    if report["trend"]:
+        print("Trend per hour: " + ", ".join(f"{key} {value:+}" for key, value in report["trend"].items()))
+
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.out}")
+
+    # Analyses still queued behind the rate governor would otherwise hold the process open until they all drain
+    job_runner = app.get_job_runner()
+    job_runner.executor.shutdown(wait=False, cancel_futures=True)
+    running = sum(1 for job in job_runner.list_jobs("analysis") if job.status == "running")
+    if running:
+        print(f"Waiting for {running} running analyses to finish before exiting")
+    return report
+
+
+def run_stand_in_ingest(args, ingest_argv):
+    # The app's own ingest command, with the extraction stand-in filling the datasets instead of the API
+    ingest_args = app.build_cli_parser().parse_args(["ingest"] + ingest_argv)
+    model_client = StandInExtractionModel(latency=0.2, tokens_per_second=400.0, seed=args.seed)
+    result = app.run_ingest(ingest_args, model_client=model_client)
+    print(json.dumps(result, indent=2) if args.json else app.format_cli_result("ingest", result))
+    return result
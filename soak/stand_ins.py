@@ -0,0 +1,163 @@
+# Stand-ins for S3 and the model API, used by the soak and by offline ingestion runs
+import io
+import re
+import json
+import math
+import time
+import random
+import hashlib
+import threading
+from collections import Counter
+from types import SimpleNamespace
+
+import botocore.exceptions
+
+from wybeai.routing import estimate_tokens
+
+# Stand-in data for the soak harness, one letter per fund and quarter like the real buckets
+SOAK_QUARTERS = ["2022 Q3", "2022 Q4", "2023 Q1", "2023 Q2", "2023 Q3", "2023 Q4", "2024 Q1"]
+SOAK_SECTORS = ["Technology", "Healthcare", "Financials", "Energy", "Industrials", "Consumer Discretionary", "Materials", "Utilities"]
+SOAK_THEMES = {
+    "Macro": ["Inflation", "Interest Rates", "Recession Risk", "Labor Market", "Fiscal Policy", "Credit Spreads"],
+    "Asset Classes": ["Equities", "Credit", "Commodities", "Currencies", "Rates"],
+    "Geographies": ["United States", "Europe", "Japan", "China", "Emerging Markets"],
+}
+SOAK_QUESTIONS = [
+    "What did the fund say about inflation?",
+    "Which positions were added this quarter?",
+    "How is the fund positioned for a recession?",
+    "What drove performance in the latest quarter?",
+    "What is the fund's view on interest rates?",
+]
+
+class StandInS3:
+    def __init__(self, funds=12, latency=0.05, letter_kb=40, seed=0):
+        # Mimics the slice of the S3 client the app uses, every call sleeps a lognormal latency with a long tail
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.fund_names = [f"Stand-in Capital {i + 1}" for i in range(funds)]
+        self.objects = self.build_objects(letter_kb)
+        self.counters = Counter()
+
+    def build_objects(self, letter_kb):
+        rng = random.Random(0)
+        words = ["portfolio", "inflation", "rates", "position", "exposure", "quarter", "earnings", "valuation", "margin", "growth", "credit", "hedge", "conviction", "drawdown", "liquidity"]
+        objects = {}
+        general, performance = [], []
+        for fund_name in self.fund_names:
+            prefix = fund_name.lower().replace(" ", "")
+            equities = []
+            for quarter in SOAK_QUARTERS:
+                general.append({"Fund Name": fund_name, "Date": quarter, **{key: ", ".join(rng.sample(values, 2)) for key, values in SOAK_THEMES.items()}})
+                performance.append({
+                    "Fund Name": fund_name,
+                    "Date": quarter,
+                    "Quarterly Performance Net of Fees": str(round(rng.gauss(2.0, 5.0), 1)),
+                    "Key Contributors to Performance": f"Long {rng.choice(SOAK_SECTORS).lower()} positions.",
+                    "Key Detractors from Performance": f"Short {rng.choice(SOAK_SECTORS).lower()} positions.",
+                    "Portfolio Positioning and Adjustments": f"Net exposure moved to {rng.randint(20, 90)}%.",
+                })
+                for _ in range(rng.randint(3, 8)):
+                    equities.append({"Company": f"Company {rng.randint(1, 500)}", "Sector": rng.choice(SOAK_SECTORS), "Date": quarter, "PositionOpen": "Yes", "PositionClose": "No", "Description": "Stand-in position."})
+
+                # Letters are random prose of roughly the real size, so tagging and prompt building do real work
+                letter = []
+                size = 0
+                while size < letter_kb * 1024:
+                    sentence = " ".join(rng.choice(words) for _ in range(rng.randint(8, 20))).capitalize() + ". "
+                    letter.append(sentence)
+                    size += len(sentence)
+                objects[("hedgefunds", f"{prefix}/cleaned/{fund_name} {quarter}.txt")] = "".join(letter).encode("utf-8")
+            objects[("hedgefunds", f"{prefix}/{prefix}_equities.json")] = json.dumps(equities).encode("utf-8")
+        objects[("hedgefunds", "hedgefund_general_insights.json")] = json.dumps(general).encode("utf-8")
+        objects[("hedgefunds", "hedgefund_performance_insights.json")] = json.dumps(performance).encode("utf-8")
+        objects[("venturecapitalfunds", "vc_performance_insights.json")] = b"[]"
+        return objects
+
+    def delay(self):
+        with self.lock:
+            seconds = self.random.lognormvariate(math.log(self.latency), 0.6)
+        time.sleep(seconds)
+
+    def error(self, code, status, operation):
+        return botocore.exceptions.ClientError({"Error": {"Code": code, "Message": code}, "ResponseMetadata": {"HTTPStatusCode": status}}, operation)
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        self.delay()
+        with self.lock:
+            self.counters["get_object"] += 1
+            body = self.objects.get((Bucket, Key))
+        if body is None:
+            raise self.error("NoSuchKey", 404, "GetObject")
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if IfNoneMatch == etag:
+            raise self.error("304", 304, "GetObject")
+        return {"Body": io.BytesIO(body), "ETag": etag}
+
+    def upload_fileobj(self, fileobj, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        self.delay()
+        body = fileobj.read()
+        with self.lock:
+            self.counters["upload"] += 1
+            self.objects[(Bucket, Key)] = body
+        if Callback:
+            Callback(len(body))
+
+class StandInModel:
+    def __init__(self, latency=1.5, tokens_per_second=80.0, output_tokens=300, seed=0):
+        # Stands in for an anthropic.Anthropic client, answers take a base latency plus time to "generate" the output
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.messages = self
+        self.counters = Counter()
+
+    def create(self, model, max_tokens, temperature, system, messages):
+        input_tokens = estimate_tokens(system) + sum(estimate_tokens(part["text"]) for message in messages for part in message["content"])
+        with self.lock:
+            output_tokens = min(max_tokens, int(self.random.uniform(0.5, 1.5) * self.output_tokens))
+            seconds = self.random.lognormvariate(math.log(self.latency), 0.4) + output_tokens / self.tokens_per_second
+            self.counters["calls"] += 1
+            self.counters["input_tokens"] += input_tokens
+        time.sleep(seconds)
+        text = f"<thinking>Stand-in.</thinking><answer>{self.answer(model, input_tokens, system, messages)}</answer>"
+        return SimpleNamespace(content=[SimpleNamespace(text=text)], usage=SimpleNamespace(input_tokens=input_tokens, output_tokens=output_tokens))
+
+    def answer(self, model, input_tokens, system, messages):
+        return f"Stand-in answer from {model} over {input_tokens} input tokens."
+
+class StandInExtractionModel(StandInModel):
+    # Fills the extraction template in the system prompt from the letter's own words, so the ingestion
+    # pipeline can run end to end without a model
+    def answer(self, model, input_tokens, system, messages):
+        schema = re.search(r"<schema>(.*?)</schema>", system, re.DOTALL)
+        if not schema:
+            return super().answer(model, input_tokens, system, messages)
+        words = re.findall(r"[A-Za-z]+", messages[0]["content"][0]["text"])[2:]
+        seed = int(hashlib.sha256(" ".join(words).encode("utf-8")).hexdigest()[:8], 16)
+        rng = random.Random(seed)
+
+        def value(field):
+            if field in ("Quarterly Performance Net of Fees", "Amount Invested"):
+                return str(round(rng.uniform(-5, 10), 1))
+            if field in ("PositionOpen", "PositionClose"):
+                return rng.choice(["Yes", "No"])
+            if field == "Sector":
+                return rng.choice(SOAK_SECTORS)
+            if field == "Company":
+                return " ".join(rng.sample(words, 2)).title()
+            if field in SOAK_THEMES:
+                return ", ".join(rng.sample(SOAK_THEMES[field], 2))
+            start = rng.randrange(max(1, len(words) - 12))
+            return " ".join(words[start:start + 12]).capitalize()
+
+        filled = {}
+        for part, fields in json.loads(schema.group(1)).items():
+            if isinstance(fields, list):
+                filled[part] = [{field: value(field) for field in fields[0]} for _ in range(rng.randint(1, 4))]
+            else:
+                filled[part] = {field: value(field) for field in fields}
+        return json.dumps(filled)
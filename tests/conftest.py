@@ -0,0 +1,40 @@
+import os
+import sys
+import hashlib
+
+import botocore.exceptions
+import pytest
+
+# The tests import the wybeai package from the repository root, the Streamlit app is never loaded
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+class FakeAWS:
+    # Objects kept in memory with an ETag each, answering the calls the subsystems make on AWSOperations
+    def __init__(self):
+        self.objects = {}
+        self.requests = []
+
+    def put(self, bucket, file_name, body):
+        data = body if isinstance(body, bytes) else body.encode("utf-8")
+        self.objects[(bucket, file_name)] = (data, hashlib.md5(data).hexdigest())
+
+    def lookup(self, bucket, file_name):
+        self.requests.append((bucket, file_name))
+        if (bucket, file_name) not in self.objects:
+            raise botocore.exceptions.ClientError({"Error": {"Code": "NoSuchKey", "Message": file_name}}, "GetObject")
+        return self.objects[(bucket, file_name)]
+
+    def fetch_object(self, file_name, bucket):
+        return self.lookup(bucket, file_name)[0].decode("utf-8")
+
+    def get_object(self, file_name, bucket, etag=None):
+        data, current = self.lookup(bucket, file_name)
+        return (None, current) if etag == current else (data, current)
+
+    def fetch_versioned(self, file_name, bucket):
+        data, etag = self.lookup(bucket, file_name)
+        return data.decode("utf-8"), etag
+
+@pytest.fixture
+def fake_aws():
+    return FakeAWS()
@@ -0,0 +1,107 @@
+import threading
+import time
+
+import botocore.exceptions
+import pytest
+
+from wybeai.caching import S3LatencyGuard, SingleFlight
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+def test_single_flight_coalesces_concurrent_calls():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return "letter"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(single_flight.do("key", fetch))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: single_flight.stats()["coalesced"] == 4)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == ["letter"] * 5
+    assert len(calls) == 1
+    assert single_flight.stats() == {"in_flight": 0, "calls": 1, "coalesced": 4}
+
+def test_single_flight_hands_errors_to_waiters_and_forgets_the_key():
+    single_flight = SingleFlight()
+    release = threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise KeyboardInterrupt()
+
+    errors = []
+
+    def call():
+        try:
+            single_flight.do("key", fail)
+        except BaseException as e:
+            errors.append(type(e))
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: single_flight.stats()["coalesced"] == 2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert errors == [KeyboardInterrupt] * 3
+    assert single_flight.stats()["in_flight"] == 0
+    # The next caller runs the function again instead of waiting on the failed call
+    assert single_flight.do("key", lambda: "retried") == "retried"
+
+def test_latency_guard_hedges_a_slow_primary():
+    guard = S3LatencyGuard(hedge=True, hedge_min_delay=0.05)
+    guard.latencies.extend([0.01] * 20)
+    attempts = []
+
+    def request():
+        attempts.append(1)
+        if len(attempts) == 1:
+            time.sleep(1.0)
+            return "primary"
+        return "backup"
+
+    assert guard.get(request) == "backup"
+    stats = guard.stats()
+    assert stats["hedged"] == 1
+    assert stats["hedge_wins"] == 1
+
+def test_latency_guard_skips_the_hedge_for_fast_requests():
+    guard = S3LatencyGuard(hedge=True, hedge_min_delay=0.5)
+    assert guard.get(lambda: "primary") == "primary"
+    assert guard.stats()["hedged"] == 0
+
+def test_latency_guard_serves_stale_copy_when_revalidation_is_slow():
+    guard = S3LatencyGuard(stale_timeout=0.05)
+
+    def revalidation():
+        time.sleep(0.5)
+        return "fresh"
+
+    assert guard.revalidate(revalidation, "stale", "bucket/key") == "stale"
+    assert guard.stats()["stale_served"] == 1
+
+def test_latency_guard_raises_when_the_object_was_deleted():
+    guard = S3LatencyGuard(stale_timeout=1.0)
+
+    def revalidation():
+        raise botocore.exceptions.ClientError({"Error": {"Code": "NoSuchKey", "Message": "gone"}}, "GetObject")
+
+    with pytest.raises(botocore.exceptions.ClientError):
+        guard.revalidate(revalidation, "stale", "bucket/key")
+    assert guard.stats()["stale_served"] == 0
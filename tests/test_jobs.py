@@ -0,0 +1,82 @@
+import json
+import os
+import time
+
+from wybeai.jobs import Job, JobRunner
+
+def wait_for(job, timeout=5.0):
+    deadline = time.time() + timeout
+    while job.is_active():
+        assert time.time() < deadline, "job did not finish"
+        time.sleep(0.01)
+    return job
+
+def test_identical_requests_share_one_job(tmp_path):
+    runner = JobRunner(max_workers=2, store_dir=str(tmp_path))
+    calls = []
+
+    def analyse(job, question):
+        calls.append(question)
+        return f"answer to {question}"
+
+    first = runner.submit("analysis", "Fund A", analyse, "q", dedup_key="fund-a:q", session_id="s1")
+    wait_for(first)
+    second = runner.submit("analysis", "Fund A", analyse, "q", dedup_key="fund-a:q", session_id="s2")
+
+    assert second is first
+    assert calls == ["q"]
+    assert first.result == "answer to q"
+    assert first.sessions == {"s1", "s2"}
+    assert [job.job_id for job in runner.list_jobs(session_id="s2")] == [first.job_id]
+    with open(os.path.join(str(tmp_path), f"{first.job_id}.json"), encoding="utf-8") as f:
+        assert json.load(f)["sessions"] == ["s1", "s2"]
+
+def test_failed_jobs_are_retried():
+    runner = JobRunner(max_workers=1)
+    attempts = []
+
+    def flaky(job):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("model overloaded")
+        return "ok"
+
+    failed = wait_for(runner.submit("analysis", "Fund A", flaky, dedup_key="fund-a"))
+    assert failed.status == "failed"
+    assert failed.error == "model overloaded"
+
+    retried = wait_for(runner.submit("analysis", "Fund A", flaky, dedup_key="fund-a"))
+    assert retried is not failed
+    assert retried.status == "done"
+    assert retried.result == "ok"
+
+def test_restart_marks_interrupted_jobs_failed(tmp_path):
+    job = Job("abc", "analysis", "Fund A")
+    job.status = "running"
+    with open(os.path.join(str(tmp_path), "abc.json"), "w", encoding="utf-8") as f:
+        json.dump(job.to_dict(), f)
+
+    runner = JobRunner(store_dir=str(tmp_path))
+    restored = runner.get("abc")
+    assert restored.status == "failed"
+    assert restored.error == "Interrupted by a server restart"
+
+def test_oldest_finished_jobs_are_evicted_beyond_the_cap(tmp_path):
+    runner = JobRunner(max_workers=1, store_dir=str(tmp_path), max_jobs=2)
+    jobs = [wait_for(runner.submit("analysis", f"Fund {i}", lambda job: "ok")) for i in range(3)]
+
+    assert runner.get(jobs[0].job_id) is None
+    assert {job.job_id for job in runner.list_jobs()} == {jobs[1].job_id, jobs[2].job_id}
+    assert not os.path.exists(os.path.join(str(tmp_path), f"{jobs[0].job_id}.json"))
+
+def test_expired_records_are_dropped_on_start(tmp_path):
+    job = Job("old", "analysis", "Fund A")
+    job.status = "done"
+    record = job.to_dict()
+    record["updated_at"] = "2000-01-01T00:00:00"
+    with open(os.path.join(str(tmp_path), "old.json"), "w", encoding="utf-8") as f:
+        json.dump(record, f)
+
+    runner = JobRunner(store_dir=str(tmp_path), retention_hours=1)
+    assert runner.get("old") is None
+    assert not os.path.exists(os.path.join(str(tmp_path), "old.json"))
@@ -0,0 +1,97 @@
+import mmap
+import os
+import time
+
+from wybeai.letters import LetterStore, PromptContent, letter_text
+
+class Bucket:
+    def __init__(self, letters):
+        self.letters = dict(letters)
+        self.fetches = []
+
+    def fetcher(self, file_name):
+        def fetch():
+            self.fetches.append(file_name)
+            return self.letters[file_name]
+        return fetch
+
+def test_letters_are_served_from_memory():
+    bucket = Bucket({"a.txt": b"first letter"})
+    store = LetterStore(max_bytes=1024)
+
+    assert store.get("hedgefunds", "a.txt", bucket.fetcher("a.txt")) == b"first letter"
+    assert store.get("hedgefunds", "a.txt", bucket.fetcher("a.txt")) == b"first letter"
+    assert bucket.fetches == ["a.txt"]
+    assert store.stats()["hits"] == 1
+
+def test_invalidate_drops_the_memory_copy():
+    bucket = Bucket({"a.txt": b"first letter"})
+    store = LetterStore(max_bytes=1024)
+    store.get("hedgefunds", "a.txt", bucket.fetcher("a.txt"))
+
+    bucket.letters["a.txt"] = b"uploaded again"
+    store.invalidate("hedgefunds", "a.txt")
+
+    assert store.get("hedgefunds", "a.txt", bucket.fetcher("a.txt")) == b"uploaded again"
+    assert store.stats()["resident_bytes"] == len(b"uploaded again")
+
+def test_invalidate_removes_the_mirror_file(tmp_path):
+    bucket = Bucket({"a.txt": b"first letter"})
+    store = LetterStore(max_bytes=1024, mirror_dir=str(tmp_path))
+    letter = store.get("hedgefunds", "a.txt", bucket.fetcher("a.txt"))
+    assert isinstance(letter, mmap.mmap)
+    assert letter_text(letter) == "first letter"
+
+    store.invalidate("hedgefunds", "a.txt")
+    assert not os.path.exists(store.mirror_path("hedgefunds", "a.txt"))
+
+def test_another_workers_upload_is_noticed(tmp_path):
+    bucket = Bucket({"a.txt": b"first letter"})
+    reader = LetterStore(max_bytes=1024, mirror_dir=str(tmp_path))
+    uploader = LetterStore(max_bytes=1024, mirror_dir=str(tmp_path))
+    assert letter_text(reader.get("hedgefunds", "a.txt", bucket.fetcher("a.txt"))) == "first letter"
+
+    time.sleep(0.01)
+    bucket.letters["a.txt"] = b"uploaded again"
+    uploader.invalidate("hedgefunds", "a.txt")
+    uploader.get("hedgefunds", "a.txt", bucket.fetcher("a.txt"))
+
+    assert letter_text(reader.get("hedgefunds", "a.txt", bucket.fetcher("a.txt"))) == "uploaded again"
+
+def test_least_recently_used_letters_are_evicted():
+    bucket = Bucket({"a.txt": b"a" * 400, "b.txt": b"b" * 400, "c.txt": b"c" * 400})
+    store = LetterStore(max_bytes=1000)
+    store.get("hedgefunds", "a.txt", bucket.fetcher("a.txt"))
+    store.get("hedgefunds", "b.txt", bucket.fetcher("b.txt"))
+    store.get("hedgefunds", "a.txt", bucket.fetcher("a.txt"))
+    store.get("hedgefunds", "c.txt", bucket.fetcher("c.txt"))
+
+    assert list(store.entries) == [("hedgefunds", "a.txt"), ("hedgefunds", "c.txt")]
+    assert store.stats()["evictions"] == 1
+
+def test_prompt_content_keeps_letters_apart_and_keys_them_by_etag(tmp_path):
+    bucket = Bucket({"a.txt": b"first letter"})
+    mapped = LetterStore(max_bytes=1024, mirror_dir=str(tmp_path)).get("hedgefunds", "a.txt", bucket.fetcher("a.txt"))
+
+    content = PromptContent()
+    content.add_letter("alpha_2024_q1", mapped)
+    content.add_letter("alpha_2024_q2", "second letter")
+    assert content.parts == ["<alpha_2024_q1>\nfirst letter\n</alpha_2024_q1>", "<alpha_2024_q2>\nsecond letter\n</alpha_2024_q2>"]
+    assert len(content) == 2
+
+    # The same body identifies the same way whether it is mapped, bytes or text
+    same = PromptContent()
+    same.add_letter("alpha_2024_q1", b"first letter")
+    same.add_letter("alpha_2024_q2", b"second letter")
+    assert same.identities == content.identities
+
+    edited = PromptContent()
+    edited.add_letter("alpha_2024_q1", b"first letter, edited")
+    assert edited.identities[0] != content.identities[0]
+
+def test_prompt_content_wraps_plain_text():
+    assert PromptContent.of("").parts == []
+    assert not PromptContent.of("")
+    insights = PromptContent.of("Fund A: +4%")
+    assert insights.parts == ["Fund A: +4%"]
+    assert PromptContent.of(insights) is insights
@@ -0,0 +1,44 @@
+import json
+
+from wybeai.mentions import MentionIndex, MentionIndexer, company_aliases
+
+COMPANIES = {
+    "Target Corporation": {"aliases": company_aliases("Target Corporation"), "ticker": "TGT"},
+    "Block, Inc.": {"aliases": company_aliases("Block, Inc."), "ticker": "SQ"},
+    "Meta Platforms, Inc.": {"aliases": company_aliases("Meta Platforms, Inc."), "ticker": "META"},
+    "ON Semiconductor": {"aliases": company_aliases("ON Semiconductor"), "ticker": "ON"},
+}
+
+def mentioned(text):
+    indexer = MentionIndexer(None)
+    return [company for company, _, _ in indexer.scan(indexer.automaton(COMPANIES), text)]
+
+def test_short_names_drop_suffixes_and_descriptors():
+    assert company_aliases("Meta Platforms, Inc.") == ["Meta", "Meta Platforms", "Meta Platforms, Inc."]
+    assert company_aliases("Cisco Systems") == ["Cisco", "Cisco Systems"]
+
+def test_common_nouns_are_not_mentions():
+    text = "We kept our target return and our price target, the building block of the portfolio is on track."
+    assert mentioned(text) == []
+
+def test_names_and_tickers_as_written_are_mentions():
+    text = "We added Target and trimmed Meta. Block (SQ) fell while ON and TGT rose. META Platforms reported."
+    assert mentioned(text) == ["Target Corporation", "Meta Platforms, Inc.", "Block, Inc.", "Block, Inc.", "ON Semiconductor", "Target Corporation", "Meta Platforms, Inc."]
+
+def test_names_inside_longer_words_are_not_mentions():
+    assert mentioned("Targeted buys and metadata blocks") == []
+
+def test_index_survives_a_round_trip_through_json():
+    indexer = MentionIndexer(None)
+    automaton = indexer.automaton(COMPANIES)
+    index = {"companies": COMPANIES, "letters": {
+        "a/cleaned/Alpha 2024 Q1.txt": {"fund": "Alpha", "quarter": "2024 Q1", "mentions": indexer.scan(automaton, "We added Target and Meta.")},
+        "a/cleaned/Alpha 2023 Q4.txt": {"fund": "Alpha", "quarter": "2023 Q4", "mentions": indexer.scan(automaton, "Target again.")},
+    }}
+    built = MentionIndex([index])
+    shared = MentionIndex.from_rows(json.loads(json.dumps(built.rows())))
+
+    assert shared.postings == built.postings
+    assert shared.letters == 2
+    assert shared.match("TGT") == ["Target Corporation"]
+    assert shared.counts(shared.mentions("Target Corporation")) == (["2023 Q4", "2024 Q1"], {"Alpha": [1, 1]})
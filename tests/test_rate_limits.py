@@ -0,0 +1,42 @@
+import pytest
+
+from wybeai.rate_limits import RateGovernor
+
+def test_acquire_caps_the_cost_at_the_bucket_capacity():
+    governor = RateGovernor(60, 1000)
+    assert governor.acquire("session", 5000) == 1000
+
+def test_settle_refunds_the_over_reservation():
+    governor = RateGovernor(60, 1000)
+    reserved = governor.acquire("session", 800)
+    assert governor.levels["tokens"] == pytest.approx(200, abs=5)
+
+    governor.settle(reserved, 100)
+    assert governor.levels["tokens"] == pytest.approx(900, abs=5)
+
+    # Using more than the estimate never takes extra from the bucket
+    governor.settle(100, 300)
+    assert governor.levels["tokens"] == pytest.approx(900, abs=5)
+
+def test_processes_sharing_the_state_file_share_the_budget(tmp_path):
+    state_path = str(tmp_path / "rate_state.db")
+    first = RateGovernor(60, 1000, state_path=state_path)
+    second = RateGovernor(60, 1000, state_path=state_path)
+
+    first.acquire("session", 900)
+    assert second.try_reserve({"requests": 1.0, "tokens": 900.0}) > 0
+
+    first.settle(900, 0)
+    assert second.try_reserve({"requests": 1.0, "tokens": 900.0}) == 0
+
+def test_failed_reservation_leaves_the_queue(monkeypatch):
+    governor = RateGovernor(60, 1000)
+
+    def fail(cost):
+        raise RuntimeError("state file locked")
+
+    monkeypatch.setattr(governor, "try_reserve", fail)
+    with pytest.raises(RuntimeError):
+        governor.acquire("session", 100)
+    assert governor.stats()["queue_depth"] == 0
+    assert governor.stats()["waiting_sessions"] == 0
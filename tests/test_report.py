@@ -0,0 +1,83 @@
+import threading
+
+from wybeai.registry import FundRegistry
+from wybeai.report import BulkReport
+
+class Analyst:
+    # Answers every piece except the ones listed in failing, which raise like an overloaded model, and the ones
+    # listed in unanswered, which come back with an error like a range without letters
+    def __init__(self, failing=(), unanswered=()):
+        self.fund_registry = FundRegistry()
+        for name in ("Alpha Partners, LP", "Beta Capital, LP"):
+            self.fund_registry.register("Hedge Funds", name, "2024 Q1")
+        self.failing = set(failing)
+        self.unanswered = set(unanswered)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def resolve_fund(self, fund):
+        return self.fund_registry.resolve(fund)
+
+    def quarter_range(self, quarters, start_quarter=None, end_quarter=None):
+        start_quarter = start_quarter or quarters[0]
+        end_quarter = end_quarter or quarters[-1]
+        return [quarter for quarter in quarters if start_quarter <= quarter <= end_quarter]
+
+    def analyze_fund(self, fund_id, option, start_quarter=None, end_quarter=None):
+        with self.lock:
+            self.calls.append((fund_id, option))
+        if (fund_id, option) in self.failing:
+            raise RuntimeError("model overloaded")
+        if (fund_id, option) in self.unanswered:
+            return {"answer": None, "error": "No letters or insights matched the selection."}
+        return {"answer": f"{option} for {fund_id}", "letters": ["2024 Q1"]}
+
+FUNDS = ["Alpha Partners", "Beta Capital"]
+ANALYSES = ["Key Contributors to Performance", "Portfolio Positioning and Adjustments"]
+
+def test_rerun_only_does_the_failed_pieces(tmp_path):
+    analyst = Analyst(failing={("betacapital", "Portfolio Positioning and Adjustments")})
+    first = BulkReport(analyst, FUNDS, ANALYSES, out_dir=str(tmp_path)).run()
+    assert first["pieces"] == 3
+    assert [failure["fund"] for failure in first["failures"]] == ["Beta Capital"]
+
+    analyst.failing.clear()
+    analyst.calls.clear()
+    second = BulkReport(analyst, FUNDS, ANALYSES, out_dir=str(tmp_path)).run()
+    assert second["report_id"] == first["report_id"]
+    assert second["resumed"] == 3
+    assert second["failures"] == []
+    assert analyst.calls == [("betacapital", "Portfolio Positioning and Adjustments")]
+
+    with open(second["markdown"], encoding="utf-8") as f:
+        markdown = f.read()
+    assert "Portfolio Positioning and Adjustments for betacapital" in markdown
+    assert "Not generated" not in markdown
+
+def test_different_settings_never_reuse_pieces(tmp_path):
+    analyst = Analyst()
+    first = BulkReport(analyst, FUNDS, ANALYSES, out_dir=str(tmp_path)).run()
+    other = BulkReport(analyst, FUNDS[:1], ANALYSES, out_dir=str(tmp_path)).run()
+    assert other["report_id"] != first["report_id"]
+    assert other["resumed"] == 0
+
+def test_error_answers_are_not_checkpointed(tmp_path):
+    analyst = Analyst(unanswered={("alphapartners", "Key Contributors to Performance")})
+    first = BulkReport(analyst, FUNDS, ANALYSES, out_dir=str(tmp_path)).run()
+    assert [failure["option"] for failure in first["failures"]] == ["Key Contributors to Performance"]
+
+    analyst.unanswered.clear()
+    analyst.calls.clear()
+    second = BulkReport(analyst, FUNDS, ANALYSES, out_dir=str(tmp_path)).run()
+    assert second["resumed"] == 3
+    assert analyst.calls == [("alphapartners", "Key Contributors to Performance")]
+
+def test_a_new_quarter_starts_a_new_report(tmp_path):
+    analyst = Analyst()
+    first = BulkReport(analyst, FUNDS, ANALYSES, out_dir=str(tmp_path)).run()
+    bounded = BulkReport(analyst, FUNDS, ANALYSES, end_quarter="2024 Q1", out_dir=str(tmp_path))
+    assert bounded.report_id == first["report_id"]
+
+    analyst.fund_registry.register("Hedge Funds", "Alpha Partners, LP", "2024 Q2")
+    assert BulkReport(analyst, FUNDS, ANALYSES, out_dir=str(tmp_path)).report_id != first["report_id"]
+    assert BulkReport(analyst, FUNDS, ANALYSES, end_quarter="2024 Q1", out_dir=str(tmp_path)).report_id == first["report_id"]
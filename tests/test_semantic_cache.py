@@ -0,0 +1,44 @@
+import pytest
+
+from wybeai.semantic_cache import SemanticAnswerCache, normalize_question
+
+def cache_with(question, answer="stored answer"):
+    cache = SemanticAnswerCache()
+    for other in ("What is the outlook for rates?", "Which sectors did well?", "How much cash do they hold?"):
+        cache.store("scope", other, "other answer")
+    cache.store("scope", question, answer)
+    return cache
+
+def test_rephrasings_of_the_same_question_hit():
+    cache = cache_with("Which positions were exited this quarter?")
+    hit = cache.lookup("scope", "What positions did they exit this quarter?")
+    assert hit["answer"] == "stored answer"
+    assert hit["similarity"] >= cache.threshold
+
+    assert cache_with("What are the top holdings?").lookup("scope", "Which are their top holdings?")["similarity"] == 1.0
+
+@pytest.mark.parametrize("stored, asked", [
+    ("Which positions were exited this quarter?", "Which positions were added this quarter?"),
+    ("What do they say about inflation in Europe?", "What do they say about inflation in the US?"),
+    ("Did they increase exposure to energy?", "Did they decrease exposure to energy?"),
+    ("How is the portfolio positioned for rising rates?", "How is the portfolio positioned for falling rates?"),
+    ("What were the main detractors in Q1?", "What were the main detractors in Q2?"),
+])
+def test_near_duplicates_with_a_different_meaning_miss(stored, asked):
+    assert cache_with(stored).lookup("scope", asked) is None
+
+def test_pronouns_that_carry_meaning_are_kept():
+    assert normalize_question("What about inflation in the US?") == "inflation us"
+    assert normalize_question("How did it perform?") == "it perform"
+
+def test_answers_never_cross_scopes():
+    cache = cache_with("Which positions were exited this quarter?")
+    assert cache.lookup("other scope", "Which positions were exited this quarter?") is None
+
+def test_forgotten_entries_release_their_document_frequency():
+    cache = SemanticAnswerCache(max_entries=2)
+    for question in ("What is the outlook for rates?", "Which sectors did well?", "How much cash do they hold?"):
+        cache.store("scope", question, "answer")
+    assert cache.stats()["entries"] == 2
+    assert cache.lookup("scope", "What is the outlook for rates?") is None
+    assert cache.document_frequency.sum() == sum(len(entry["counts"]) for entry in cache.entries.values())
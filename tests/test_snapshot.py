@@ -0,0 +1,107 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from wybeai.insights import InsightStore
+from wybeai.registry import FundRegistry
+from wybeai.snapshot import TableSnapshot
+
+PERFORMANCE = [{"Fund Name": "Alpha Partners, LP", "Date": "2024 Q1", "Quarterly Performance Net of Fees": 4.2}]
+
+def build_stores(fake_aws):
+    fund_registry = FundRegistry()
+    fund_registry.register("Hedge Funds", "Alpha Partners, LP", "2024 Q1")
+    insight_store = InsightStore(fake_aws, fund_registry)
+    with insight_store.lock:
+        insight_store.load_source("performance", "hedgefunds", "hedgefund_performance_insights.json", None, json.dumps(PERFORMANCE), "etag-1")
+    return fund_registry, insight_store
+
+def generations(directory):
+    return sorted(name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name)))
+
+def test_write_publishes_a_generation_a_restarted_worker_can_map(tmp_path, fake_aws):
+    fund_registry, insight_store = build_stores(fake_aws)
+    written = TableSnapshot(str(tmp_path)).write(fake_aws, fund_registry, insight_store)
+    assert written["rows"]["performance"] == 1
+
+    snapshot = TableSnapshot(str(tmp_path))
+    restored_registry = snapshot.restore_registry()
+    assert restored_registry.resolve("Alpha Partners").quarters == ["2024 Q1"]
+
+    restored_store = InsightStore(fake_aws, restored_registry)
+    assert snapshot.restore_insights(restored_store)
+    rows = restored_store.query("SELECT fund_id, net_return FROM performance")
+    assert [(row["fund_id"], row["net_return"]) for row in rows] == [("alphapartners", 4.2)]
+    assert restored_store.etags["hedgefunds/hedgefund_performance_insights.json"] == "etag-1"
+
+def test_older_generations_are_pruned(tmp_path, fake_aws):
+    fund_registry, insight_store = build_stores(fake_aws)
+    snapshot = TableSnapshot(str(tmp_path))
+    for _ in range(3):
+        snapshot.write(fake_aws, fund_registry, insight_store)
+
+    with open(os.path.join(str(tmp_path), "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    remaining = generations(str(tmp_path))
+    assert len(remaining) == 2
+    assert manifest["generation"] in remaining
+
+def test_snapshot_for_another_layout_is_ignored(tmp_path, fake_aws):
+    fund_registry, insight_store = build_stores(fake_aws)
+    TableSnapshot(str(tmp_path)).write(fake_aws, fund_registry, insight_store)
+
+    path = os.path.join(str(tmp_path), "manifest.json")
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest["layout"] = "older"
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+
+    assert TableSnapshot(str(tmp_path)).read() is None
+
+def put_registry_files(fake_aws):
+    fake_aws.put("hedgefunds", "hedgefund_general_insights.json", json.dumps([{"Fund Name": "Alpha Partners, LP", "Date": "2024 Q1"}]))
+    fake_aws.put("venturecapitalfunds", "vc_performance_insights.json", json.dumps([{"Fund Name": "Seed Ventures", "Date": "2024 Q1"}]))
+    fake_aws.put("hedgefunds", "hedgefund_performance_insights.json", json.dumps(PERFORMANCE))
+
+def test_restart_revalidates_against_the_etags_that_were_read(tmp_path, fake_aws):
+    put_registry_files(fake_aws)
+    fund_registry = FundRegistry().load(fake_aws)
+    insight_store = InsightStore(fake_aws, fund_registry).refresh(force=True)
+    TableSnapshot(str(tmp_path)).write(fake_aws, fund_registry, insight_store)
+
+    with open(os.path.join(str(tmp_path), "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    assert manifest["registry_sources"]["hedgefunds/hedgefund_general_insights.json"] == fake_aws.objects[("hedgefunds", "hedgefund_general_insights.json")][1]
+    assert manifest["registry_sources"]["hedgefunds/uploaded_letters.json"] is None
+
+    # Nothing changed in the buckets, so the restarted worker neither reloads nor writes a new generation
+    snapshot = TableSnapshot(str(tmp_path))
+    restored_registry = snapshot.restore_registry()
+    restored_store = InsightStore(fake_aws, restored_registry)
+    snapshot.restore_insights(restored_store)
+    snapshot.validate(fake_aws, restored_registry, restored_store)
+    assert generations(str(tmp_path)) == [manifest["generation"]]
+
+    fake_aws.put("hedgefunds", "hedgefund_general_insights.json", json.dumps([{"Fund Name": "Alpha Partners, LP", "Date": "2024 Q1"}, {"Fund Name": "Gamma Fund", "Date": "2024 Q2"}]))
+    snapshot.validate(fake_aws, restored_registry, restored_store)
+    assert restored_registry.resolve("Gamma Fund") is not None
+    assert len(generations(str(tmp_path))) == 2
+
+def test_registry_reload_leaves_the_published_tables_untouched(fake_aws):
+    put_registry_files(fake_aws)
+    fund_registry = FundRegistry().load(fake_aws)
+    funds, aliases = fund_registry.funds, fund_registry.aliases
+    published = dict(funds)
+
+    fake_aws.put("hedgefunds", "hedgefund_general_insights.json", json.dumps([{"Fund Name": "Gamma Fund", "Date": "2024 Q2"}]))
+    fund_registry.load(fake_aws)
+    fund_registry.register("Hedge Funds", "Delta Fund", "2024 Q3")
+
+    # Threads still iterating the earlier tables never see them change size
+    assert funds == published
+    assert "deltafund" not in aliases
+    assert set(fund_registry.fund_names("Hedge Funds")) == {"Alpha Partners", "Gamma Fund", "Delta Fund"}
@@ -6,11 +6,45 @@ import pandas as pd
 import boto3
 import botocore
 import os
+import sys
+import argparse
 import anthropic
 from datetime import datetime, timedelta
 import json
 import numpy as np
 import re
+import io
+import threading
+import hashlib
+import hmac
+import time
+import warnings
+import bisect
+import difflib
+from collections import Counter
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+from wybeai.caching import SHARED_CACHE_SCHEMA, SharedCache, S3LatencyGuard, SingleFlight
+from wybeai.semantic_cache import SemanticAnswerCache
+from wybeai.storage import LocalS3
+from wybeai.jobs import JobRunner
+from wybeai.routing import estimate_tokens, ModelRouter
+from wybeai.rate_limits import RateGovernor
+from wybeai.letters import LetterStore, PromptContent, letter_text
+from wybeai.registry import FUND_SOURCES, FundRecord, UPLOADED_LETTERS_CATALOG, COMPACTION_REPORT, FundRegistry
+from wybeai.insights import INSIGHT_TABLES, InsightStore
+from wybeai.snapshot import TableSnapshot
+from wybeai.mentions import MENTION_INDEX, MentionIndexer, MentionIndex
+from wybeai.report import BulkReport
 
 # Set AWS credentials and region
 os.environ["AWS_ACCESS_KEY_ID"] = "AWS"
@@ -23,55 +57,432 @@ boto3.setup_default_session(aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
                             region_name=os.getenv('REGION_NAME'))
 
 ANTHROPIC_API_KEY = "API"
-CLAUDE_HAIKU = "claude-3-haiku-20240307"
-CLAUDE_SONNET = "claude-3-sonnet-20240229"
+
+# Large uploads are split into parts that are sent concurrently
+UPLOAD_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=4,
+    use_threads=True
+)
+
+@st.cache_resource
+def get_shared_cache():
+    # Set WYBEAI_SHARED_CACHE to an empty string to give every process its own fetches again
+    path = os.getenv("WYBEAI_SHARED_CACHE", ".wybeai/shared_cache.db")
+    if not path:
+        return None
+    return SharedCache(path, max_bytes=int(os.getenv("WYBEAI_SHARED_CACHE_MB", "512")) * 1024 * 1024)
+
+# Explicit timeouts and adaptive retries, so one slow GET can't hold a page for the SDK's default minute
+S3_CLIENT_CONFIG = Config(
+    connect_timeout=float(os.getenv("WYBEAI_S3_CONNECT_TIMEOUT", "3")),
+    read_timeout=float(os.getenv("WYBEAI_S3_READ_TIMEOUT", "10")),
+    retries={"max_attempts": int(os.getenv("WYBEAI_S3_MAX_ATTEMPTS", "4")), "mode": "adaptive"},
+    max_pool_connections=32
+)
+
+@st.cache_resource
+def get_s3_latency_guard():
+    return S3LatencyGuard(
+        hedge=os.getenv("WYBEAI_S3_HEDGE", "0") == "1",
+        hedge_min_delay=float(os.getenv("WYBEAI_S3_HEDGE_MIN_DELAY", "0.2")),
+        stale_timeout=float(os.getenv("WYBEAI_S3_STALE_TIMEOUT", "2"))
+    )
+
+@st.cache_resource
+def get_single_flight():
+    # One per server process, so every session's identical requests meet in the same table
+    return SingleFlight()
+
+@st.cache_resource
+def get_semantic_cache():
+    # Shared by every session, so one user's answer serves another's rephrasing of the same question
+    threshold = float(os.environ.get("WYBEAI_SEMANTIC_THRESHOLD", "0.8"))
+    max_entries = int(os.environ.get("WYBEAI_SEMANTIC_CACHE_SIZE", "5000"))
+    return SemanticAnswerCache(threshold, max_entries)
+
+@st.cache_resource
+def get_update_lock(name):
+    # Shared objects rewritten by read-modify-write get one lock per name for the whole process, every rerun and session included
+    return threading.Lock()
 
 class AWSOperations:
-    def __init__(self):
-        self.s3 = boto3.client('s3')
+    def __init__(self, shared_cache=None, object_ttl=300, single_flight=None, latency_guard=None, s3_client=None, letter_store=None):
+        # WYBEAI_LOCAL_STORAGE points the whole app at a local directory instead of S3
+        local_storage = os.getenv("WYBEAI_LOCAL_STORAGE")
+        self.s3 = s3_client or (LocalS3(local_storage) if local_storage else boto3.client('s3', config=S3_CLIENT_CONFIG))
+        self.shared_cache = shared_cache
+        self.object_ttl = object_ttl
+        self.single_flight = single_flight
+        self.latency_guard = latency_guard or get_s3_latency_guard()
+        self.letter_store = letter_store or get_letter_store()
 
     def fetch_object(self, file_name, bucket_name):
-        obj = self.s3.get_object(Bucket=bucket_name, Key=file_name)
-        return obj['Body'].read().decode('utf-8')
+        return self.fetch_bytes(file_name, bucket_name).decode('utf-8')
+
+    def fetch_bytes(self, file_name, bucket_name):
+        if self.single_flight:
+            return self.single_flight.do(("s3", bucket_name, file_name), lambda: self.load_bytes(file_name, bucket_name))
+        return self.load_bytes(file_name, bucket_name)
+
+    def get_object(self, file_name, bucket_name, etag=None):
+        # Returns (body, etag), or (None, etag) when the object still matches the given ETag
+        def request():
+            try:
+                if etag:
+                    obj = self.s3.get_object(Bucket=bucket_name, Key=file_name, IfNoneMatch=etag)
+                else:
+                    obj = self.s3.get_object(Bucket=bucket_name, Key=file_name)
+            except botocore.exceptions.ClientError as e:
+                if etag and e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 304:
+                    return None, etag
+                raise e
+            return obj['Body'].read(), obj.get('ETag', '')
+        return self.latency_guard.get(request)
+
+    def load_bytes(self, file_name, bucket_name):
+        if not self.shared_cache:
+            return self.get_object(file_name, bucket_name)[0]
+
+        cache_key = f"{bucket_name}/{file_name}"
+        entry = self.shared_cache.get("objects", cache_key)
+        if entry and time.time() - entry[2] < self.object_ttl:
+            return entry[0]
+        if entry:
+            return self.latency_guard.revalidate(lambda: self.revalidate(file_name, bucket_name, entry), entry[0], cache_key)
+
+        body, etag = self.get_object(file_name, bucket_name)
+        self.shared_cache.put("objects", cache_key, body, etag)
+        return body
+
+    def revalidate(self, file_name, bucket_name, entry):
+        # Once an entry is stale, a conditional GET only transfers the body if the ETag changed
+        cache_key = f"{bucket_name}/{file_name}"
+        body, etag = self.get_object(file_name, bucket_name, entry[1])
+        if body is None:
+            self.shared_cache.touch("objects", cache_key)
+            return entry[0]
+        self.shared_cache.put("objects", cache_key, body, etag)
+        return body
+
+    def fetch_versioned(self, file_name, bucket_name):
+        # The text together with the ETag of the body that was read, snapshots revalidate against it later
+        if not self.shared_cache:
+            request = lambda: self.get_object(file_name, bucket_name)
+            body, etag = self.single_flight.do(("s3-versioned", bucket_name, file_name), request) if self.single_flight else request()
+            return body.decode('utf-8'), etag
+
+        body = self.fetch_bytes(file_name, bucket_name)
+        row = self.shared_cache.version("objects", f"{bucket_name}/{file_name}")
+        return body.decode('utf-8'), row[0] if row else None
+
+    def fresh_version(self, file_name, bucket_name):
+        # The ETag of a cached object that is still within its freshness window, otherwise None
+        if not self.shared_cache:
+            return None
+        row = self.shared_cache.version("objects", f"{bucket_name}/{file_name}")
+        if row and time.time() - row[1] < self.object_ttl:
+            return row[0]
+        return None
+
+    def upload_object(self, fileobj, file_name, bucket_name, content_type=None, progress_callback=None):
+        # Stream the file object to S3, multipart uploads kick in above the threshold
+        extra_args = {"ContentType": content_type} if content_type else None
+        fileobj.seek(0)
+        self.s3.upload_fileobj(fileobj, bucket_name, file_name, ExtraArgs=extra_args, Callback=progress_callback, Config=UPLOAD_TRANSFER_CONFIG)
+
+        # Other workers must not keep serving the previous body
+        if self.shared_cache:
+            self.shared_cache.invalidate("objects", f"{bucket_name}/{file_name}")
+        self.letter_store.invalidate(bucket_name, file_name)
+
+    def list_objects(self, bucket_name, prefix=""):
+        # Every (key, etag) under the prefix, following continuation tokens past the 1000 key page size
+        objects = []
+        token = None
+        while True:
+            if token:
+                page = self.s3.list_objects_v2(Bucket=bucket_name, Prefix=prefix, ContinuationToken=token)
+            else:
+                page = self.s3.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
+            objects.extend((item["Key"], item.get("ETag", "")) for item in page.get("Contents", []))
+            if not page.get("IsTruncated"):
+                return objects
+            token = page["NextContinuationToken"]
+
+def load_shared_table(aws_operations, name, sources, build):
+    # Derived tables are shared between workers as the JSON rows build returns, tagged with the ETags of the
+    # objects they were built from. Nothing executable is ever read back from the host-shared file
+    cache = aws_operations.shared_cache
+    if not cache:
+        return build()
+
+    def sources_version():
+        versions = [aws_operations.fresh_version(file_name, bucket_name) for bucket_name, file_name in sources]
+        if not all(versions):
+            return None
+        return hashlib.sha256(json.dumps([SHARED_CACHE_SCHEMA] + versions).encode("utf-8")).hexdigest()
+
+    version = sources_version()
+    entry = cache.get("tables", name, version) if version else None
+    if entry:
+        try:
+            return json.loads(entry[0])
+        except ValueError as e:
+            print(f"Discarding unreadable cache entry: tables {name}")
+            print(f"Error: {str(e)}")
+
+    # Building fetches the sources, which refreshes their ETags
+    table = build()
+    version = sources_version()
+    if version:
+        cache.put("tables", name, json.dumps(table).encode("utf-8"), version)
+    return table
+
+@st.cache_resource
+def get_job_runner():
+    # One worker pool per server process, shared by all sessions
+    return JobRunner(max_workers=int(os.getenv("WYBEAI_JOB_WORKERS", "4")), store_dir=os.getenv("WYBEAI_JOB_DIR", ".wybeai/jobs"))
+
+def display_analysis_job(job_runner, session_key, rate_governor=None):
+    # Show the analysis this session last submitted, it keeps running across reruns
+    job_id = st.session_state.get(session_key)
+    job = job_runner.get(job_id) if job_id else None
+    if job is None:
+        return
+
+    st.caption(job.label)
+    if job.is_active():
+        @st.fragment(run_every=2)
+        def poll_job():
+            if job_runner.get(job_id).is_active():
+                st.info("The analysis is running in the background. You can keep browsing, the answer will appear here when it is ready.")
+                if rate_governor:
+                    stats = rate_governor.stats()
+                    st.caption(f"Model queue: {stats['queue_depth']} request(s) from {stats['waiting_sessions']} session(s) waiting, average wait {stats['average_wait']:.1f}s")
+            else:
+                st.rerun()
+
+        poll_job()
+    elif job.status == "failed":
+        st.error(f"The analysis failed: {job.error}")
+    else:
+        st.write(job.result)
+
+def display_previous_analyses(job_runner):
+    # Only the analyses this session asked for, other users' questions and answers stay private
+    completed_jobs = [job for job in job_runner.list_jobs("analysis", get_session_id()) if job.status == "done"]
+    if not completed_jobs:
+        return
+
+    # Streamlit deep-copies widget options, so offer the ids rather than the jobs and their locks
+    jobs_by_id = {job.job_id: job for job in completed_jobs}
+    with st.expander("Previous analyses"):
+        job_id = st.selectbox(
+            "Select a previous analysis",
+            list(jobs_by_id),
+            format_func=lambda job_id: f"{jobs_by_id[job_id].updated_at:%Y-%m-%d %H:%M} - {jobs_by_id[job_id].label}",
+            key="previous_analysis"
+        )
+        st.write(jobs_by_id[job_id].result)
+
+# Input ceiling per request, comfortably inside the context window and what one request should cost
+INPUT_TOKEN_BUDGET = int(os.getenv("WYBEAI_INPUT_TOKEN_BUDGET", "150000"))
+
+FOCUS_STOPWORDS = {"what", "which", "when", "where", "does", "about", "their", "they", "this", "that", "with", "from", "have", "were", "fund", "funds", "quarter", "letter", "letters", "please", "provide"}
+
+def focus_terms(text):
+    return {word for word in re.findall(r"[a-z0-9]+", text.lower()) if len(word) > 3 and word not in FOCUS_STOPWORDS}
+
+def letter_sections(letter, target_tokens=200):
+    # Paragraphs, with long ones broken at sentence ends, so trimming can take a little at a time
+    sections = []
+    for paragraph in re.split(r"\n\s*\n", letter):
+        current = ""
+        for sentence in re.split(r"(?<=[.!?])\s+", paragraph.strip()):
+            if current and estimate_tokens(current) + estimate_tokens(sentence) > target_tokens:
+                sections.append(current)
+                current = sentence
+            else:
+                current = f"{current} {sentence}" if current else sentence
+        if current:
+            sections.append(current)
+    return sections
+
+def display_context_cuts(cuts, budget):
+    if not cuts:
+        return
+    st.warning(f"The selection was trimmed to fit the {budget:,} token input budget:")
+    for cut in cuts:
+        if cut["sections"] is None:
+            st.write(f"- Left out {cut['letter']} (about {cut['tokens']:,} tokens)")
+        else:
+            st.write(f"- Dropped {cut['sections']} least relevant passages from {cut['letter']} (about {cut['tokens']:,} tokens)")
+
+def display_cached_answer(cached):
+    if not cached:
+        return
+    asked_at = datetime.fromtimestamp(cached["stored_at"]).strftime("%Y-%m-%d %H:%M")
+    st.info(f"Answered from an earlier question asked at {asked_at} (similarity {cached['similarity']:.2f}): \"{cached['question']}\". Tick \"Generate a fresh answer\" to ask the model again.")
+    st.write(cached["answer"])
+
+def get_session_id():
+    # Worker threads have no script context, so capture this before handing work off
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else "default"
+
+@st.cache_resource
+def get_rate_governor():
+    return RateGovernor(
+        requests_per_minute=int(os.getenv("WYBEAI_MODEL_RPM", "50")),
+        tokens_per_minute=int(os.getenv("WYBEAI_MODEL_TPM", "100000")),
+        state_path=os.getenv("WYBEAI_RATE_STATE")
+    )
+
+@st.cache_resource
+def get_model_router():
+    return ModelRouter(
+        target=os.getenv("WYBEAI_ROUTING_TARGET", "balanced"),
+        latency_target=float(os.getenv("WYBEAI_LATENCY_TARGET", "45")),
+        cost_target=float(os.getenv("WYBEAI_COST_TARGET", "0.10"))
+    )
 
 class AIResponseGenerator:
-    def __init__(self, api_key):
+    def __init__(self, api_key, fund_registry, rate_governor, model_router, shared_cache=None, single_flight=None, input_token_budget=INPUT_TOKEN_BUDGET, model_client=None):
         self.api_key = api_key
-
-    def generate_response(self, prompt, system_prompt, partner_letters, fund_names_dates):
-        client = anthropic.Anthropic(api_key=self.api_key)
-        
-        # Create XML tags for each document
-        tagged_letters = []
+        self.model_client = model_client
+        self.shared_cache = shared_cache
+        self.single_flight = single_flight
+        self.fund_registry = fund_registry
+        self.rate_governor = rate_governor
+        self.model_router = model_router
+        self.input_token_budget = input_token_budget
+
+    def tag_letters(self, partner_letters, fund_names_dates):
+        # Each letter goes between its XML tags as its own content part, they are never joined into one prompt string
+        content = PromptContent()
         for letter, fund_name_date in zip(partner_letters, fund_names_dates):
-            fund_name, date = fund_name_date.lower().split(" ", 1)
-            fund_name = fund_name.replace(" ", "")
-            quarter = date.split(" ")[0].lower()
-            year = date.split(" ")[1]
-            tag = f"<{fund_name}_{year}_{quarter}>"
-            tagged_letter = f"{tag}\n{letter}\n</{fund_name}_{year}_{quarter}>"
-            tagged_letters.append(tagged_letter)
-        
-        combined_letters = "\n\n".join(tagged_letters)
-        
-        message = client.messages.create(
-            model=CLAUDE_HAIKU,
-            max_tokens=2000,
-            temperature=0.2,
-            system=system_prompt,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": f"{combined_letters}\n\n{prompt}"
-                        }
-                    ]
-                }
-            ]
-        )
+            record, quarter = self.fund_registry.resolve_letter(fund_name_date)
+            content.add_letter(record.letter_tag(quarter), letter)
+        return content
+
+    def prepare_letters(self, prompt, system_prompt, partner_letters, fund_names_dates, focus=None, policy="oldest"):
+        # Returns the tagged letters, the letters that made it in and what had to be cut to fit the budget
+        partner_letters, fund_names_dates, cuts = self.fit_letters(prompt, system_prompt, partner_letters, fund_names_dates, focus, policy)
+        return self.tag_letters(partner_letters, fund_names_dates), fund_names_dates, cuts
+
+    def fit_letters(self, prompt, system_prompt, partner_letters, fund_names_dates, focus=None, policy="oldest"):
+        # Every letter costs its text plus the two XML tags around it
+        overhead = estimate_tokens(system_prompt) + estimate_tokens(prompt)
+        sizes = [estimate_tokens(letter) + 20 for letter in partner_letters]
+        excess = overhead + sum(sizes) - self.input_token_budget
+        if excess <= 0:
+            return list(partner_letters), list(fund_names_dates), []
+
+        letters = [letter_text(letter) for letter in partner_letters]
+        names = list(fund_names_dates)
+        quarters = [self.fund_registry.resolve_letter(name)[1] for name in names]
+        cuts = []
+
+        # Time series analyses lose their oldest quarters first, as long as one letter is left to work with
+        if policy == "oldest":
+            dropped = set()
+            for i in sorted(range(len(names)), key=lambda i: quarters[i])[:-1]:
+                if excess <= 0:
+                    break
+                dropped.add(i)
+                excess -= sizes[i]
+                cuts.append({"letter": names[i], "sections": None, "tokens": sizes[i]})
+            letters, names, quarters = ([values[i] for i in range(len(values)) if i not in dropped] for values in (letters, names, quarters))
+
+        # Then the passages that least mention the question or themes go, older quarters before newer ones on ties
+        if excess > 0:
+            terms = focus_terms(focus or prompt)
+            sections = [letter_sections(letter) for letter in letters]
+            ranked = []
+            for i, parts in enumerate(sections):
+                for j, part in enumerate(parts):
+                    tokens = estimate_tokens(part)
+                    hits = sum(1 for word in re.findall(r"[a-z0-9]+", part.lower()) if word in terms)
+                    ranked.append((hits / max(tokens, 50), quarters[i], -j, i, j, tokens))
+
+            dropped = {}
+            for _, _, _, i, j, tokens in sorted(ranked):
+                if excess <= 0:
+                    break
+                dropped.setdefault(i, {})[j] = tokens
+                excess -= tokens
+            for i, removed in sorted(dropped.items()):
+                letters[i] = "\n\n".join(part for j, part in enumerate(sections[i]) if j not in removed)
+                cuts.append({"letter": names[i], "sections": len(removed), "tokens": sum(removed.values())})
+
+        print(f"Trimmed the letters to fit the {self.input_token_budget} token input budget: {cuts}")
+        return letters, names, cuts
+
+    def route(self, prompt, system_prompt, content, task):
+        input_tokens = estimate_tokens(system_prompt) + PromptContent.of(content).tokens + estimate_tokens(prompt)
+        return self.model_router.route(task, input_tokens, estimate_tokens(prompt))
+
+    def request_key(self, model, max_tokens, temperature, system_prompt, content, prompt):
+        # Letters count by their tag and ETag, so the key is a few hundred bytes however long the letters are
+        return hashlib.sha256(json.dumps([model, max_tokens, temperature, system_prompt, content.identities, prompt]).encode("utf-8")).hexdigest()
+
+    def create_answer(self, prompt, system_prompt, content, task="synthesis", temperature=0.2, session_id=None, route=None, fresh=False):
+        return self.create_message(prompt, system_prompt, content, task, temperature, session_id, route, fresh)["answer"]
+
+    def create_message(self, prompt, system_prompt, content, task="synthesis", temperature=0.2, session_id=None, route=None, fresh=False):
+        content = PromptContent.of(content)
+        model, max_tokens = route or self.route(prompt, system_prompt, content, task)
+
+        # An identical request answered by any worker on this host is reused instead of calling the model again,
+        # unless a fresh answer was asked for, in which case the new answer replaces the stored one
+        cache_key = self.request_key(model, max_tokens, temperature, system_prompt, content, prompt)
+        if self.shared_cache and not fresh:
+            entry = self.shared_cache.get("answers", cache_key, SHARED_CACHE_SCHEMA)
+            if entry:
+                return dict(json.loads(entry[0]), cached=True)
+
+        # An identical request already in flight in this process is waited on instead of sent again
+        session_id = session_id or get_session_id()
+        if self.single_flight:
+            return self.single_flight.do(("answer", cache_key), lambda: self.call_model(prompt, system_prompt, content, temperature, session_id, model, max_tokens, cache_key))
+        return self.call_model(prompt, system_prompt, content, temperature, session_id, model, max_tokens, cache_key)
+
+    def call_model(self, prompt, system_prompt, content, temperature, session_id, model, max_tokens, cache_key):
+        client = self.model_client or anthropic.Anthropic(api_key=self.api_key)
+
+        # Wait for room in the shared request and token budget before dispatching
+        estimated_input_tokens = estimate_tokens(system_prompt) + content.tokens + estimate_tokens(prompt)
+        if estimated_input_tokens > self.input_token_budget:
+            print(f"Sending about {estimated_input_tokens} input tokens, over the {self.input_token_budget} token input budget")
+        reserved_tokens = self.rate_governor.acquire(session_id, estimated_input_tokens + max_tokens)
+
+        started_at = time.time()
+        try:
+            message = client.messages.create(
+                model=model,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                system=system_prompt,
+                messages=[
+                    {
+                        "role": "user",
+                        # Every letter is its own text block, followed by the instructions
+                        "content": [{"type": "text", "text": part} for part in content.parts + [prompt]]
+                    }
+                ]
+            )
+        except Exception:
+            # A failed call returns its whole token reservation, the request itself stays counted
+            self.rate_governor.settle(reserved_tokens, 0)
+            raise
         
+        latency = time.time() - started_at
+        print(f"Tokens for {model}: estimated {estimated_input_tokens} input, used {message.usage.input_tokens} input and {message.usage.output_tokens} of {max_tokens} output")
+        self.model_router.record(model, latency, message.usage.input_tokens, message.usage.output_tokens)
+        self.rate_governor.settle(reserved_tokens, message.usage.input_tokens + message.usage.output_tokens)
+
         raw_text = message.content
         answer = raw_text[0].text
         
@@ -80,130 +491,524 @@ class AIResponseGenerator:
         if answer_match:
             answer = answer_match.group(1).strip()
         
-        st.write(answer)
+        result = {
+            "answer": answer,
+            "model": model,
+            "max_tokens": max_tokens,
+            "estimated_input_tokens": estimated_input_tokens,
+            "input_tokens": message.usage.input_tokens,
+            "output_tokens": message.usage.output_tokens,
+            "latency": round(latency, 2),
+        }
+        if self.shared_cache:
+            self.shared_cache.put("answers", cache_key, json.dumps(result).encode("utf-8"), SHARED_CACHE_SCHEMA)
+        return result
+
+    def run_analysis(self, job, prompt, system_prompt, content, task, temperature, session_id, route, fresh=False, on_answer=None):
+        job.update(message=f"Waiting for {route[0]}")
+        answer = self.create_answer(prompt, system_prompt, content, task, temperature, session_id, route, fresh)
+        if on_answer:
+            on_answer(answer)
+        return answer
+
+    def submit_analysis(self, job_runner, label, prompt, system_prompt, content, task="synthesis", temperature=0.2, fresh=False, on_answer=None):
+        # Route up front so the chosen model and budget are part of the job identity
+        content = PromptContent.of(content)
+        route = self.route(prompt, system_prompt, content, task)
+
+        # The job id is derived from the request key, so identical analyses from different users run once.
+        # A fresh request gets its own job so it is never folded into an earlier run
+        dedup_key = None if fresh else self.request_key(route[0], route[1], temperature, system_prompt, content, prompt)
+        session_id = get_session_id()
+        return job_runner.submit("analysis", label, self.run_analysis, prompt, system_prompt, content, task, temperature, session_id, route, fresh, on_answer, dedup_key=dedup_key, session_id=session_id)
+
+@st.cache_resource
+def get_letter_store():
+    return LetterStore(
+        max_bytes=int(os.getenv("WYBEAI_LETTER_STORE_MB", "256")) * 1024 * 1024,
+        mirror_dir=os.getenv("WYBEAI_LETTER_MIRROR") or None,
+        ttl=int(os.getenv("WYBEAI_LETTER_TTL", "3600"))
+    )
 
 class DocumentFetcher:
-    def __init__(self, aws_operations):
+    def __init__(self, aws_operations, fund_registry, letter_store=None):
         self.aws_operations = aws_operations
+        self.fund_registry = fund_registry
+        self.letter_store = letter_store
+
+    def fetch_letter(self, file_name, bucket):
+        if self.letter_store is None:
+            return self.aws_operations.fetch_object(file_name, bucket)
+        return self.letter_store.get(bucket, file_name, lambda: self.aws_operations.fetch_bytes(file_name, bucket))
 
     def fetch_partner_letters(self, fund_names_dates):
         partner_letters = []
         for fund_name_date in fund_names_dates:
-            parts = fund_name_date.split()
-            fund_name = " ".join(parts[:-2]).lower().replace(" ", "")
-            date = " ".join(parts[-2:])
-            file_name = f"{fund_name}/cleaned/{fund_name_date}.txt"
+            record, date = self.fund_registry.resolve_letter(fund_name_date)
+
+            # Skip letters the registry doesn't know about instead of issuing a GET that will fail
+            if record is None or date not in record.quarters:
+                print(f"No letter registered for: {fund_name_date}")
+                continue
+
+            file_name = record.preferred_letter_key(date)
             try:
-                letter_content = self.aws_operations.fetch_object(file_name, "hedgefunds")
+                letter_content = self.fetch_letter(file_name, record.bucket)
                 partner_letters.append(letter_content)
             except Exception as e:
                 print(f"File not found: {file_name}")
                 print(f"Error: {str(e)}")
         return partner_letters
 
-def fetch_fund_names(aws_operations, bucket_name, fund_info_path):
-    # Fetch the JSON file from S3
-    json_data = aws_operations.fetch_object(fund_info_path, bucket_name)
-    fund_info_data = json.loads(json_data)
+    def fetch_letter_pairs(self, fund_names_dates):
+        # Like fetch_partner_letters, but keeps each letter paired with its name when some are missing
+        pairs = []
+        for fund_name_date in fund_names_dates:
+            letters = self.fetch_partner_letters([fund_name_date])
+            if letters:
+                pairs.append((fund_name_date, letters[0]))
+        return pairs
+
+def split_paragraphs(text):
+    return [paragraph.strip() for paragraph in re.split(r"\n\s*\n", text) if paragraph.strip()]
+
+DELTA_MODE_NOTE = """
+            Only the first quarter of each fund is provided in full. Every later quarter only contains the paragraphs that are new or revised compared to the previous quarter, marked [New in ...] or [Revised in ...], plus [Dropped since ...] notes for paragraphs that no longer appear. Unchanged content was omitted and should be read as carried over from the previous quarter.
+            """
+
+class QuarterDeltaBuilder:
+    def normalize(self, paragraph):
+        return re.sub(r"\s+", " ", paragraph).strip().lower()
+
+    def summarize(self, paragraph, limit=200):
+        paragraph = re.sub(r"\s+", " ", paragraph).strip()
+        return paragraph if len(paragraph) <= limit else paragraph[:limit].rsplit(" ", 1)[0] + "..."
+
+    def build(self, entries):
+        # entries are (quarter, text) pairs for one fund in chronological order
+        deltas = []
+        previous_quarter = None
+        previous_paragraphs = []
+        previous_normalized = []
+        for quarter, text in entries:
+            paragraphs = split_paragraphs(text)
+            normalized = [self.normalize(paragraph) for paragraph in paragraphs]
+
+            if previous_quarter is None:
+                deltas.append((quarter, text))
+            else:
+                parts = [f"[Changes since {previous_quarter}]"]
+                unchanged = 0
+                matcher = difflib.SequenceMatcher(None, previous_normalized, normalized, autojunk=False)
+                for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+                    if tag == "equal":
+                        unchanged += j2 - j1
+                        continue
+                    # Replaced paragraphs pair up as revisions, any surplus on either side is new or dropped
+                    revised = min(i2 - i1, j2 - j1) if tag == "replace" else 0
+                    for offset, paragraph in enumerate(paragraphs[j1:j2]):
+                        parts.append(f"[{'Revised' if offset < revised else 'New'} in {quarter}]\n{paragraph}")
+                    for paragraph in previous_paragraphs[i1 + revised:i2]:
+                        parts.append(f"[Dropped since {previous_quarter}] {self.summarize(paragraph)}")
+                if unchanged:
+                    parts.append(f"[{unchanged} paragraph(s) unchanged from {previous_quarter} omitted]")
+                deltas.append((quarter, "\n\n".join(parts)))
+
+            previous_quarter = quarter
+            previous_paragraphs = paragraphs
+            previous_normalized = normalized
+        return deltas
+
+@st.cache_resource(ttl=3600, show_spinner=False)
+def load_fund_registry(_aws_operations):
+    # A fresh worker starts from the local snapshot, later reloads go to S3 as before
+    registry = get_table_snapshot().restore_registry()
+    return registry or FundRegistry().load(_aws_operations)
+
+@st.cache_resource(show_spinner=False)
+def get_insight_store(_aws_operations, _fund_registry):
+    snapshot = get_table_snapshot()
+    insight_store = InsightStore(_aws_operations, _fund_registry)
+    if snapshot.restore_insights(insight_store):
+        # Serve from the snapshot right away and check it against S3 behind the first requests
+        snapshot.start(snapshot.validate, _aws_operations, _fund_registry, insight_store)
+    else:
+        insight_store.refresh(force=True)
+        snapshot.start(snapshot.write, _aws_operations, _fund_registry, insight_store)
+    return insight_store
 
-    # Get unique fund names
-    fund_names = set(obj['Fund Name'].replace(", LP", "") for obj in fund_info_data)
+def load_insight_store(aws_operations, fund_registry):
+    # The store lives for the whole process, so every rerun hands it the registry currently loaded
+    return get_insight_store(aws_operations, fund_registry).use_registry(fund_registry)
 
-    return list(fund_names)
+@st.cache_resource
+def get_table_snapshot():
+    # One per server process, WYBEAI_SNAPSHOT_DIR should be on local disk so the files can be memory-mapped
+    return TableSnapshot(os.getenv("WYBEAI_SNAPSHOT_DIR", os.path.join(".wybeai", "snapshots")))
 
 # def select_funds(aws_operations, bucket_name, fund_info_path):
 #     fund_names = fetch_fund_names(aws_operations, bucket_name, fund_info_path)
 #     selected_funds = st.sidebar.multiselect("Select Funds", fund_names)
 #     return selected_funds
 
-class OpportunityScout:
-    def __init__(self, aws_operations, bucket_name):
-        self.aws_operations = aws_operations
-        self.bucket_name = bucket_name
-
-    def fetch_json_data(self, formatted_fund_name):
-        json_file_path = f"{formatted_fund_name}/{formatted_fund_name}_equities.json"
+class PaginatedResultGrid:
+    def __init__(self, key, page_sizes=(25, 50, 100, 250)):
+        self.key = key
+        self.page_sizes = list(page_sizes)
+
+    def get_columns(self, records, exclude=()):
+        # Collect the column names in order of first appearance without building a DataFrame
+        columns = []
+        seen = set(exclude)
+        for record in records:
+            for column in record:
+                if column not in seen:
+                    seen.add(column)
+                    columns.append(column)
+        return columns
+
+    def filter_indices(self, records, columns, query):
+        # Case-insensitive substring match over the displayed columns
+        if not query:
+            return list(range(len(records)))
+
+        query = query.lower()
+        return [
+            index for index, record in enumerate(records)
+            if any(query in str(record.get(column, '')).lower() for column in columns)
+        ]
 
+    def sort_key(self, value):
+        # Numbers sort before text, empty values always go last
+        if value is None or value == '':
+            return (2, 0, '')
         try:
-            json_data = self.aws_operations.fetch_object(json_file_path, self.bucket_name)
-            json_data = json.loads(json_data)
-            return json_data
-        except botocore.exceptions.ClientError as e:
-            if e.response['Error']['Code'] == 'NoSuchKey':
-                print(f"JSON file not found for fund: {formatted_fund_name}")
-                return None
+            return (0, float(str(value).rstrip('%').replace('$', '').replace(',', '')), '')
+        except ValueError:
+            return (1, 0, str(value).lower())
+
+    def sort_indices(self, records, indices, sort_column, descending):
+        if not sort_column:
+            return indices
+
+        keyed = [(self.sort_key(records[index].get(sort_column)), index) for index in indices]
+        # Keep empty values at the bottom regardless of the sort direction
+        filled = [item for item in keyed if item[0][0] != 2]
+        empty = [index for key, index in keyed if key[0] == 2]
+        filled.sort(key=lambda item: item[0], reverse=descending)
+        return [index for _, index in filled] + empty
+
+    def filter_frame(self, df, columns, query):
+        # Vectorized version of filter_indices for typed tables
+        if not query:
+            return df
+
+        mask = np.zeros(len(df), dtype=bool)
+        for column in columns:
+            values = df[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                # Match against the categories once and then compare codes
+                hits = np.flatnonzero(values.cat.categories.astype(str).str.contains(query, case=False, regex=False))
+                mask |= np.isin(values.cat.codes.to_numpy(), hits)
             else:
-                raise e
+                mask |= values.astype(str).str.contains(query, case=False, regex=False).to_numpy()
+        return df[mask]
+
+    def sort_frame(self, df, sort_column, descending):
+        if not sort_column:
+            return df
+        return df.sort_values(sort_column, ascending=not descending, na_position="last", kind="stable")
+
+    def render(self, records, columns, formatters=None, column_config=None):
+        formatters = formatters or {}
+        is_frame = isinstance(records, pd.DataFrame)
+
+        filter_col, sort_col, order_col, size_col = st.columns([3, 2, 1, 1])
+        query = filter_col.text_input("Filter rows", key=f"{self.key}_query")
+        sort_column = sort_col.selectbox("Sort by", [None] + columns, format_func=lambda x: "—" if x is None else x, key=f"{self.key}_sort")
+        descending = order_col.selectbox("Order", ["Ascending", "Descending"], key=f"{self.key}_order") == "Descending"
+        page_size = size_col.selectbox("Rows per page", self.page_sizes, key=f"{self.key}_page_size")
+
+        # Filter and sort row indices only, the records themselves are never copied
+        if is_frame:
+            indices = self.sort_frame(self.filter_frame(records, columns, query), sort_column, descending)
+        else:
+            indices = self.filter_indices(records, columns, query)
+            indices = self.sort_indices(records, indices, sort_column, descending)
 
-    def filter_companies(self, json_data, sectors, start_quarter, end_quarter, pitched, exited):
-        filtered_companies = []
+        total_rows = len(indices)
+        total_pages = max(1, (total_rows + page_size - 1) // page_size)
+        page_key = f"{self.key}_page"
+        if st.session_state.get(page_key, 1) > total_pages:
+            st.session_state[page_key] = total_pages
+        page = st.number_input(f"Page (of {total_pages})", min_value=1, max_value=total_pages, step=1, key=page_key)
 
-        for company in json_data:
+        start = (page - 1) * page_size
+        page_indices = indices.iloc[start:start + page_size] if is_frame else indices[start:start + page_size]
 
-            if sectors and company['Sector'] not in sectors:
-                continue
+        if total_rows:
+            st.write(f"Showing rows {start + 1}-{start + len(page_indices)} of {total_rows} matching ({len(records)} total)")
+        else:
+            st.write(f"No rows match the filter ({len(records)} total)")
+            return
 
-            pitch_quarter = company['Date']
+        if is_frame:
+            df = page_indices[columns].copy()
+            for column, formatter in formatters.items():
+                df[column] = df[column].map(formatter)
+            st.dataframe(df, column_config=column_config, use_container_width=True)
+            return
 
-            if start_quarter and end_quarter:
-                if pitch_quarter < start_quarter or pitch_quarter > end_quarter:
-                    continue
+        # Only the visible page is turned into a DataFrame and sent to the browser (as Arrow)
+        page_rows = []
+        for index in page_indices:
+            record = records[index]
+            row = {}
+            for column in columns:
+                value = record.get(column)
+                row[column] = formatters[column](value) if column in formatters else value
+            page_rows.append(row)
+
+        df = pd.DataFrame(page_rows, columns=columns, index=page_indices)
+        st.dataframe(df, column_config=column_config, use_container_width=True)
+
+class SectorCube:
+    def __init__(self, equities_by_fund):
+        records = [(fund_id, item['Sector'], item['Date']) for fund_id, items in equities_by_fund.items() for item in items]
+        self.fund_ids = sorted(equities_by_fund)
+        self.sectors = sorted(set(sector for _, sector, _ in records))
+        self.quarters = sorted(set(quarter for _, _, quarter in records))
+        self.fund_index = {fund_id: i for i, fund_id in enumerate(self.fund_ids)}
+        sector_index = {sector: i for i, sector in enumerate(self.sectors)}
+        quarter_index = {quarter: i for i, quarter in enumerate(self.quarters)}
+
+        # Count mentions per fund x sector x quarter in one pass
+        counts = np.zeros((len(self.fund_ids), len(self.sectors), len(self.quarters)), dtype=np.int32)
+        if records:
+            np.add.at(counts, (
+                np.array([self.fund_index[fund_id] for fund_id, _, _ in records]),
+                np.array([sector_index[sector] for _, sector, _ in records]),
+                np.array([quarter_index[quarter] for _, _, quarter in records])
+            ), 1)
+
+        # Prefix sums along the quarter axis, with a leading zero slice so any range is one subtraction
+        self.cumulative = np.zeros((len(self.fund_ids), len(self.sectors), len(self.quarters) + 1), dtype=np.int32)
+        np.cumsum(counts, axis=2, out=self.cumulative[:, :, 1:])
+
+    def fund_rows(self, fund_ids):
+        return [self.fund_index[fund_id] for fund_id in fund_ids if fund_id in self.fund_index]
+
+    def quarter_bounds(self, start_quarter, end_quarter):
+        # Quarter labels sort chronologically, so the inclusive range maps onto two bisections
+        return bisect.bisect_left(self.quarters, start_quarter), bisect.bisect_right(self.quarters, end_quarter)
+
+    def sector_counts(self, fund_ids, start_quarter, end_quarter):
+        rows = self.fund_rows(fund_ids)
+        if not rows:
+            return np.zeros(len(self.sectors), dtype=np.int32)
+        start, end = self.quarter_bounds(start_quarter, end_quarter)
+        selected = self.cumulative[rows]
+        return (selected[:, :, end] - selected[:, :, start]).sum(axis=0)
+
+    def top_sectors(self, fund_ids, start_quarter, end_quarter, n=3):
+        counts = self.sector_counts(fund_ids, start_quarter, end_quarter)
+        order = np.argsort(-counts, kind="stable")[:n]
+        return [(self.sectors[i], int(counts[i])) for i in order if counts[i] > 0]
+
+    def sector_trend(self, fund_ids, start_quarter, end_quarter, sectors):
+        # Per-quarter counts are the differences between neighbouring prefix sums
+        rows = self.fund_rows(fund_ids)
+        start, end = self.quarter_bounds(start_quarter, end_quarter)
+        quarters = self.quarters[start:end]
+        if not rows:
+            return quarters, {sector: [0] * len(quarters) for sector in sectors}
+        per_quarter = np.diff(self.cumulative[rows].sum(axis=0), axis=1)[:, start:end]
+        sector_index = {sector: i for i, sector in enumerate(self.sectors)}
+        return quarters, {sector: per_quarter[sector_index[sector]].tolist() for sector in sectors if sector in sector_index}
+
+def load_sector_cube(insight_store):
+    # Built from the equities table the store already holds, and rebuilt only when a refresh changed it
+    def build(store):
+        equities_by_fund = {}
+        for row in store.query("SELECT fund_id, data FROM equities ORDER BY source, position"):
+            equities_by_fund.setdefault(row["fund_id"], []).append(json.loads(row["data"]))
+        return SectorCube(equities_by_fund)
+
+    return insight_store.derived("sector_cube", build)
+
+def display_sector_trend(sector_cube, fund_ids, start_quarter, end_quarter, top_sectors):
+    quarters, trend = sector_cube.sector_trend(fund_ids, start_quarter, end_quarter, [sector for sector, _ in top_sectors])
+    if not quarters:
+        return
+
+    option = {
+        "tooltip": {"trigger": "axis"},
+        "legend": {"data": list(trend)},
+        "xAxis": {"type": "category", "data": quarters},
+        "yAxis": {"type": "value", "name": "Mentions"},
+        "series": [{"name": sector, "type": "line", "data": counts} for sector, counts in trend.items()],
+    }
+    st_echarts(options=option, height="300px")
+
+class PerformanceMatrix:
+    def __init__(self, rows):
+        # rows are (fund_id, quarter, net return in percent), the matrix holds decimal returns with NaN gaps
+        self.fund_ids = sorted(set(fund_id for fund_id, _, _ in rows))
+        self.quarters = sorted(set(quarter for _, quarter, _ in rows))
+        self.fund_index = {fund_id: i for i, fund_id in enumerate(self.fund_ids)}
+        quarter_index = {quarter: i for i, quarter in enumerate(self.quarters)}
+
+        self.returns = np.full((len(self.fund_ids), len(self.quarters)), np.nan)
+        if rows:
+            self.returns[
+                np.array([self.fund_index[fund_id] for fund_id, _, _ in rows]),
+                np.array([quarter_index[quarter] for _, quarter, _ in rows])
+            ] = np.array([net_return for _, _, net_return in rows], dtype=float) / 100.0
+
+    def select(self, fund_ids, start_quarter, end_quarter):
+        fund_ids = [fund_id for fund_id in fund_ids if fund_id in self.fund_index]
+        start = bisect.bisect_left(self.quarters, start_quarter)
+        end = bisect.bisect_right(self.quarters, end_quarter)
+        returns = self.returns[np.array([self.fund_index[fund_id] for fund_id in fund_ids], dtype=int)][:, start:end]
+        return fund_ids, self.quarters[start:end], returns
+
+    def analytics(self, fund_ids, start_quarter, end_quarter, window=4):
+        fund_ids, quarters, returns = self.select(fund_ids, start_quarter, end_quarter)
+        observed = ~np.isnan(returns)
+        periods = observed.sum(axis=1)
+
+        # Missing quarters compound as flat, so growth carries through gaps
+        growth = np.nancumprod(1.0 + returns, axis=1)
+        cumulative = growth - 1.0
+        total = cumulative[:, -1] if quarters else np.full(len(fund_ids), np.nan)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            annualized = np.where(periods > 0, (1.0 + total) ** (4.0 / np.maximum(periods, 1)) - 1.0, np.nan)
+            # The running peak starts from the initial wealth of 1.0, so a loss in the first quarter is a drawdown too
+            drawdown = growth / np.maximum.accumulate(np.maximum(growth, 1.0), axis=1) - 1.0 if quarters else growth
+        max_drawdown = drawdown.min(axis=1) if quarters else np.full(len(fund_ids), np.nan)
+
+        # Annualized volatility over a trailing window, NaN until the window holds two observations
+        volatility = np.full(returns.shape, np.nan)
+        if len(quarters) >= window:
+            windows = np.lib.stride_tricks.sliding_window_view(returns, window, axis=1)
+            counts = (~np.isnan(windows)).sum(axis=2)
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                volatility[:, window - 1:] = np.where(counts >= 2, np.nanstd(windows, axis=2, ddof=1) * 2.0, np.nan)
+
+        # Cross-fund ranks, 1 is the best return among the selected funds
+        quarterly = pd.DataFrame(returns.T)
+        total_frame = pd.Series(np.where(periods > 0, total, np.nan))
+
+        return {
+            "fund_ids": fund_ids,
+            "quarters": quarters,
+            "returns": returns,
+            "cumulative": np.where(np.cumsum(observed, axis=1) > 0, cumulative, np.nan),
+            "drawdown": drawdown,
+            "volatility": volatility,
+            "quarterly_rank": quarterly.rank(axis=1, ascending=False).to_numpy().T,
+            "quarterly_percentile": quarterly.rank(axis=1, pct=True).to_numpy().T,
+            "total_return": np.where(periods > 0, total, np.nan),
+            "annualized_return": annualized,
+            "max_drawdown": np.where(periods > 0, max_drawdown, np.nan),
+            "latest_volatility": volatility[:, -1] if quarters else np.full(len(fund_ids), np.nan),
+            "rank": total_frame.rank(ascending=False).to_numpy(),
+            "percentile": total_frame.rank(pct=True).to_numpy(),
+        }
 
-            if pitched and str(company['PositionOpen']) in ['1', '0']:
-                if str(company['PositionOpen']) == '0':
-                    continue
-            if exited and str(company['PositionClose']) in ['1', '0']:
-                if str(company['PositionClose']) == '0':
-                    continue
+    def top_quarters(self, fund_ids, start_quarter, end_quarter, n=5):
+        fund_ids, quarters, returns = self.select(fund_ids, start_quarter, end_quarter)
+        flat = np.where(np.isnan(returns), -np.inf, returns).ravel()
+        order = np.argsort(-flat, kind="stable")[:n]
+        order = order[np.isfinite(flat[order])]
+        fund_rows, quarter_columns = np.unravel_index(order, returns.shape)
+        return [(fund_ids[i], quarters[j], float(returns[i, j])) for i, j in zip(fund_rows, quarter_columns)]
+
+def load_performance_matrix(insight_store):
+    return insight_store.derived("performance_matrix", lambda store: PerformanceMatrix([
+        (row["fund_id"], row["quarter"], row["net_return"])
+        for row in store.query("SELECT fund_id, quarter, net_return FROM performance WHERE net_return IS NOT NULL AND quarter IS NOT NULL")
+    ]))
+
+def performance_summary(analytics, fund_registry):
+    # One row per fund, numbers stay numeric so the grid sorts them correctly
+    return pd.DataFrame({
+        "Fund": [fund_registry.resolve(fund_id).display_name for fund_id in analytics["fund_ids"]],
+        "Cumulative Return": analytics["total_return"],
+        "Annualized Return": analytics["annualized_return"],
+        "Max Drawdown": analytics["max_drawdown"],
+        "Volatility (trailing 4Q, annualized)": analytics["latest_volatility"],
+        "Rank": analytics["rank"],
+        "Percentile": analytics["percentile"],
+    }).sort_values("Rank", na_position="last")
+
+def display_performance_overlay(analytics, fund_registry, metric="cumulative", height="400px"):
+    if not analytics["quarters"]:
+        return
+    values = analytics[metric] * 100.0
+    series_data = pd.DataFrame(values).round(2).astype(object).where(~np.isnan(values), None).to_numpy().tolist()
+    names = [fund_registry.resolve(fund_id).display_name for fund_id in analytics["fund_ids"]]
+
+    option = {
+        "tooltip": {"trigger": "axis"},
+        "legend": {"data": names},
+        "xAxis": {"type": "category", "data": analytics["quarters"]},
+        "yAxis": {"type": "value", "name": "%"},
+        "series": [{"name": name, "type": "line", "connectNulls": True, "data": data} for name, data in zip(names, series_data)],
+    }
+    st_echarts(options=option, height=height)
 
-            filtered_companies.append(company)
+PERFORMANCE_METRICS = {
+    "Cumulative return": "cumulative",
+    "Quarterly return": "returns",
+    "Drawdown": "drawdown",
+    "Rolling volatility": "volatility",
+    "Percentile among selected funds": "quarterly_percentile",
+}
+
+class OpportunityScout:
+    def __init__(self, aws_operations, bucket_name, fund_registry, sector_cube, insight_store):
+        self.aws_operations = aws_operations
+        self.bucket_name = bucket_name
+        self.fund_registry = fund_registry
+        self.sector_cube = sector_cube
+        self.insight_store = insight_store
 
-        return filtered_companies
-    
     def aggregate_companies(self, selected_funds, sectors, start_quarter, end_quarter, pitched, exited):
-        aggregated_companies = []
+        clauses = []
+        params = []
+        if sectors:
+            clauses.append(f"sector IN ({', '.join('?' * len(sectors))})")
+            params.extend(sectors)
 
-        for fund_name in selected_funds:
-            json_data = self.fetch_json_data(fund_name)
-            filtered_companies = self.filter_companies(json_data, sectors, start_quarter, end_quarter, pitched, exited)
-            aggregated_companies.extend(filtered_companies)
+        # Positions flagged '0' are excluded, records without a flag are kept
+        if pitched:
+            clauses.append("position_open IS NOT '0'")
+        if exited:
+            clauses.append("position_close IS NOT '0'")
 
-        return aggregated_companies
+        where = " AND ".join(clauses) or None
+        return self.insight_store.records("equities", selected_funds, start_quarter, end_quarter, where, params)
 
     def display_companies(self, aggregated_companies):
         if not aggregated_companies:
             st.write("No companies found matching the selected criteria.")
             return
 
-        df = pd.DataFrame(aggregated_companies)
-        
-        # Remove the "Description" column from the displayed dataframe
-        if "Description" in df.columns:
-            df = df.drop(columns=["Description"])
+        grid = PaginatedResultGrid("opportunity_scout_grid")
+
+        # Remove the "Description" column from the displayed grid
+        columns = grid.get_columns(aggregated_companies, exclude=["Description"])
         
         # Add the message to inform the user about double-clicking on a cell
         st.write("**Double-click on a cell to see the full text.**")
         
-        st.dataframe(df)
+        grid.render(aggregated_companies, columns)
 
     def get_top_sectors(self, selected_funds, start_quarter, end_quarter):
-        sector_counts = {}
-
-        for fund_name in selected_funds:
-            json_data = self.fetch_json_data(fund_name)
-            filtered_companies = self.filter_companies(json_data, None, start_quarter, end_quarter, None, None)
-
-            for company in filtered_companies:
-                sector = company['Sector']
-                if sector in sector_counts:
-                    sector_counts[sector] += 1
-                else:
-                    sector_counts[sector] = 1
-
-        sorted_sectors = sorted(sector_counts.items(), key=lambda x: x[1], reverse=True)
-        top_sectors = sorted_sectors[:3]
-
-        return top_sectors
+        # Answered from the precomputed sector cube, no equities records are scanned
+        return self.sector_cube.top_sectors(selected_funds, start_quarter, end_quarter, n=3)
 
     def run(self, fund_type, selected_funds):
         if not selected_funds:
@@ -219,6 +1024,7 @@ class OpportunityScout:
                 st.write(f"**Top 3 most discussed sectors by the selected funds from {start_quarter} to {end_quarter}:**")
                 for sector, count in top_sectors:
                     st.write(f"- {sector} ({count} mentions)")
+                display_sector_trend(self.sector_cube, selected_funds, start_quarter, end_quarter, top_sectors)
             else:
                 st.write(f"No sectors discussed by the selected funds from {start_quarter} to {end_quarter}.")
 
@@ -233,56 +1039,52 @@ class OpportunityScout:
         pitched = st.checkbox("Newly Added Positions")
         exited = st.checkbox("Exited Positions")
 
+        criteria = (tuple(selected_funds), tuple(selected_sectors), start_quarter, end_quarter, pitched, exited)
         if st.button("Submit"):
             aggregated_companies = self.aggregate_companies(selected_funds, selected_sectors, start_quarter, end_quarter, pitched, exited)
-            self.display_companies(aggregated_companies)
+            st.session_state["opportunity_scout_results"] = (criteria, aggregated_companies)
+
+        # Keep the submitted results across reruns so paging and sorting don't refetch anything
+        results = st.session_state.get("opportunity_scout_results")
+        if results and results[0] == criteria:
+            self.display_companies(results[1])
                  
 class PerformancePulse:
-    def __init__(self, aws_operations, ai_response_generator, document_fetcher):
+    def __init__(self, aws_operations, ai_response_generator, document_fetcher, fund_registry, job_runner, insight_store):
         self.aws_operations = aws_operations
         self.ai_response_generator = ai_response_generator
         self.document_fetcher = document_fetcher
+        self.fund_registry = fund_registry
+        self.job_runner = job_runner
+        self.insight_store = insight_store
 
     def fetch_performance_data(self, selected_funds, start_quarter, end_quarter):
-        # Fetch the performance data from the JSON file in the S3 bucket
-        performance_data = self.aws_operations.fetch_object("hedgefund_performance_insights.json", "hedgefunds")
-        performance_data = json.loads(performance_data)
-
-        # Filter the performance data based on the selected funds and date range
-        filtered_data = [
-            obj for obj in performance_data
-            if obj['Fund Name'] in selected_funds and start_quarter <= obj['Date'] <= end_quarter
-        ]
-
-        return filtered_data
-
-    def display_performance_table(self, filtered_data):
-        # Extract the relevant columns from the filtered data for the performance table
-        table_data = [
-            {
-                'Fund Name': obj['Fund Name'],
-                'Date': obj['Date'],
-                'Quarterly Performance Net of Fees': self.convert_to_percentage(obj.get('Quarterly Performance Net of Fees', ''))
-            }
-            for obj in filtered_data
-        ]
+        return self.insight_store.records("performance", selected_funds, start_quarter, end_quarter)
 
-        # Create a DataFrame from the table data and sort it by 'Quarterly Performance Net of Fees' in descending order
-        df = pd.DataFrame(table_data)
-        df = df.sort_values('Quarterly Performance Net of Fees', ascending=False, key=lambda x: pd.to_numeric(x.str.rstrip('%'), errors='coerce'))
+    def display_performance_table(self, top_quarters):
+        # The top 5 best performing quarters, already ranked numerically by the performance matrix
+        df = pd.DataFrame(
+            [(self.fund_registry.resolve(fund_id).display_name, quarter, net_return * 100.0) for fund_id, quarter, net_return in top_quarters],
+            columns=['Fund Name', 'Date', 'Quarterly Performance Net of Fees']
+        )
+        st.table(df.style.format({'Quarterly Performance Net of Fees': "{:.1f}%"}))
 
-        # Limit the table to the top 5 best performing quarters
-        top_5_df = df.head(5)
+    def display_performance_analytics(self, performance_matrix, fund_ids, start_quarter, end_quarter):
+        analytics = performance_matrix.analytics(fund_ids, start_quarter, end_quarter)
+        if not analytics["fund_ids"] or not analytics["quarters"]:
+            return
 
-        st.table(top_5_df)
+        percent = "{:.1%}".format
+        st.dataframe(
+            performance_summary(analytics, self.fund_registry).style.format({
+                "Cumulative Return": percent, "Annualized Return": percent, "Max Drawdown": percent,
+                "Volatility (trailing 4Q, annualized)": percent, "Rank": "{:.0f}", "Percentile": percent
+            }, na_rep="-"),
+            hide_index=True
+        )
+        metric = st.selectbox("Chart", list(PERFORMANCE_METRICS), key="performance_pulse_metric")
+        display_performance_overlay(analytics, self.fund_registry, PERFORMANCE_METRICS[metric])
 
-    def convert_to_percentage(self, value):
-        # Convert a value to percentage format
-        try:
-            return f"{float(value):.1f}%"
-        except (ValueError, TypeError):
-            return value
-        
     def convert_to_float(self, value):
         # Convert a value to float if possible, otherwise return the original value
         try:
@@ -290,7 +1092,7 @@ class PerformancePulse:
         except (ValueError, TypeError):
             return value
 
-    def handle_dropdown_selection(self, selected_option, filtered_data):
+    def handle_dropdown_selection(self, selected_option, filtered_data, delta_mode=False):
         # Extract the relevant insights based on the selected option
         if selected_option in ['Key Contributors to Performance', 'Key Detractors from Performance']:
             insight_key = selected_option
@@ -355,6 +1157,18 @@ class PerformancePulse:
             for obj in filtered_data
         ]
 
+        if delta_mode:
+            # Group each fund's quarters chronologically and keep only what changed from the quarter before
+            system_prompt += DELTA_MODE_NOTE
+            insights_by_fund = {}
+            for obj in sorted(insight_data, key=lambda obj: obj['Date']):
+                insights_by_fund.setdefault(obj['Fund Name'], []).append((obj['Date'], obj['Insight']))
+            insight_data = [
+                {'Fund Name': fund_name, 'Date': date, 'Insight': insight}
+                for fund_name, entries in insights_by_fund.items()
+                for date, insight in QuarterDeltaBuilder().build(entries)
+            ]
+
         # Format the insights data for sending to the AI API
         formatted_insights = []
         for obj in insight_data:
@@ -365,46 +1179,10 @@ class PerformancePulse:
 
         return message_prompt, system_prompt, aggregated_insights
 
-    def generate_performance_pulse_response(self, prompt, system_prompt, aggregated_insights):
-        client = anthropic.Anthropic(api_key=self.ai_response_generator.api_key)
-
-        message = client.messages.create(
-            model=CLAUDE_HAIKU,
-            max_tokens=3000,
-            temperature=0.3,
-            system=system_prompt,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": f"{aggregated_insights}\n\n{prompt}"
-                        }
-                    ]
-                }
-            ]
-        )
-
-        raw_text = message.content
-        answer = raw_text[0].text
-
-        # Extract the content within <answer></answer> tags if present
-        answer_match = re.search(r'<answer>(.*?)</answer>', answer, re.DOTALL)
-        if answer_match:
-            answer = answer_match.group(1).strip()
-
-        st.write(answer)
-
     def fetch_positioning_text(self, fund_name, quarter):
-        # Fetch the performance data from the JSON file in the S3 bucket
-        performance_data = self.aws_operations.fetch_object("hedgefund_performance_insights.json", "hedgefunds")
-        performance_data = json.loads(performance_data)
-        
         # Find the matching fund and quarter in the performance data
-        for obj in performance_data:
-            if obj['Fund Name'] == fund_name and obj['Date'] == quarter:
-                return obj.get('Portfolio Positioning and Adjustments', '')
+        for obj in self.insight_store.records("performance", [fund_name], quarter, quarter):
+            return obj.get('Portfolio Positioning and Adjustments', '')
         
         return ''
     
@@ -414,16 +1192,16 @@ class PerformancePulse:
 
         if selected_funds:
             filtered_data = self.fetch_performance_data(selected_funds, start_quarter, end_quarter)
-            self.display_performance_table(filtered_data)
-            
-            # Filter out rows with invalid numeric values in 'Quarterly Performance Net of Fees'
-            valid_data = [row for row in filtered_data if isinstance(self.convert_to_float(row.get('Quarterly Performance Net of Fees', '')), float)]
+            performance_matrix = load_performance_matrix(self.insight_store)
+            fund_ids = format_fund_names(self.fund_registry, selected_funds)
+            top_quarters = performance_matrix.top_quarters(fund_ids, start_quarter, end_quarter, n=5)
+            self.display_performance_table(top_quarters)
+            self.display_performance_analytics(performance_matrix, fund_ids, start_quarter, end_quarter)
             
-            if valid_data:
-                # Get the best performing fund and quarter from the valid data
-                best_performing_row = max(valid_data, key=lambda x: self.convert_to_float(x.get('Quarterly Performance Net of Fees', '')))
-                best_performing_fund = best_performing_row['Fund Name']
-                best_performing_quarter = best_performing_row['Date']
+            if top_quarters:
+                # Get the best performing fund and quarter, rows without a numeric return never enter the matrix
+                best_fund_id, best_performing_quarter, _ = top_quarters[0]
+                best_performing_fund = self.fund_registry.resolve(best_fund_id).display_name
                 
                 # Fetch the "Portfolio Positioning and Adjustments" text for the best performing fund and quarter
                 positioning_text = self.fetch_positioning_text(best_performing_fund, best_performing_quarter)
@@ -437,63 +1215,68 @@ class PerformancePulse:
 
             selected_option = st.selectbox("Select an option", ["Key Contributors to Performance", "Key Detractors from Performance", "Portfolio Positioning and Adjustments"])
 
+            delta_mode = False
+            if selected_option == 'Portfolio Positioning and Adjustments':
+                delta_mode = st.checkbox("Only send what changed between quarters (delta mode)", value=True, key="performance_pulse_delta_mode")
+
             if selected_option:
-                message_prompt, system_prompt, aggregated_insights = self.handle_dropdown_selection(selected_option, filtered_data)
+                message_prompt, system_prompt, aggregated_insights = self.handle_dropdown_selection(selected_option, filtered_data, delta_mode)
                     
                 if st.button("Submit"):
-                    self.generate_performance_pulse_response(message_prompt, system_prompt, aggregated_insights)
+                    # Run the analysis in the background, the answer survives reruns
+                    label = f"Performance Pulse: {selected_option}{' (delta)' if delta_mode else ''} ({', '.join(selected_funds)}, {start_quarter} to {end_quarter})"
+                    job = self.ai_response_generator.submit_analysis(self.job_runner, label, message_prompt, system_prompt, aggregated_insights, task="synthesis", temperature=0.3)
+                    st.session_state["performance_pulse_job"] = job.job_id
+
+                display_analysis_job(self.job_runner, "performance_pulse_job", self.ai_response_generator.rate_governor)
+                display_previous_analyses(self.job_runner)
         else:
             st.write("**Please select at least one fund to view performance data.**")
 
+# Theme columns of the general_insights table
+THEME_KEYS = {
+    'Market Commentary': 'macro',
+    'Asset Class': 'asset_classes',
+    'Geography': 'geographies',
+}
+
 class MarketMoodMonitor:
-    def __init__(self, aws_operations, ai_response_generator, fund_info_path, document_fetcher):
+    def __init__(self, aws_operations, ai_response_generator, document_fetcher, fund_registry, job_runner, insight_store):
         self.aws_operations = aws_operations
         self.ai_response_generator = ai_response_generator
-        self.fund_info_path = fund_info_path
         self.document_fetcher = document_fetcher
+        self.fund_registry = fund_registry
+        self.job_runner = job_runner
+        self.insight_store = insight_store
 
-    def fetch_fund_info_data(self):
-        fund_info_data = self.aws_operations.fetch_object(self.fund_info_path, "hedgefunds")
-        fund_info_data = json.loads(fund_info_data)
-        return fund_info_data
-    
-    def get_unique_values(self, fund_info_data, key):
-        values = set()
-        for obj in fund_info_data:
-            if key in obj:
-                values.update(obj[key].split(", "))
-        return list(values)
-
-    def handle_theme_specific(self, fund_info_data, analysis_type, selected_funds, start_quarter, end_quarter):
-        if analysis_type == 'Market Commentary':
-            themes = self.get_unique_values(fund_info_data, 'Macro')
-        elif analysis_type == 'Asset Class':
-            themes = self.get_unique_values(fund_info_data, 'Asset Classes')
-        elif analysis_type == 'Geography':
-            themes = self.get_unique_values(fund_info_data, 'Geographies')
+    def get_themes(self, analysis_type):
+        return self.insight_store.distinct_values("general_insights", THEME_KEYS[analysis_type])
+
+    def filter_theme_data(self, analysis_type, selected_themes, selected_funds, start_quarter, end_quarter):
+        # A record matches when any selected theme appears in its theme list
+        column = THEME_KEYS[analysis_type]
+        where = "(" + " OR ".join(f"instr({column}, ?) > 0" for _ in selected_themes) + ")"
+        return self.insight_store.records("general_insights", selected_funds or None, start_quarter, end_quarter, where, selected_themes)
+
+    def build_theme_prompts(self, analysis_type, selected_themes):
+        message_prompt = f"Provide a detailed overview of the {', '.join(selected_themes)} themes discussed in the selected partner letters. Break it down into clear, structured bullet points. Highlight the key points that the letters discussed. Please compare and contrast between the different funds and quarters. Make sure to cite your sources by putting the title of the letter that was cited in brackets like this: [Greenlight Capital 2023 Q4]. I want to know the exactly source of each view point. The purpose is to make the user aware of the outlook on these specific themes. Please present your findings in a well-structured, easy-to-follow format."
+        
+        system_prompt = f"You are an experienced investment analyst with a deep understanding of various {analysis_type.lower()} themes. I have attached partner letters from the selected hedge funds for you to analyze and reference for the upcoming task. Each letter is identified by the appropiate XML tags at the top and bottom of the letter. Each hedge fund writes a quarterly partner letter discussing topics such as their performance, \
+            macroeconomic views, and rationale for adding specific equity positions to their fund. Please carefully read through the entire document and identify the most relevant commentary related to the selected themes: {', '.join(selected_themes)}. When you complete your task, first plan how you should answer and which data you will use within \
+                <thinking> </thinking> XML tags. This is a space for you to write down relevant content and will not be shown to the user. Once you are done thinking, output your final answer to the user within <answer> </answer> XML tags. Do not include closing tags or unnecessary open-and-close tag sections."
+
+        return message_prompt, system_prompt
+
+    def handle_theme_specific(self, analysis_type, selected_funds, start_quarter, end_quarter):
+        themes = self.get_themes(analysis_type)
 
         selected_themes = st.multiselect(f'Select {analysis_type.lower()} themes:', themes)
 
         if selected_themes:
-            # Add text to inform users about uploading documents
-            st.write("**You can upload a maximum of 5 documents to filter in the sidebar.**")
-
-            # Filter the fund_info_data based on the selected themes
-            filtered_funds_data = []
-            for obj in fund_info_data:
-                if analysis_type == 'Market Commentary' and any(theme in obj.get('Macro', '') for theme in selected_themes):
-                    filtered_funds_data.append(obj)
-                elif analysis_type == 'Asset Class' and any(theme in obj.get('Asset Classes', '') for theme in selected_themes):
-                    filtered_funds_data.append(obj)
-                elif analysis_type == 'Geography' and any(theme in obj.get('Geographies', '') for theme in selected_themes):
-                    filtered_funds_data.append(obj)
-
-            # Filter the filtered_funds_data based on the selected date range
-            filtered_funds_data = [obj for obj in filtered_funds_data if start_quarter <= obj['Date'] <= end_quarter]
-
-            # Filter the filtered_funds_data based on the selected funds
-            if selected_funds:
-                filtered_funds_data = [obj for obj in filtered_funds_data if obj['Fund Name'] in selected_funds]
+            # Wide selections are trimmed to the passages about the themes rather than capped at a number of letters
+            st.write(f"**Selections over the {self.ai_response_generator.input_token_budget:,} token input budget are trimmed to the passages most about the selected themes.**")
+
+            filtered_funds_data = self.filter_theme_data(analysis_type, selected_themes, selected_funds, start_quarter, end_quarter)
 
             if filtered_funds_data:
                 # Get the fund names and dates from the filtered data
@@ -504,90 +1287,74 @@ class MarketMoodMonitor:
                     st.write(f"- {fund_name_date}")
 
                 if st.button('Submit'):
-                    message_prompt = f"Provide a detailed overview of the {', '.join(selected_themes)} themes discussed in the selected partner letters. Break it down into clear, structured bullet points. Highlight the key points that the letters discussed. Please compare and contrast between the different funds and quarters. Make sure to cite your sources by putting the title of the letter that was cited in brackets like this: [Greenlight Capital 2023 Q4]. I want to know the exactly source of each view point. The purpose is to make the user aware of the outlook on these specific themes. Please present your findings in a well-structured, easy-to-follow format."
-                    
-                    system_prompt = f"You are an experienced investment analyst with a deep understanding of various {analysis_type.lower()} themes. I have attached partner letters from the selected hedge funds for you to analyze and reference for the upcoming task. Each letter is identified by the appropiate XML tags at the top and bottom of the letter. Each hedge fund writes a quarterly partner letter discussing topics such as their performance, \
-                        macroeconomic views, and rationale for adding specific equity positions to their fund. Please carefully read through the entire document and identify the most relevant commentary related to the selected themes: {', '.join(selected_themes)}. When you complete your task, first plan how you should answer and which data you will use within \
-                            <thinking> </thinking> XML tags. This is a space for you to write down relevant content and will not be shown to the user. Once you are done thinking, output your final answer to the user within <answer> </answer> XML tags. Do not include closing tags or unnecessary open-and-close tag sections."
+                    message_prompt, system_prompt = self.build_theme_prompts(analysis_type, selected_themes)
 
-                    partner_letters = self.document_fetcher.fetch_partner_letters(fund_names_dates)
+                    # Keep each letter paired with its name so missing quarters cannot shift the tags
+                    letter_pairs = self.document_fetcher.fetch_letter_pairs(fund_names_dates)
+                    fund_names_dates = [fund_name_date for fund_name_date, _ in letter_pairs]
+                    partner_letters = [letter for _, letter in letter_pairs]
+                    combined_letters, fund_names_dates, cuts = self.ai_response_generator.prepare_letters(message_prompt, system_prompt, partner_letters, fund_names_dates, ", ".join(selected_themes), policy="relevance")
                     
                     # Display the included document names
                     st.write("These funds were included in the analysis:")
                     for fund_name_date in fund_names_dates:
                         st.write(f"- {fund_name_date}")
+                    display_context_cuts(cuts, self.ai_response_generator.input_token_budget)
+
+                    # Generate the response in the background
+                    label = f"Market Mood Monitor: {', '.join(selected_themes)} ({start_quarter} to {end_quarter})"
+                    job = self.ai_response_generator.submit_analysis(self.job_runner, label, message_prompt, system_prompt, combined_letters, task="synthesis")
+                    st.session_state["market_mood_job"] = job.job_id
 
-                    # Generate the response
-                    self.ai_response_generator.generate_response(message_prompt, system_prompt, partner_letters, fund_names_dates)
+                display_analysis_job(self.job_runner, "market_mood_job", self.ai_response_generator.rate_governor)
+                display_previous_analyses(self.job_runner)
             else:
                 st.write(f"No funds found that discussed the selected {analysis_type.lower()} themes.")
 
     def run(self, selected_funds):
         analysis_type = st.radio('Select analysis type:', ['Market Commentary', 'Asset Class', 'Geography'])
-        fund_info_data = self.fetch_fund_info_data()
             
         # Add a slider for selecting the date range
         quarters = ["2022 Q3", "2022 Q4", "2023 Q1", "2023 Q2", "2023 Q3", "2023 Q4", "2024 Q1"]
         start_quarter, end_quarter = st.sidebar.select_slider("Select Date Range", options=quarters, value=(quarters[0], quarters[-1]))
 
-        self.handle_theme_specific(fund_info_data, analysis_type, selected_funds, start_quarter, end_quarter)
-
+        self.handle_theme_specific(analysis_type, selected_funds, start_quarter, end_quarter)
 
 class SpecificFundsSection:
-    def __init__(self, aws_operations, ai_response_generator, document_fetcher):
+    def __init__(self, aws_operations, ai_response_generator, document_fetcher, fund_registry, job_runner, sector_cube, insight_store, semantic_cache=None):
         self.aws_operations = aws_operations
         self.ai_response_generator = ai_response_generator
         self.document_fetcher = document_fetcher
+        self.fund_registry = fund_registry
+        self.job_runner = job_runner
+        self.sector_cube = sector_cube
+        self.insight_store = insight_store
+        self.semantic_cache = semantic_cache
 
     def fetch_performance_data(self, selected_fund, start_quarter, end_quarter):
-        # Fetch the performance data from the JSON file in the S3 bucket
-        performance_data = self.aws_operations.fetch_object("hedgefund_performance_insights.json", "hedgefunds")
-        performance_data = json.loads(performance_data)
-
-        # Filter the performance data based on the selected fund and date range
-        filtered_data = [
-            obj for obj in performance_data
-            if obj['Fund Name'] == selected_fund and start_quarter <= obj['Date'] <= end_quarter
-        ]
-
-        return filtered_data
+        return self.insight_store.records("performance", [selected_fund], start_quarter, end_quarter)
     
     def fetch_available_dates(self, selected_fund):
-        # Fetch the JSON file containing the fund information
-        fund_info_data = self.aws_operations.fetch_object("hedgefund_general_insights.json", "hedgefunds")
-        fund_info_data = json.loads(fund_info_data)
-
-        # Extract the available dates for the selected fund
-        available_dates = [obj['Date'] for obj in fund_info_data if obj['Fund Name'] == selected_fund]
+        # The registry already knows which quarters have letters for the selected fund
+        record = self.fund_registry.resolve(selected_fund)
+        return list(record.quarters) if record else []
 
-        return sorted(set(available_dates))
+    def display_line_graph(self, selected_fund, start_quarter, end_quarter):
+        analytics = load_performance_matrix(self.insight_store).analytics([self.fund_registry.resolve(selected_fund).fund_id], start_quarter, end_quarter)
+        display_performance_overlay(analytics, self.fund_registry, "returns")
 
-    def display_line_graph(self, filtered_data):
-        x_data = []
-        y_data = []
-
-        for obj in filtered_data:
-            x_data.append(obj['Date'])
-            performance = obj.get('Quarterly Performance Net of Fees', '')
-            try:
-                y_data.append(float(performance))
-            except (ValueError, TypeError):
-                y_data.append(None)
-
-        option = {
-            "xAxis": {
-                "type": "category",
-                "data": x_data,
-            },
-            "yAxis": {"type": "value"},
-            "series": [{"data": y_data, "type": "line"}],
-        }
-
-        st_echarts(options=option, height="400px")
-
-    def handle_performance_button_click(self, selected_fund, quarters_in_range, selected_performance_option):
+    def handle_performance_button_click(self, selected_fund, quarters_in_range, selected_performance_option, delta_mode=False):
         fund_names_dates = [f"{selected_fund} {quarter}" for quarter in quarters_in_range]
-        partner_letters = self.document_fetcher.fetch_partner_letters(fund_names_dates)
+        if delta_mode:
+            # Send the first letter in full and only the changed paragraphs of each later quarter
+            letter_pairs = self.document_fetcher.fetch_letter_pairs(fund_names_dates)
+            deltas = QuarterDeltaBuilder().build([(" ".join(fund_name_date.split()[-2:]), letter_text(letter)) for fund_name_date, letter in letter_pairs])
+            fund_names_dates = [f"{selected_fund} {quarter}" for quarter, _ in deltas]
+            partner_letters = [letter for _, letter in deltas]
+        else:
+            letter_pairs = self.document_fetcher.fetch_letter_pairs(fund_names_dates)
+            fund_names_dates = [fund_name_date for fund_name_date, _ in letter_pairs]
+            partner_letters = [letter for _, letter in letter_pairs]
 
         if selected_performance_option == 'Key Contributors to Performance':
             message_prompt = "Analyze the key positive contributors to {selected_fund}'s performance across the provided quarterly letters. Identify the top stocks, sectors, strategies or positions that drove outperformance each quarter. For each key contributor, extract specific evidence and examples from all relevant letters, clearly citing the quarter. Compare and contrast how that contributor performed across different quarters - highlight quarters where it was a top performer as well as any periods of underperformance if that exists. Explain the reasons and market conditions behind the diverging performance based on context from the letters."
@@ -664,50 +1431,32 @@ class SpecificFundsSection:
             Limitations:
             [Any caveats about missing context or inability to fully evaluate adjustments]
             """
+            if delta_mode:
+                system_prompt += DELTA_MODE_NOTE
 
         return message_prompt, system_prompt, partner_letters, fund_names_dates
     
-    def fetch_json_data(self, selected_fund):
-        # Format the fund name for the JSON file path
-        formatted_fund_name = selected_fund.lower().replace(" ", "")
-        json_file_path = f"{formatted_fund_name}/{formatted_fund_name}_equities.json"
+    def handle_ask_anything(self, selected_fund, quarters_in_range, user_input):
+        letter_pairs = self.document_fetcher.fetch_letter_pairs([f"{selected_fund} {quarter}" for quarter in quarters_in_range])
+        fund_names_dates = [fund_name_date for fund_name_date, _ in letter_pairs]
+        partner_letters = [letter for _, letter in letter_pairs]
 
-        try:
-            # Fetch the JSON data from S3
-            json_data = self.aws_operations.fetch_object(json_file_path, "hedgefunds")
-            json_data = json.loads(json_data)
-            return json_data
-        except botocore.exceptions.ClientError as e:
-            if e.response['Error']['Code'] == 'NoSuchKey':
-                print(f"JSON file not found for fund: {selected_fund}")
-                return None
-            else:
-                raise e
-            
-    def get_top_sectors(self, selected_fund, start_quarter, end_quarter):
-        # Fetch the JSON data for the selected fund
-        json_data = self.fetch_json_data(selected_fund)
-
-        if json_data:
-            # Filter the data based on the selected date range
-            filtered_data = [item for item in json_data if start_quarter <= item['Date'] <= end_quarter]
-
-            # Count the occurrences of each sector
-            sector_counts = {}
-            for item in filtered_data:
-                sector = item['Sector']
-                if sector in sector_counts:
-                    sector_counts[sector] += 1
-                else:
-                    sector_counts[sector] = 1
+        system_prompt = f"""
+        You are an experienced investment analyst reviewing the quarterly partner letters from the hedge fund {selected_fund}.
+        The user has asked the following question: "{user_input}"
+        Your task is to analyze the provided partner letters and extract relevant insights to answer the user's question.
+        Provide a comprehensive response, citing specific examples from the letters to support your points.
+        After reviewing the relevant information, take a moment to organize your thoughts within <thinking></thinking> tags before presenting your final analysis to the user within <answer></answer> tags.
+        """
 
-            # Sort the sectors by count in descending order
-            sorted_sectors = sorted(sector_counts.items(), key=lambda x: x[1], reverse=True)
+        return user_input, system_prompt, partner_letters, fund_names_dates
 
-            # Return the top 3 sectors
-            return sorted_sectors[:3]
-        else:
-            return []
+    def fetch_json_data(self, selected_fund):
+        return self.insight_store.records("equities", [selected_fund]) or None
+            
+    def get_top_sectors(self, selected_fund, start_quarter, end_quarter):
+        # Answered from the precomputed sector cube, no equities records are scanned
+        return self.sector_cube.top_sectors([self.fund_registry.resolve(selected_fund).fund_id], start_quarter, end_quarter, n=3)
         
     def run(self, selected_fund):
         if selected_fund:
@@ -781,8 +1530,7 @@ class SpecificFundsSection:
             # Get all the quarters within the selected date range
             quarters_in_range = [date for date in available_dates if start_quarter <= date <= end_quarter]
 
-            filtered_data = self.fetch_performance_data(selected_fund, start_quarter, end_quarter)
-            self.display_line_graph(filtered_data)
+            self.display_line_graph(selected_fund, start_quarter, end_quarter)
 
             # Get the top 3 most discussed sectors
             top_sectors = self.get_top_sectors(selected_fund, start_quarter, end_quarter)
@@ -793,6 +1541,7 @@ class SpecificFundsSection:
                 st.write("**Top 3 most discussed sectors in the selected date range:**")
                 for sector, count in top_sectors:
                     st.write(f"- {sector} ({count} mentions)")
+                display_sector_trend(self.sector_cube, [self.fund_registry.resolve(selected_fund).fund_id], start_quarter, end_quarter, top_sectors)
             else:
                 st.write("No sector data available for the selected date range.")
 
@@ -805,13 +1554,23 @@ class SpecificFundsSection:
                 performance_options = ['Key Contributors to Performance', 'Key Detractors from Performance', 'Portfolio Positioning and Adjustments']
                 selected_performance_option = st.selectbox("Select a performance option", performance_options)
                 
+                delta_mode = False
+                if selected_performance_option == 'Portfolio Positioning and Adjustments' and len(quarters_in_range) > 1:
+                    delta_mode = st.checkbox("Only send what changed between quarters (delta mode)", value=True, key="specific_funds_delta_mode")
+
                 if selected_performance_option:
-                    result = self.handle_performance_button_click(selected_fund, quarters_in_range, selected_performance_option)
+                    result = self.handle_performance_button_click(selected_fund, quarters_in_range, selected_performance_option, delta_mode)
                     if result:
                         message_prompt, system_prompt, partner_letters, fund_names_dates = result
                         if st.button("Submit"):
                             print("Submit button clicked")
-                            self.ai_response_generator.generate_response(message_prompt, system_prompt, partner_letters, fund_names_dates)
+                            combined_letters, fund_names_dates, cuts = self.ai_response_generator.prepare_letters(message_prompt, system_prompt, partner_letters, fund_names_dates, selected_performance_option)
+                            display_context_cuts(cuts, self.ai_response_generator.input_token_budget)
+                            label = f"{selected_fund}: {selected_performance_option}{' (delta)' if delta_mode else ''} ({start_quarter} to {end_quarter})"
+                            # Positioning reviews compare quarters, contributors and detractors are extraction
+                            task = "synthesis" if selected_performance_option == 'Portfolio Positioning and Adjustments' else "extraction"
+                            job = self.ai_response_generator.submit_analysis(self.job_runner, label, message_prompt, system_prompt, combined_letters, task=task)
+                            st.session_state["specific_funds_job"] = job.job_id
                     else:
                         print("Result is None")
                 else:
@@ -835,57 +1594,97 @@ class SpecificFundsSection:
                 st.write(f"The partner letters that match the selected fund ({selected_fund}) and date range ({start_quarter} to {end_quarter}) will be analyzed by GenAI.")
                 
                 user_input = st.text_input("Enter your question:")
+                fresh = st.checkbox("Generate a fresh answer", key="specific_funds_fresh_answer")
                 submit_button = st.button("Submit")
                 
                 if submit_button:
                     if user_input:
-                        fund_names_dates = [f"{selected_fund} {quarter}" for quarter in quarters_in_range]
-                        partner_letters = self.document_fetcher.fetch_partner_letters(fund_names_dates)
-                        
-                        system_prompt = f"""
-                        You are an experienced investment analyst reviewing the quarterly partner letters from the hedge fund {selected_fund}.
-                        The user has asked the following question: "{user_input}"
-                        Your task is to analyze the provided partner letters and extract relevant insights to answer the user's question.
-                        Provide a comprehensive response, citing specific examples from the letters to support your points.
-                        After reviewing the relevant information, take a moment to organize your thoughts within <thinking></thinking> tags before presenting your final analysis to the user within <answer></answer> tags.
-                        """
+                        message_prompt, system_prompt, partner_letters, fund_names_dates = self.handle_ask_anything(selected_fund, quarters_in_range, user_input)
                         
                         print("Submit button clicked for Ask Anything")
-                        self.ai_response_generator.generate_response(user_input, system_prompt, partner_letters, fund_names_dates)
+                        st.session_state.pop("specific_funds_cached_answer", None)
+
+                        # A question already answered from the same letters, however it was worded, is served without a model call
+                        cache_scope = None
+                        if self.semantic_cache:
+                            cache_scope = self.semantic_cache.scope("hedge", self.fund_registry.resolve(selected_fund).fund_id, fund_names_dates, partner_letters)
+                        cached = None if fresh or not cache_scope else self.semantic_cache.lookup(cache_scope, user_input)
+                        if cached:
+                            st.session_state["specific_funds_cached_answer"] = cached
+                            st.session_state.pop("specific_funds_job", None)
+                        else:
+                            combined_letters, fund_names_dates, cuts = self.ai_response_generator.prepare_letters(message_prompt, system_prompt, partner_letters, fund_names_dates, user_input, policy="relevance")
+                            display_context_cuts(cuts, self.ai_response_generator.input_token_budget)
+                            label = f"{selected_fund}: {user_input} ({start_quarter} to {end_quarter})"
+                            on_answer = (lambda answer: self.semantic_cache.store(cache_scope, user_input, answer)) if cache_scope else None
+                            job = self.ai_response_generator.submit_analysis(self.job_runner, label, message_prompt, system_prompt, combined_letters, task="qa", fresh=fresh, on_answer=on_answer)
+                            st.session_state["specific_funds_job"] = job.job_id
                     else:
                         st.warning("Please enter a question before submitting.")
 
+                display_cached_answer(st.session_state.get("specific_funds_cached_answer"))
+
+            if insight_option in ("Performance", "Ask Anything"):
+                display_analysis_job(self.job_runner, "specific_funds_job", self.ai_response_generator.rate_governor)
+                display_previous_analyses(self.job_runner)
+
 class VCDocumentFetcher:
-    def __init__(self, aws_operations):
+    def __init__(self, aws_operations, fund_registry):
         self.aws_operations = aws_operations
+        self.fund_registry = fund_registry
 
     def fetch_vc_partner_letters(self, fund_name, date):
-        bucket_name = fund_name.split(" ")[0].lower()
-        file_name = f"{bucket_name}/cleaned/{fund_name} {date}.txt"
+        record = self.fund_registry.resolve(fund_name)
+        if record is None or date not in record.quarters:
+            print(f"No letter registered for: {fund_name} {date}")
+            return None
+
+        file_name = record.preferred_letter_key(date)
         try:
-            letter_content = self.aws_operations.fetch_object(file_name, "venturecapitalfunds")
+            letter_content = self.aws_operations.fetch_object(file_name, record.bucket)
             return letter_content
         except Exception as e:
             print(f"File not found: {file_name}")
             print(f"Error: {str(e)}")
             return None
 
+VC_INVESTMENT_COLUMNS = ["Fund", "Date", "Company", "Type of Investment", "Amount Invested", "Date invested", "Fair Value of the Investment", "Summary"]
+AMOUNT_BUCKETS = ["<$1m", "$1m-$10m", ">$10m"]
+
+def format_amount(value):
+    # Amounts that could not be parsed are shown as n/a rather than $nan
+    return "n/a" if pd.isna(value) else f"${value:,.2f}"
+
+def build_vc_investments_table(investments_data):
+    df = pd.DataFrame(investments_data, columns=VC_INVESTMENT_COLUMNS)
+
+    # Amounts are stored in $m as strings, parse them once into a numeric column
+    df["Amount Invested"] = pd.to_numeric(df["Amount Invested"], errors="coerce")
+
+    # Precompute the amount bucket for each row (unparseable amounts get no bucket)
+    amounts = df["Amount Invested"].to_numpy()
+    bucket_codes = np.select([amounts < 1, amounts <= 10, amounts > 10], [0, 1, 2], default=-1)
+    df["Amount Bucket"] = pd.Categorical.from_codes(bucket_codes, categories=AMOUNT_BUCKETS)
+
+    # Categorical columns keep their sorted unique values as the dropdown options
+    df["Type of Investment"] = df["Type of Investment"].astype("category")
+    df["Fair Value of the Investment"] = df["Fair Value of the Investment"].astype("category")
+
+    return df
+
+@st.cache_resource(ttl=3600, max_entries=64, show_spinner=False)
+def load_vc_investments_table(_vc_opportunity_scout, selected_funds, generation):
+    # Shared across reruns per fund selection and insight store generation, so a refresh builds a new table. Callers must not modify it
+    return build_vc_investments_table(_vc_opportunity_scout.fetch_investments_data(selected_funds))
+
 class VCOpportunityScout:
-    def __init__(self, aws_operations):
+    def __init__(self, aws_operations, fund_registry, insight_store):
         self.aws_operations = aws_operations
+        self.fund_registry = fund_registry
+        self.insight_store = insight_store
 
     def fetch_investments_data(self, selected_funds):
-        investments_data = []
-        for fund_name in selected_funds:
-            bucket_name = fund_name.split(" ")[0].lower()
-            file_name = f"{bucket_name}/{bucket_name}_investments.json"
-            try:
-                json_data = self.aws_operations.fetch_object(file_name, "venturecapitalfunds")
-                investments_data.extend(json.loads(json_data))
-            except Exception as e:
-                print(f"File not found: {file_name}")
-                print(f"Error: {str(e)}")
-        return investments_data
+        return self.insight_store.records("vc_investments", selected_funds)
     
     def run(self, fund_type, selected_funds):
         if not selected_funds:
@@ -893,68 +1692,63 @@ class VCOpportunityScout:
             return
         
         if fund_type == "Venture Capital Funds":
-            investments_data = self.fetch_investments_data(selected_funds)
-            investment_types = sorted(set(item["Type of Investment"] for item in investments_data))
+            investments_table = load_vc_investments_table(self, tuple(sorted(selected_funds)), self.insight_store.generation)
+            investment_types = list(investments_table["Type of Investment"].cat.categories)
             selected_investment_type = st.selectbox("Select Type of Investment", ["All"] + investment_types)
 
             # Add the "Select Amount Invested" filter
-            amount_invested_options = ["All", "<$1m", "$1m-$10m", ">$10m"]
+            amount_invested_options = ["All"] + AMOUNT_BUCKETS
             selected_amount_invested = st.selectbox("Select Amount Invested", amount_invested_options)
 
             # Add the "Fair Value of the Investment" filter
-            fair_value_options = sorted(set(item["Fair Value of the Investment"] for item in investments_data))
+            fair_value_options = list(investments_table["Fair Value of the Investment"].cat.categories)
             selected_fair_value = st.selectbox("Select Fair Value of the Investment", ["All"] + fair_value_options)
 
+            criteria = (tuple(selected_funds), selected_investment_type, selected_amount_invested, selected_fair_value)
             if st.button("Submit"):
-                filtered_data = investments_data
+                # Combine the filters as boolean masks over the categorical codes
+                mask = np.ones(len(investments_table), dtype=bool)
 
                 if selected_investment_type != "All":
-                    filtered_data = [item for item in filtered_data if item["Type of Investment"] == selected_investment_type]
+                    mask &= (investments_table["Type of Investment"] == selected_investment_type).to_numpy()
 
                 # Apply the "Select Amount Invested" filter
                 if selected_amount_invested != "All":
-                    if selected_amount_invested == "<$1m":
-                        filtered_data = [item for item in filtered_data if float(item["Amount Invested"]) < 1]
-                    elif selected_amount_invested == "$1m-$10m":
-                        filtered_data = [item for item in filtered_data if 1 <= float(item["Amount Invested"]) <= 10]
-                    else:  # ">$10m"
-                        filtered_data = [item for item in filtered_data if float(item["Amount Invested"]) > 10]
+                    mask &= (investments_table["Amount Bucket"] == selected_amount_invested).to_numpy()
 
                 # Apply the "Fair Value of the Investment" filter
                 if selected_fair_value != "All":
-                    filtered_data = [item for item in filtered_data if item["Fair Value of the Investment"] == selected_fair_value]
+                    mask &= (investments_table["Fair Value of the Investment"] == selected_fair_value).to_numpy()
 
-                if filtered_data:
-                    df = pd.DataFrame(filtered_data)
-                    df["Amount Invested"] = df["Amount Invested"].apply(lambda x: "${:,.2f}".format(float(x)))
-                    df = df[["Fund", "Date", "Company", "Type of Investment", "Amount Invested", "Date invested", "Fair Value of the Investment", "Summary"]]
-                    
-                    df.reset_index(drop=True, inplace=True)
+                st.session_state["vc_opportunity_scout_results"] = (criteria, investments_table[mask])
 
+            # Keep the submitted results across reruns so paging and sorting don't refetch anything
+            results = st.session_state.get("vc_opportunity_scout_results")
+            if results and results[0] == criteria:
+                filtered_data = results[1]
+                if len(filtered_data):
                     # Add the message to inform the user about double-clicking on a cell
                     st.write("**Double-click on a cell to see the full text.**")
 
-                    st.dataframe(df)
+                    # Amounts stay numeric for sorting and are only formatted for the visible page
+                    grid = PaginatedResultGrid("vc_opportunity_scout_grid")
+                    grid.render(filtered_data, VC_INVESTMENT_COLUMNS, formatters={"Amount Invested": format_amount})
                 else:
                     st.write("No data found for the selected filters.")
         else:
             st.write("This feature is not available for the selected fund type.")  
             
 class SpecificVCFundsSection:
-    def __init__(self, aws_operations, ai_response_generator, vc_document_fetcher):
+    def __init__(self, aws_operations, ai_response_generator, vc_document_fetcher, fund_registry, insight_store, semantic_cache=None):
         self.aws_operations = aws_operations
         self.ai_response_generator = ai_response_generator
         self.vc_document_fetcher = vc_document_fetcher
+        self.fund_registry = fund_registry
+        self.insight_store = insight_store
+        self.semantic_cache = semantic_cache
 
     def fetch_performance_data(self, selected_fund):
-        # Fetch the performance data from the JSON file in the S3 bucket
-        performance_data = self.aws_operations.fetch_object("vc_performance_insights.json", "venturecapitalfunds")
-        performance_data = json.loads(performance_data)
-
-        # Filter the performance data based on the selected fund
-        filtered_data = [obj for obj in performance_data if obj['Fund Name'] == selected_fund]
-
-        return filtered_data
+        return self.insight_store.records("vc_performance", [selected_fund])
 
     def display_performance_table(self, filtered_data):
         # Extract the relevant columns from the filtered data for the performance table
@@ -978,49 +1772,32 @@ class SpecificVCFundsSection:
 
         st.write(text)
 
-    def generate_vc_response(self, prompt, system_prompt, partner_letter, fund_name, date):
-        client = anthropic.Anthropic(api_key=self.ai_response_generator.api_key)
-        
+    def generate_vc_response(self, prompt, system_prompt, partner_letter, fund_name, date, fresh=False):
         # Create XML tags for the document
-        fund_name = fund_name.replace(" ", "").replace(",", "")
-        quarter = date.split(" ")[0].lower()
-        year = date.split(" ")[1]
-        tag = f"<{fund_name}_{year}_{quarter}>"
-        tagged_letter = f"{tag}\n{partner_letter}\n</{fund_name}_{year}_{quarter}>"
-        
-        message = client.messages.create(
-            model=CLAUDE_HAIKU,
-            max_tokens=2000,
-            temperature=0.2,
-            system=system_prompt,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": f"{tagged_letter}\n\n{prompt}"
-                        }
-                    ]
-                }
-            ]
-        )
-        
-        raw_text = message.content
-        answer = raw_text[0].text
-        
-        # Extract the content within <answer></answer> tags if present
-        answer_match = re.search(r'<answer>(.*?)</answer>', answer, re.DOTALL)
-        if answer_match:
-            answer = answer_match.group(1).strip()
-        
-        st.write(answer)
+        content = PromptContent()
+        content.add_letter(self.fund_registry.resolve(fund_name).letter_tag(date), partner_letter)
+
+        return self.ai_response_generator.create_answer(prompt, system_prompt, content, task="qa", fresh=fresh)
 
     def handle_ask_anything(self, selected_fund, filtered_data):
         user_input = st.text_input("Enter your question:")
+        fresh = st.checkbox("Generate a fresh answer", key="vc_ask_anything_fresh")
+        date = filtered_data[0]['Date']
+        criteria = (selected_fund, date, user_input)
+
+        # Only a click sends the question, reruns show the answer already received for the same inputs
+        if not st.button("Submit", key="vc_ask_anything_submit"):
+            previous = st.session_state.get("vc_ask_anything_answer")
+            if previous and previous[0] == criteria:
+                if previous[2]:
+                    display_cached_answer(previous[2])
+                else:
+                    st.write(previous[1])
+            return
 
-        if user_input:
-            date = filtered_data[0]['Date']
+        if not user_input:
+            st.warning("Please enter a question before submitting.")
+        else:
             partner_letter = self.vc_document_fetcher.fetch_vc_partner_letters(selected_fund, date)
 
             if partner_letter:
@@ -1042,7 +1819,20 @@ class SpecificVCFundsSection:
                 Please provide a detailed response based on the information in the quarterly letter from {selected_fund}. Make sure you cite your sources correctly and provide a well-structured answer.
                 """
 
-                self.generate_vc_response(message_prompt, system_prompt, partner_letter, selected_fund, date)
+                # A question already answered from this letter, however it was worded, is served without a model call
+                cache_scope = None
+                if self.semantic_cache:
+                    cache_scope = self.semantic_cache.scope("vc", self.fund_registry.resolve(selected_fund).fund_id, [date], [partner_letter])
+                cached = None if fresh or not cache_scope else self.semantic_cache.lookup(cache_scope, user_input)
+                if cached:
+                    st.session_state["vc_ask_anything_answer"] = (criteria, cached["answer"], cached)
+                    display_cached_answer(cached)
+                else:
+                    answer = self.generate_vc_response(message_prompt, system_prompt, partner_letter, selected_fund, date, fresh)
+                    if cache_scope:
+                        self.semantic_cache.store(cache_scope, user_input, answer)
+                    st.session_state["vc_ask_anything_answer"] = (criteria, answer, None)
+                    st.write(answer)
             else:
                 st.write("Partner letter not found for the selected fund and date.")
 
@@ -1071,19 +1861,533 @@ class SpecificVCFundsSection:
             else:
                 st.write("No performance data found for the selected fund.")
 
+# Paragraphs matching these are treated as boilerplate as soon as they repeat once
+BOILERPLATE_HINTS = re.compile(
+    r"\bpast performance\b|\bnot an offer\b|\bsolicitation\b|\bconfidential\b|\binformational purposes\b|\bforward[- ]looking\b|"
+    r"\bno assurance\b|\bdisclaimer\b|\binvestor relations\b|\bcontact us\b|\bwww\.|[\w.+-]+@[\w-]+(\.[\w-]+)+|"
+    r"^\s*(tel|phone|fax|e-?mail)\s*[:.]",
+    re.IGNORECASE | re.MULTILINE
+)
+
+class LetterCompactor:
+    def __init__(self, aws_operations, fund_registry, shingle_size=5, similarity=0.8, min_words=20):
+        self.aws_operations = aws_operations
+        self.fund_registry = fund_registry
+        self.shingle_size = shingle_size
+        self.similarity = similarity
+        self.min_words = min_words
+        self.report_lock = get_update_lock(COMPACTION_REPORT)
+
+    def hash_text(self, text):
+        return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def shingles(self, paragraph):
+        # Hash every run of shingle_size words, near-identical paragraphs share most of these
+        words = re.findall(r"\w+", paragraph.lower())
+        if not words:
+            return set()
+        if len(words) < max(self.shingle_size, self.min_words):
+            # Short blocks like signatures and contact lines are too short to shingle, they match on their normalized
+            # text instead. A single unhinted line is most likely a section heading and is never treated as boilerplate
+            if "\n" not in paragraph.strip() and not BOILERPLATE_HINTS.search(paragraph):
+                return set()
+            return {self.hash_text("exact:" + " ".join(words))}
+        return {
+            self.hash_text(" ".join(words[i:i + self.shingle_size]))
+            for i in range(len(words) - self.shingle_size + 1)
+        }
+
+    def find_repeated(self, letters):
+        # letters is a list of paragraph lists, one per quarter
+        signatures = [[self.shingles(paragraph) for paragraph in paragraphs] for paragraphs in letters]
+
+        index = {}
+        for letter_index, letter_signatures in enumerate(signatures):
+            for paragraph_index, signature in enumerate(letter_signatures):
+                for shingle in signature:
+                    index.setdefault(shingle, []).append((letter_index, paragraph_index))
+
+        repeated = {}
+        for letter_index, letter_signatures in enumerate(signatures):
+            for paragraph_index, signature in enumerate(letter_signatures):
+                if not signature:
+                    continue
+
+                # Count shared shingles with paragraphs of the fund's other letters
+                overlaps = Counter(other for shingle in signature for other in index[shingle] if other[0] != letter_index)
+                matching_letters = set()
+                for other, shared in overlaps.items():
+                    other_signature = signatures[other[0]][other[1]]
+                    if shared / (len(signature) + len(other_signature) - shared) >= self.similarity:
+                        matching_letters.add(other[0])
+
+                # Disclaimers and contact blocks only need to repeat once, anything else at least twice
+                required = 1 if BOILERPLATE_HINTS.search(letters[letter_index][paragraph_index]) else 2
+                if len(matching_letters) >= required:
+                    repeated[(letter_index, paragraph_index)] = len(matching_letters)
+        return repeated
+
+    def compact_paragraphs(self, letter_index, paragraphs, repeated):
+        compacted = []
+        for paragraph_index, paragraph in enumerate(paragraphs):
+            if (letter_index, paragraph_index) not in repeated:
+                compacted.append(paragraph)
+            elif not compacted or not compacted[-1].startswith("[Boilerplate omitted"):
+                # Runs of repeated paragraphs collapse into a single stub
+                compacted.append(f"[Boilerplate omitted: repeated in {repeated[(letter_index, paragraph_index)]} other letters from this fund]")
+        return "\n\n".join(compacted)
+
+    def compact_fund(self, record, job=None):
+        quarters = []
+        letters = []
+        originals = []
+        for quarter in record.quarters:
+            try:
+                text = self.aws_operations.fetch_object(record.letter_key(quarter), record.bucket)
+            except Exception as e:
+                print(f"File not found: {record.letter_key(quarter)}")
+                print(f"Error: {str(e)}")
+                continue
+            quarters.append(quarter)
+            originals.append(text)
+            letters.append(split_paragraphs(text))
+
+        repeated = self.find_repeated(letters)
+
+        report = {"letters": {}, "built_at": datetime.now().isoformat()}
+        for letter_index, quarter in enumerate(quarters):
+            compact_text = self.compact_paragraphs(letter_index, letters[letter_index], repeated)
+            self.aws_operations.upload_object(io.BytesIO(compact_text.encode("utf-8")), record.compact_key(quarter), record.bucket, content_type="text/plain; charset=utf-8")
+            report["letters"][quarter] = {
+                "original_tokens": estimate_tokens(originals[letter_index]),
+                "compact_tokens": estimate_tokens(compact_text),
+                "paragraphs_removed": sum(1 for key in repeated if key[0] == letter_index)
+            }
+            if job:
+                job.update(message=f"Compacted {quarter}")
+
+        original_tokens = sum(item["original_tokens"] for item in report["letters"].values())
+        compact_tokens = sum(item["compact_tokens"] for item in report["letters"].values())
+        report["original_tokens"] = original_tokens
+        report["compact_tokens"] = compact_tokens
+        report["reduction"] = round(1 - compact_tokens / original_tokens, 4) if original_tokens else 0.0
+
+        # Serialize report updates so concurrent compactions don't overwrite each other
+        with self.report_lock:
+            bucket_report = self.fund_registry.fetch_compaction_report(self.aws_operations, record.bucket)
+            bucket_report[record.fund_id] = report
+            self.aws_operations.upload_object(io.BytesIO(json.dumps(bucket_report, indent=2).encode("utf-8")), COMPACTION_REPORT, record.bucket, content_type="application/json")
+
+        record.compaction = report
+        return report
+
+    def run_compaction(self, job, fund_name):
+        report = self.compact_fund(self.fund_registry.resolve(fund_name), job)
+        return f"{report['reduction']:.0%} fewer tokens across {len(report['letters'])} letters"
+
+class LetterIngestor:
+    def __init__(self, aws_operations, fund_registry, letter_compactor):
+        self.aws_operations = aws_operations
+        self.fund_registry = fund_registry
+        self.letter_compactor = letter_compactor
+        self.catalog_lock = get_update_lock(UPLOADED_LETTERS_CATALOG)
+
+    def extract_text(self, fileobj):
+        if PdfReader is None:
+            raise RuntimeError("pypdf is required to extract text from uploaded PDFs")
+
+        fileobj.seek(0)
+        reader = PdfReader(fileobj)
+        pages = [page.extract_text() or "" for page in reader.pages]
+        return "\n\n".join(page.strip() for page in pages if page.strip())
+
+    def register_letter(self, record, quarter, raw_key):
+        # Serialize catalog updates so concurrent ingestions don't overwrite each other
+        with self.catalog_lock:
+            catalog = self.fund_registry.fetch_uploaded_letters(self.aws_operations, record.bucket)
+            catalog = [obj for obj in catalog if not (obj['Fund Name'] == record.display_name and obj['Date'] == quarter)]
+            catalog.append({"Fund Name": record.display_name, "Date": quarter, "Source": raw_key, "Uploaded": datetime.now().isoformat()})
+            self.aws_operations.upload_object(io.BytesIO(json.dumps(catalog, indent=2).encode('utf-8')), UPLOADED_LETTERS_CATALOG, record.bucket, content_type="application/json")
+
+        self.fund_registry.register(record.fund_type, record.display_name, quarter)
+
+    def ingest(self, job, fileobj, fund_type, fund_name, quarter):
+        record = self.fund_registry.resolve(fund_name) or self.fund_registry.make_record(fund_type, fund_name)
+        raw_key = f"{record.prefix}/raw/{record.display_name} {quarter}.pdf"
+
+        # Upload the original PDF, progress is reported per transferred part
+        total_bytes = max(1, fileobj.size if hasattr(fileobj, "size") else len(fileobj.getbuffer()))
+        uploaded_bytes = [0]
+
+        def on_progress(bytes_transferred):
+            uploaded_bytes[0] += bytes_transferred
+            job.update(0.6 * uploaded_bytes[0] / total_bytes)
+
+        job.update(0.0, "Uploading PDF")
+        self.aws_operations.upload_object(fileobj, raw_key, record.bucket, content_type="application/pdf", progress_callback=on_progress)
+
+        job.update(0.6, "Extracting text")
+        text = self.extract_text(fileobj)
+        if not text:
+            raise ValueError("No text could be extracted from the PDF")
+
+        # Write the text into the same cleaned/ layout the fetchers read from
+        job.update(0.8, "Writing cleaned letter")
+        letter_key = record.letter_key(quarter)
+        self.aws_operations.upload_object(io.BytesIO(text.encode('utf-8')), letter_key, record.bucket, content_type="text/plain; charset=utf-8")
+
+        job.update(0.9, "Registering letter in the catalog")
+        self.register_letter(record, quarter, raw_key)
+
+        # Re-run boilerplate detection now that the fund has another letter to compare against
+        job.update(0.95, "Compacting the fund's letters")
+        self.letter_compactor.compact_fund(self.fund_registry.resolve(record.fund_id), job)
+
+        return f"ingested as {letter_key}"
+
+INGEST_MANIFEST = "ingest_manifest.json"
+LETTER_KEY_PATTERN = re.compile(r"^(?P<prefix>[^/]+)/cleaned/(?P<fund>.+) (?P<quarter>\d{4} Q[1-4])\.txt$")
+
+# What the extraction pulls out of each letter, per fund type. Every part is one record for the
+# fund and quarter, except "holdings", which is a list, and each part lands in the dataset named by
+# EXTRACTION_DATASETS, either bucket-wide or in the fund's own file
+EXTRACTION_SCHEMAS = {
+    "Hedge Funds": {
+        "general": {
+            "Macro": "comma separated macro themes the letter discusses, e.g. Inflation, Interest Rates",
+            "Asset Classes": "comma separated asset classes the letter discusses, e.g. Equities, Credit",
+            "Geographies": "comma separated regions or countries the letter discusses",
+        },
+        "performance": {
+            "Quarterly Performance Net of Fees": "the quarter's net return in percent as a plain number, e.g. 3.2, or empty if not stated",
+            "Key Contributors to Performance": "what drove gains this quarter, with position names",
+            "Key Detractors from Performance": "what caused losses this quarter, with position names",
+            "Portfolio Positioning and Adjustments": "changes to exposure, sizing and positions, and why",
+        },
+        "holdings": {
+            "Company": "company name",
+            "Sector": "GICS style sector, e.g. Technology",
+            "PositionOpen": "Yes if the letter says the position was opened or pitched this quarter, otherwise No",
+            "PositionClose": "Yes if the letter says the position was exited this quarter, otherwise No",
+            "Description": "one sentence on the thesis or what was said about it",
+        },
+    },
+    "Venture Capital Funds": {
+        "performance": {
+            "Net IRR": "the fund's net IRR as stated, e.g. 18.5%",
+            "Percentage Capital Commitments Called": "share of commitments called to date as stated, e.g. 62%",
+            "Commentary on Fund Performance": "the manager's commentary on the fund's performance",
+            "Key Contributors to Performance": "portfolio companies or events that drove value up",
+            "Key Detractors from Performance": "portfolio companies or events that drove value down",
+            "Portfolio Positioning and Adjustments": "new investments, follow-ons, exits and changes in focus",
+        },
+        "holdings": {
+            "Company": "portfolio company name",
+            "Type of Investment": "e.g. Seed, Series A, Follow-on",
+            "Amount Invested": "amount invested in $m as a plain number, e.g. 2.5",
+            "Date invested": "when the investment was made, as stated",
+            "Fair Value of the Investment": "e.g. Above cost, At cost, Below cost",
+            "Summary": "one sentence on the company",
+        },
+    },
+}
+
+EXTRACTION_DATASETS = {
+    ("Hedge Funds", "general"): "hedgefund_general_insights.json",
+    ("Hedge Funds", "performance"): "hedgefund_performance_insights.json",
+    ("Hedge Funds", "holdings"): FundRecord.equities_key,
+    ("Venture Capital Funds", "performance"): "vc_performance_insights.json",
+    ("Venture Capital Funds", "holdings"): FundRecord.investments_key,
+}
+
+class DatasetBuilder:
+    # Builds the JSON datasets the app reads from the cleaned letters in the buckets. Only letters whose
+    # content changed since the last run (per the bucket's ingest manifest) are sent for extraction,
+    # and their fund and quarter replace whatever the datasets held for them before
+    def __init__(self, aws_operations, fund_registry, ai_response_generator, workers=8, mention_indexer=None):
+        self.aws_operations = aws_operations
+        self.fund_registry = fund_registry
+        self.ai_response_generator = ai_response_generator
+        self.workers = workers
+        self.mention_indexer = mention_indexer
+
+    def read_json(self, file_name, bucket, default):
+        # Uncached reads, the pipeline must merge into what is in the bucket right now
+        try:
+            return json.loads(self.aws_operations.get_object(file_name, bucket)[0])
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] == 'NoSuchKey':
+                return default
+            raise e
+
+    def write_json(self, data, file_name, bucket):
+        self.aws_operations.upload_object(io.BytesIO(json.dumps(data, indent=2).encode("utf-8")), file_name, bucket, content_type="application/json")
+
+    def list_letters(self, bucket):
+        letters = []
+        for key, etag in self.aws_operations.list_objects(bucket):
+            match = LETTER_KEY_PATTERN.match(key)
+            if match:
+                letters.append({"key": key, "etag": etag, "fund": match.group("fund"), "quarter": match.group("quarter")})
+        return letters
+
+    def changed_letters(self, bucket, letters, manifest, force=False):
+        # A matching ETag skips the download, otherwise the body is hashed so a re-upload of the same text is not re-extracted
+        changed = []
+        for letter in letters:
+            entry = manifest.get(letter["key"])
+            if entry and not force and entry.get("etag") == letter["etag"]:
+                continue
+            body = self.aws_operations.get_object(letter["key"], bucket)[0]
+            letter["hash"] = hashlib.sha256(body).hexdigest()
+            if entry and not force and entry.get("hash") == letter["hash"]:
+                entry["etag"] = letter["etag"]
+                continue
+            letter["text"] = body.decode("utf-8")
+            changed.append(letter)
+        return changed
+
+    def build_prompts(self, fund_type, fund_name, quarter):
+        schema = EXTRACTION_SCHEMAS[fund_type]
+        example = {part: [fields] if part == "holdings" else fields for part, fields in schema.items()}
+        system_prompt = f"""
+        You are an experienced investment analyst turning the quarterly partner letter from the fund {fund_name} for {quarter} into structured data.
+        Fill in the JSON template below from the letter. Every value describes what the field should contain, replace it with what the letter says.
+        "holdings" is a list with one object per company the letter names as a position, use an empty list if there are none.
+        Use an empty string for anything the letter does not state, never guess.
+        <schema>
+        {json.dumps(example, indent=2)}
+        </schema>
+        Present only the filled JSON object to the user within <answer></answer> tags.
+        """
+        message_prompt = f"Extract the structured data from the {fund_name} {quarter} letter above."
+        return message_prompt, system_prompt
+
+    def parse(self, fund_type, answer):
+        # Keep only the schema's fields, so a chatty or partial answer can't add columns to the datasets
+        data = json.loads(answer[answer.find("{"):answer.rfind("}") + 1])
+        parsed = {}
+        for part, fields in EXTRACTION_SCHEMAS[fund_type].items():
+            if part == "holdings":
+                parsed[part] = [{field: str(item.get(field, "") or "") for field in fields} for item in data.get(part) or [] if isinstance(item, dict)]
+            else:
+                values = data.get(part) or {}
+                parsed[part] = {field: str(values.get(field, "") or "") for field in fields}
+        return parsed
+
+    def extract(self, fund_type, record, letter):
+        message_prompt, system_prompt = self.build_prompts(fund_type, record.display_name, letter["quarter"])
+        content = PromptContent()
+        content.add_letter(record.letter_tag(letter["quarter"]), letter["text"])
+        answer = self.ai_response_generator.create_answer(message_prompt, system_prompt, content, task="extraction", temperature=0.0, session_id="ingest")
+        return self.parse(fund_type, answer)
+
+    def merge(self, fund_type, bucket, extracted):
+        # extracted maps (record, quarter) to parsed parts, each dataset is rewritten once with those rows replaced
+        written = []
+        for (dataset_type, part), target in EXTRACTION_DATASETS.items():
+            if dataset_type != fund_type:
+                continue
+            if callable(target):
+                # Per-fund files hold the fund's holdings with the quarter in "Date"
+                by_record = {}
+                for (record, quarter), parts in extracted.items():
+                    by_record.setdefault(record.fund_id, (record, {}))[1][quarter] = parts[part]
+                for record, quarters in by_record.values():
+                    file_name = target(record)
+                    rows = [row for row in self.read_json(file_name, bucket, []) if row.get("Date") not in quarters]
+                    for quarter, holdings in quarters.items():
+                        for holding in holdings:
+                            row = {"Fund": record.display_name, "Date": quarter, **holding} if fund_type == "Venture Capital Funds" else {**holding, "Date": quarter}
+                            rows.append(row)
+                    self.write_json(sorted(rows, key=lambda row: row["Date"]), file_name, bucket)
+                    written.append(file_name)
+            else:
+                replaced = {(record.fund_id, quarter) for record, quarter in extracted}
+                rows = [row for row in self.read_json(target, bucket, []) if (self.fund_registry.normalize(row.get("Fund Name", "").replace(", LP", "")), row.get("Date")) not in replaced]
+                rows += [{"Fund Name": record.display_name, "Date": quarter, **parts[part]} for (record, quarter), parts in extracted.items()]
+                self.write_json(sorted(rows, key=lambda row: (row["Fund Name"], row["Date"])), target, bucket)
+                written.append(target)
+        return written
+
+    def run(self, fund_types=None, force=False):
+        summary = {"letters": 0, "changed": 0, "extracted": 0, "failures": [], "written": [], "mentions": {}}
+        for fund_type in fund_types or list(EXTRACTION_SCHEMAS):
+            bucket = FUND_SOURCES[fund_type][0]
+            manifest = self.read_json(INGEST_MANIFEST, bucket, {})
+            previous_manifest = json.dumps(manifest, sort_keys=True)
+            letters = self.list_letters(bucket)
+            changed = self.changed_letters(bucket, letters, manifest, force)
+            summary["letters"] += len(letters)
+            summary["changed"] += len(changed)
+            print(f"{fund_type}: {len(changed)} of {len(letters)} letters changed")
+
+            # Extraction is model bound, threads keep many letters in flight while the rate governor paces them
+            extracted = {}
+            with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(changed) or 1)), thread_name_prefix="wybeai-ingest") as executor:
+                futures = {}
+                for letter in changed:
+                    record = self.fund_registry.resolve(letter["fund"]) or self.fund_registry.make_record(fund_type, letter["fund"])
+                    futures[executor.submit(self.extract, fund_type, record, letter)] = (record, letter)
+                for future in futures:
+                    record, letter = futures[future]
+                    try:
+                        extracted[(record, letter["quarter"])] = future.result()
+                        manifest[letter["key"]] = {"etag": letter["etag"], "hash": letter["hash"], "extracted_at": datetime.now().isoformat()}
+                    except Exception as e:
+                        print(f"Extraction failed: {letter['key']}")
+                        print(f"Error: {str(e)}")
+                        summary["failures"].append({"key": letter["key"], "error": str(e)})
+
+            if extracted:
+                summary["written"] += self.merge(fund_type, bucket, extracted)
+                summary["extracted"] += len(extracted)
+
+            # The manifest goes last, a crash before this point just re-extracts the same letters next time
+            listed = {letter["key"] for letter in letters}
+            manifest = {key: entry for key, entry in manifest.items() if key in listed}
+            if json.dumps(manifest, sort_keys=True) != previous_manifest:
+                self.write_json(manifest, INGEST_MANIFEST, bucket)
+
+            # Holdings may have gained companies, so the mention index is brought up to date after the merge
+            if self.mention_indexer:
+                summary["mentions"][fund_type] = self.mention_indexer.update(bucket, letters, force)
+        return summary
+
+@st.cache_resource(ttl=3600, show_spinner=False)
+def load_mention_index(_aws_operations):
+    sources = [(bucket, MENTION_INDEX) for bucket, _ in FUND_SOURCES.values()]
+
+    def build():
+        indexes = []
+        for bucket, file_name in sources:
+            try:
+                indexes.append(json.loads(_aws_operations.fetch_object(file_name, bucket)))
+            except botocore.exceptions.ClientError as e:
+                if e.response['Error']['Code'] == 'NoSuchKey':
+                    print(f"No mention index in bucket: {bucket}")
+                else:
+                    raise e
+        return MentionIndex(indexes).rows()
+
+    return MentionIndex.from_rows(load_shared_table(_aws_operations, "mention_index", sources, build))
+
+class CompanySearchSection:
+    def __init__(self, mention_index, fund_registry):
+        self.mention_index = mention_index
+        self.fund_registry = fund_registry
+
+    def display_counts(self, postings):
+        quarters, counts = self.mention_index.counts(postings)
+        option = {
+            "tooltip": {"trigger": "axis"},
+            "legend": {"data": list(counts)},
+            "xAxis": {"type": "category", "data": quarters},
+            "yAxis": {"type": "value", "name": "Mentions"},
+            "series": [{"name": fund, "type": "bar", "stack": "mentions", "data": values} for fund, values in counts.items()],
+        }
+        st_echarts(options=option, height="300px")
+
+    def run(self):
+        st.title("Company Search")
+        st.write(f"Find which funds discussed a company or ticker, and when. The index covers {len(self.mention_index.companies)} companies across {self.mention_index.letters} letters and is rebuilt by ingestion.")
+
+        query = st.text_input("Company or ticker:", key="company_search_query")
+        if not query:
+            return
+
+        started_at = time.perf_counter()
+        matches = self.mention_index.match(query)
+        if not matches:
+            st.write(f"No indexed company matches \"{query}\".")
+            return
+        company = matches[0] if len(matches) == 1 else st.selectbox("Matching companies", matches, key="company_search_match")
+
+        fund_names = st.multiselect("Limit to funds", sorted({fund for _, fund, _, _ in self.mention_index.mentions(company)}), key="company_search_funds")
+        postings = self.mention_index.mentions(company, fund_names)
+        elapsed = (time.perf_counter() - started_at) * 1000
+
+        if not postings:
+            st.write(f"No letter mentions {company}.")
+            return
+        funds = {fund for _, fund, _, _ in postings}
+        quarters = {quarter for quarter, _, _, _ in postings}
+        st.write(f"{len(postings)} mentions of {company} by {len(funds)} funds across {len(quarters)} quarters ({elapsed:.1f} ms)")
+        self.display_counts(postings)
+
+        # Latest quarters first, the postings themselves are stored oldest first
+        rows = [{"Quarter": quarter, "Fund": fund, "Snippet": snippet} for quarter, fund, _, snippet in reversed(postings)]
+        st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+
 class SourcesSection:
-    def __init__(self, aws_operations):
+    def __init__(self, aws_operations, fund_registry, job_runner, letter_ingestor, letter_compactor, letter_store):
         self.aws_operations = aws_operations
+        self.fund_registry = fund_registry
+        self.job_runner = job_runner
+        self.letter_ingestor = letter_ingestor
+        self.letter_compactor = letter_compactor
+        self.letter_store = letter_store
+
+    def display_cache_usage(self):
+        with st.expander("Cache usage"):
+            stats = self.letter_store.stats()
+            st.write(f"Letter store: {stats['letters']} letters, {stats['resident_bytes'] / 1e6:.1f} MB in memory and {stats['mapped_bytes'] / 1e6:.1f} MB mapped of a {stats['budget_bytes'] / 1e6:.0f} MB budget")
+            st.write(f"Hits: {stats['hits']}, misses: {stats['misses']}, evictions: {stats['evictions']} ({stats['eviction_rate']:.1%} of lookups)")
+            if self.aws_operations.single_flight:
+                flight_stats = self.aws_operations.single_flight.stats()
+                st.write(f"Requests: {flight_stats['calls']} sent, {flight_stats['coalesced']} joined an identical request already in flight")
+            s3_stats = self.aws_operations.latency_guard.stats()
+            st.write(f"S3 GETs: {s3_stats['requests']} recent, p50 {s3_stats['p50']:.2f}s, p95 {s3_stats['p95']:.2f}s, {s3_stats['hedged']} hedged ({s3_stats['hedge_wins']} won by the duplicate), {s3_stats['stale_served']} served stale")
+            if self.aws_operations.shared_cache:
+                st.table(pd.DataFrame(self.aws_operations.shared_cache.stats()).T)
+
+    def display_compaction(self, fund_type):
+        st.write("**Letter compaction:**")
+        fund_names = self.fund_registry.fund_names(fund_type)
+        if not fund_names:
+            return
+        fund_name = st.selectbox("Fund", fund_names, key=f"compaction_fund_{fund_type}")
+        record = self.fund_registry.resolve(fund_name)
+
+        if record.compaction:
+            # Token reduction measured when the compact letters were built
+            report_data = pd.DataFrame([
+                {"Quarter": quarter, "Original Tokens": item["original_tokens"], "Compact Tokens": item["compact_tokens"], "Paragraphs Removed": item["paragraphs_removed"]}
+                for quarter, item in sorted(record.compaction["letters"].items())
+            ])
+            st.write(f"Repeated boilerplate removal saves {record.compaction['reduction']:.0%} of the input tokens for {fund_name}.")
+            st.table(report_data)
+        else:
+            st.write(f"No compact letters have been built for {fund_name} yet.")
+
+        if st.button("Rebuild compact letters", key=f"compaction_button_{fund_type}"):
+            self.job_runner.submit("compaction", f"Compaction {fund_name}", self.letter_compactor.run_compaction, fund_name)
+
+    def display_jobs(self, kind, title):
+        jobs = self.job_runner.list_jobs(kind)
+        if not jobs:
+            return
 
-    def fetch_fund_names(self, bucket_name, fund_info_path):
-        # Fetch the JSON file from S3
-        json_data = self.aws_operations.fetch_object(fund_info_path, bucket_name)
-        fund_info_data = json.loads(json_data)
+        # Only poll while something is still running
+        run_every = 2 if any(job.is_active() for job in jobs) else None
+
+        @st.fragment(run_every=run_every)
+        def render_jobs():
+            current_jobs = self.job_runner.list_jobs(kind)
+            for job in current_jobs:
+                if job.status == "failed":
+                    st.error(f"{job.label}: {job.error}")
+                elif job.status == "done":
+                    st.success(f"{job.label}: {job.result}")
+                else:
+                    st.progress(job.progress, text=f"{job.label}: {job.message}")
 
-        # Get unique fund names
-        fund_names = set(obj['Fund Name'] for obj in fund_info_data)
+            # Do a full rerun once everything has finished so the polling stops
+            if run_every and not any(job.is_active() for job in current_jobs):
+                st.rerun()
 
-        return list(fund_names)
+        st.write(f"**{title}:**")
+        render_jobs()
 
     def run(self):
         source_option = st.radio(
@@ -1092,9 +2396,7 @@ class SourcesSection:
         )
 
         if source_option == "Hedge Fund Partner Letters":
-            bucket_name = "hedgefunds"
-            fund_info_path = "hedgefund_general_insights.json"
-            fund_names = self.fetch_fund_names(bucket_name, fund_info_path)
+            fund_names = self.fund_registry.fund_names("Hedge Funds")
 
             if len(fund_names) > 0:
                 # Create a one-column DataFrame with fund names
@@ -1103,6 +2405,7 @@ class SourcesSection:
                 # Display the DataFrame
                 st.write("Fund Names:")
                 st.dataframe(fund_data)
+                self.display_compaction("Hedge Funds")
             else:
                 st.write("No fund names found.")
 
@@ -1116,29 +2419,444 @@ class SourcesSection:
 
         # File upload section
         st.write("Upload your own documents:")
+        upload_fund_type = st.selectbox("Fund type", list(FUND_SOURCES), key="upload_fund_type")
+        upload_fund = st.selectbox("Fund", self.fund_registry.fund_names(upload_fund_type) + ["Other"], key="upload_fund")
+        if upload_fund == "Other":
+            upload_fund = st.text_input("Fund name", key="upload_fund_name").strip()
+        upload_quarter = st.text_input("Quarter of the letter (e.g. 2024 Q1)", key="upload_quarter").strip()
         uploaded_file = st.file_uploader("Choose a PDF file", type="pdf")
 
-        if uploaded_file is not None:
-            # Save the uploaded file to S3
-            self.aws_operations.upload_object(uploaded_file.getvalue(), uploaded_file.name)
-            st.success(f"File '{uploaded_file.name}' uploaded successfully!")
+        if uploaded_file is not None and st.button("Upload and ingest"):
+            if not upload_fund:
+                st.warning("Please enter the fund name before uploading.")
+            elif not re.fullmatch(r"\d{4} Q[1-4]", upload_quarter):
+                st.warning("Please enter the quarter in the format '2024 Q1'.")
+            else:
+                # Upload and ingestion run in the background so the page stays responsive
+                self.job_runner.submit("ingestion", f"{upload_fund} {upload_quarter}", self.letter_ingestor.ingest, uploaded_file, upload_fund_type, upload_fund, upload_quarter)
+                st.success(f"File '{uploaded_file.name}' queued for upload and ingestion.")
+
+        self.display_jobs("ingestion", "Ingestion jobs")
+        self.display_jobs("compaction", "Compaction jobs")
+        self.display_cache_usage()
+
+# The section analyses without the Streamlit UI, for scripts, notebooks and the command line
+class WybeAnalyst:
+    def __init__(self, aws_operations=None, api_key=ANTHROPIC_API_KEY):
+        self.aws_operations = aws_operations or AWSOperations(get_shared_cache(), single_flight=get_single_flight(), latency_guard=get_s3_latency_guard())
+        self.fund_registry = FundRegistry().load(self.aws_operations)
+        self.ai_response_generator = AIResponseGenerator(api_key, self.fund_registry, get_rate_governor(), get_model_router(), get_shared_cache(), get_single_flight())
+        self.document_fetcher = DocumentFetcher(self.aws_operations, self.fund_registry, get_letter_store())
+        self.insight_store = InsightStore(self.aws_operations, self.fund_registry).refresh(force=True)
+        self.performance_pulse = PerformancePulse(self.aws_operations, self.ai_response_generator, self.document_fetcher, self.fund_registry, None, self.insight_store)
+        self.market_mood_monitor = MarketMoodMonitor(self.aws_operations, self.ai_response_generator, self.document_fetcher, self.fund_registry, None, self.insight_store)
+        self.sector_cube = None
+        self.specific_funds_section = SpecificFundsSection(self.aws_operations, self.ai_response_generator, self.document_fetcher, self.fund_registry, None, None, self.insight_store)
+
+    def resolve_fund(self, fund):
+        record = self.fund_registry.resolve(fund)
+        if record is None:
+            raise ValueError(f"Unknown fund: {fund}")
+        return record
+
+    def quarter_range(self, quarters, start_quarter=None, end_quarter=None):
+        start_quarter = start_quarter or quarters[0]
+        end_quarter = end_quarter or quarters[-1]
+        return [quarter for quarter in quarters if start_quarter <= quarter <= end_quarter]
+
+    def all_quarters(self, fund_type="Hedge Funds"):
+        return sorted({quarter for record in self.fund_registry.funds.values() if record.fund_type == fund_type for quarter in record.quarters})
+
+    def list_funds(self, fund_type="Hedge Funds"):
+        return [
+            {"fund_id": record.fund_id, "name": record.display_name, "quarters": list(record.quarters)}
+            for record in sorted(self.fund_registry.funds.values(), key=lambda record: record.display_name)
+            if record.fund_type == fund_type
+        ]
+
+    def run_analysis(self, prompt, system_prompt, content, task, temperature=0.2, **context):
+        result = dict(context)
+        if not content:
+            result.update(answer=None, error="No letters or insights matched the selection.")
+            return result
+        result.update(self.ai_response_generator.create_message(prompt, system_prompt, content, task, temperature, session_id="cli"))
+        return result
+
+    def analyze_fund(self, fund, option, start_quarter=None, end_quarter=None, question=None, delta_mode=False):
+        record = self.resolve_fund(fund)
+        quarters = self.quarter_range(record.quarters, start_quarter, end_quarter) if record.quarters else []
+        if option == "Ask Anything":
+            if not question:
+                raise ValueError("Ask Anything needs a question")
+            message_prompt, system_prompt, partner_letters, fund_names_dates = self.specific_funds_section.handle_ask_anything(record.display_name, quarters, question)
+            task, focus, policy = "qa", question, "relevance"
+        elif option in PERFORMANCE_OPTIONS:
+            message_prompt, system_prompt, partner_letters, fund_names_dates = self.specific_funds_section.handle_performance_button_click(record.display_name, quarters, option, delta_mode and option == "Portfolio Positioning and Adjustments")
+            task = "synthesis" if option == "Portfolio Positioning and Adjustments" else "extraction"
+            focus, policy = option, "oldest"
+        else:
+            raise ValueError(f"Unknown analysis: {option}")
+
+        combined_letters, fund_names_dates, cuts = self.ai_response_generator.prepare_letters(message_prompt, system_prompt, partner_letters, fund_names_dates, focus, policy)
+        return self.run_analysis(message_prompt, system_prompt, combined_letters, task, fund=record.display_name, option=option, quarters=quarters, letters=fund_names_dates, cuts=cuts)
+
+    def pulse(self, funds, option, start_quarter=None, end_quarter=None, delta_mode=False):
+        if option not in PERFORMANCE_OPTIONS:
+            raise ValueError(f"Unknown analysis: {option}")
+        fund_names = [self.resolve_fund(fund).display_name for fund in funds]
+        quarters = self.quarter_range(self.all_quarters(), start_quarter, end_quarter)
+        filtered_data = self.performance_pulse.fetch_performance_data(fund_names, quarters[0], quarters[-1]) if quarters else []
+        message_prompt, system_prompt, aggregated_insights = self.performance_pulse.handle_dropdown_selection(option, filtered_data, delta_mode and option == "Portfolio Positioning and Adjustments")
+        analytics = load_performance_matrix(self.insight_store).analytics(self.insight_store.fund_ids(fund_names), quarters[0], quarters[-1]) if quarters else None
+        performance = performance_summary(analytics, self.fund_registry).astype(object).where(lambda df: df.notna(), None).to_dict("records") if analytics and analytics["fund_ids"] else []
+        content = aggregated_insights if filtered_data else ""
+        return self.run_analysis(message_prompt, system_prompt, content, "synthesis", 0.3, funds=fund_names, option=option, quarters=quarters, performance=performance)
+
+    def market_mood(self, analysis_type, themes, start_quarter=None, end_quarter=None, funds=None):
+        if analysis_type not in THEME_KEYS:
+            raise ValueError(f"Unknown analysis type: {analysis_type}")
+        fund_names = [self.resolve_fund(fund).display_name for fund in funds or []]
+        quarters = self.quarter_range(self.all_quarters(), start_quarter, end_quarter)
+        filtered_funds_data = self.market_mood_monitor.filter_theme_data(analysis_type, themes, fund_names, quarters[0], quarters[-1]) if quarters else []
+
+        letter_pairs = self.document_fetcher.fetch_letter_pairs([f"{obj['Fund Name']} {obj['Date']}" for obj in filtered_funds_data])
+        message_prompt, system_prompt = self.market_mood_monitor.build_theme_prompts(analysis_type, themes)
+        combined_letters, fund_names_dates, cuts = self.ai_response_generator.prepare_letters(message_prompt, system_prompt, [letter for _, letter in letter_pairs], [fund_name_date for fund_name_date, _ in letter_pairs], ", ".join(themes), policy="relevance")
+        return self.run_analysis(message_prompt, system_prompt, combined_letters, "synthesis", analysis_type=analysis_type, themes=list(themes), quarters=quarters, letters=fund_names_dates, cuts=cuts)
+
+    def themes(self, analysis_type):
+        if analysis_type not in THEME_KEYS:
+            raise ValueError(f"Unknown analysis type: {analysis_type}")
+        return self.market_mood_monitor.get_themes(analysis_type)
+
+    def sql(self, query, params=()):
+        # Read-only access to the insight tables, e.g. joining performance with general insights
+        if not re.match(r"\s*(SELECT|WITH)\b", query, re.IGNORECASE):
+            raise ValueError("Only SELECT queries are allowed")
+        return self.insight_store.query(query, params)
+
+    def top_sectors(self, funds, start_quarter=None, end_quarter=None, n=3):
+        # The cube is only built when sector questions are asked
+        if self.sector_cube is None:
+            self.sector_cube = load_sector_cube(self.insight_store)
+        fund_ids = [self.resolve_fund(fund).fund_id for fund in funds]
+        quarters = self.quarter_range(self.sector_cube.quarters, start_quarter, end_quarter)
+        if not quarters:
+            return {"funds": fund_ids, "quarters": [], "sectors": []}
+        sectors = self.sector_cube.top_sectors(fund_ids, quarters[0], quarters[-1], n=n)
+        return {"funds": fund_ids, "quarters": quarters, "sectors": [{"sector": sector, "count": count} for sector, count in sectors]}
+
+def run_ingest(args, model_client=None):
+    # With a storage directory the buckets are local folders, and the host's object cache is left out so merges see the latest datasets
+    s3_client = LocalS3(args.storage_dir) if args.storage_dir else None
+    aws_operations = AWSOperations(s3_client=s3_client)
+    fund_registry = FundRegistry().load(aws_operations)
+    ai_response_generator = AIResponseGenerator(ANTHROPIC_API_KEY, fund_registry, get_rate_governor(), get_model_router(), model_client=model_client)
+    return DatasetBuilder(aws_operations, fund_registry, ai_response_generator, args.workers, MentionIndexer(aws_operations)).run(args.types, args.force)
+
+PERFORMANCE_OPTIONS = ["Key Contributors to Performance", "Key Detractors from Performance", "Portfolio Positioning and Adjustments"]
+
+ANALYSIS_CHOICES = {
+    "contributors": "Key Contributors to Performance",
+    "detractors": "Key Detractors from Performance",
+    "positioning": "Portfolio Positioning and Adjustments",
+    "ask": "Ask Anything",
+}
+
+THEME_CHOICES = {
+    "macro": "Market Commentary",
+    "asset-class": "Asset Class",
+    "geography": "Geography",
+}
+
+CLI_COMMANDS = ("funds", "themes", "analyze", "pulse", "mood", "sectors", "sql", "report", "ingest", "snapshot")
+
+def build_cli_parser():
+    parser = argparse.ArgumentParser(prog="wybeai", description="Run the wybe.ai section analyses without the web UI.")
+    parser.add_argument("--json", action="store_true", help="print the full result as JSON")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_range(subparser):
+        subparser.add_argument("--start", help="first quarter, e.g. '2023 Q1' (default: earliest)")
+        subparser.add_argument("--end", help="last quarter, e.g. '2024 Q1' (default: latest)")
+
+    funds_parser = subparsers.add_parser("funds", help="list the registered funds")
+    funds_parser.add_argument("--type", default="Hedge Funds", choices=list(FUND_SOURCES))
+
+    themes_parser = subparsers.add_parser("themes", help="list the themes available to the mood analysis")
+    themes_parser.add_argument("analysis_type", choices=list(THEME_CHOICES))
+
+    analyze_parser = subparsers.add_parser("analyze", help="Specific Funds analysis of one fund's letters")
+    analyze_parser.add_argument("fund")
+    analyze_parser.add_argument("analysis", choices=list(ANALYSIS_CHOICES))
+    analyze_parser.add_argument("--question", help="question for the 'ask' analysis")
+    analyze_parser.add_argument("--delta", action="store_true", help="only send what changed between quarters (positioning)")
+    add_range(analyze_parser)
+
+    pulse_parser = subparsers.add_parser("pulse", help="Performance Pulse across several funds")
+    pulse_parser.add_argument("funds", nargs="+")
+    pulse_parser.add_argument("--analysis", default="contributors", choices=[choice for choice in ANALYSIS_CHOICES if choice != "ask"])
+    pulse_parser.add_argument("--delta", action="store_true", help="only send what changed between quarters (positioning)")
+    add_range(pulse_parser)
+
+    mood_parser = subparsers.add_parser("mood", help="Market Mood Monitor for one or more themes")
+    mood_parser.add_argument("analysis_type", choices=list(THEME_CHOICES))
+    mood_parser.add_argument("themes", nargs="+")
+    mood_parser.add_argument("--fund", action="append", dest="funds", help="limit to this fund (repeatable)")
+    add_range(mood_parser)
+
+    sectors_parser = subparsers.add_parser("sectors", help="top sectors across the funds' equity positions")
+    sectors_parser.add_argument("funds", nargs="+")
+    sectors_parser.add_argument("-n", type=int, default=3)
+    add_range(sectors_parser)
+
+    sql_parser = subparsers.add_parser("sql", help=f"run a SELECT against the insight tables ({', '.join(INSIGHT_TABLES)})")
+    sql_parser.add_argument("query")
+
+    report_parser = subparsers.add_parser("report", help="quarterly pack of the standard analyses for many funds, resumable")
+    report_parser.add_argument("funds", nargs="*", help="funds to include (default: every hedge fund)")
+    report_parser.add_argument("--analysis", action="append", dest="analyses", choices=[choice for choice in ANALYSIS_CHOICES if choice != "ask"], help="analysis to run per fund (repeatable, default: all)")
+    report_parser.add_argument("--workers", type=int, default=16, help="pieces in flight at once, the rate governor still paces the model calls")
+    report_parser.add_argument("--out-dir", default=os.path.join(".wybeai", "reports"), help="where checkpoints and the Markdown/HTML report go")
+    add_range(report_parser)
+
+    ingest_parser = subparsers.add_parser("ingest", help="extract the insight and holdings datasets from new or changed cleaned letters")
+    ingest_parser.add_argument("--type", action="append", dest="types", choices=list(EXTRACTION_SCHEMAS), help="fund type to ingest (repeatable, default: all)")
+    ingest_parser.add_argument("--storage-dir", help="read and write a local directory laid out as <bucket>/<key> instead of S3")
+    ingest_parser.add_argument("--workers", type=int, default=8, help="letters extracted at once, the rate governor still paces the model calls")
+    ingest_parser.add_argument("--force", action="store_true", help="re-extract every letter, not just the changed ones")
+
+    subparsers.add_parser("snapshot", help="write the parsed-table snapshot new workers start from, e.g. before a deploy")
+
+    return parser
+
+def format_cli_result(command, result):
+    if command == "funds":
+        return "\n".join(f"{fund['name']} ({fund['fund_id']}): {', '.join(fund['quarters'])}" for fund in result)
+    if command == "themes":
+        return "\n".join(result)
+    if command == "sql":
+        return pd.DataFrame(result).to_string(index=False) if result else "No rows."
+    if command == "sectors":
+        return "\n".join(f"{row['sector']}: {row['count']}" for row in result["sectors"]) or "No sectors found."
+    if command == "snapshot":
+        if result is None:
+            return "No snapshot written, pyarrow is required."
+        return f"Wrote {result['path']} ({result['bytes'] / 1e6:.1f} MB): " + ", ".join(f"{name} {rows}" for name, rows in result["rows"].items())
+    if command == "ingest":
+        lines = [f"{result['extracted']} of {result['changed']} changed letters extracted ({result['letters']} letters in total)"]
+        lines += [f"Failed: {failure['key']}: {failure['error']}" for failure in result["failures"]]
+        lines += [f"{fund_type} mention index: {stats['mentions']} mentions of {stats['companies']} companies, {stats['scanned']} letters scanned" for fund_type, stats in result["mentions"].items()]
+        return "\n".join(lines + [f"Wrote {file_name}" for file_name in result["written"]])
+    if command == "report":
+        lines = [f"{result['pieces']} pieces ({result['resumed']} from checkpoints) in {result['wall_time']}s, slowest fund {result['slowest_fund']}s"]
+        lines += [f"Failed: {failure['fund']} / {failure['option']}: {failure['error']}" for failure in result["failures"]]
+        return "\n".join(lines + [result["markdown"], result["html"]])
+    if result.get("answer") is None:
+        return result["error"]
+    return result["answer"]
+
+def cli_main(argv=None):
+    parser = build_cli_parser()
+    args = parser.parse_args(argv)
+    if args.command == "ingest":
+        # Ingestion builds the datasets a live analyst would load, so it runs without one
+        result = run_ingest(args)
+        print(json.dumps(result, indent=2) if args.json else format_cli_result(args.command, result))
+        return 0
+    analyst = WybeAnalyst()
+
+    try:
+        if args.command == "funds":
+            result = analyst.list_funds(args.type)
+        elif args.command == "themes":
+            result = analyst.themes(THEME_CHOICES[args.analysis_type])
+        elif args.command == "analyze":
+            result = analyst.analyze_fund(args.fund, ANALYSIS_CHOICES[args.analysis], args.start, args.end, args.question, args.delta)
+        elif args.command == "pulse":
+            result = analyst.pulse(args.funds, ANALYSIS_CHOICES[args.analysis], args.start, args.end, args.delta)
+        elif args.command == "mood":
+            result = analyst.market_mood(THEME_CHOICES[args.analysis_type], args.themes, args.start, args.end, args.funds)
+        elif args.command == "sql":
+            result = analyst.sql(args.query)
+        elif args.command == "snapshot":
+            result = get_table_snapshot().write(analyst.aws_operations, analyst.fund_registry, analyst.insight_store)
+        elif args.command == "report":
+            funds = args.funds or [fund["fund_id"] for fund in analyst.list_funds()]
+            analyses = [ANALYSIS_CHOICES[choice] for choice in args.analyses] if args.analyses else PERFORMANCE_OPTIONS
+            result = BulkReport(analyst, funds, analyses, args.start, args.end, args.out_dir, args.workers).run()
+        else:
+            result = analyst.top_sectors(args.funds, args.start, args.end, args.n)
+    except (ValueError, sqlite3.Error) as e:
+        parser.error(str(e))
+
+    print(json.dumps(result, indent=2) if args.json else format_cli_result(args.command, result))
+    return 0
+
+# A sample's time goes to the innermost frame that matches one of these, checked against "file:qualname"
+PROFILE_PHASES = (
+    ("S3", ("/botocore/", "/boto3/", "AWSOperations.", "S3LatencyGuard.", "StandInS3.")),
+    ("Model", ("/anthropic/", "AIResponseGenerator.call_model", "StandInModel.")),
+    ("json", ("/json/",)),
+    ("SQLite", ("InsightStore.", "SharedCache.")),
+    ("pandas", ("/pandas/",)),
+    ("numpy", ("/numpy/",)),
+    ("Streamlit", ("/streamlit/",)),
+)
+
+class SectionProfiler:
+    def __init__(self, name, interval=0.005):
+        self.name = name
+        self.interval = interval
+        self.frames = {}
+        self.samples = []
+        self.started_at = self.ended_at = time.perf_counter()
+        self.done = threading.Event()
+
+    def __enter__(self):
+        # Sample the calling thread from a side thread, the profiled code itself runs untouched
+        self.thread_id = threading.get_ident()
+        self.root = sys._getframe(1)
+        self.started_at = time.perf_counter()
+        self.sampler = threading.Thread(target=self.sample, name="wybeai-profiler", daemon=True)
+        self.sampler.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.done.set()
+        self.sampler.join()
+        self.ended_at = time.perf_counter()
+        return False
+
+    def sample(self):
+        sampled_at = time.perf_counter()
+        while not self.done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            stack = []
+            while frame is not None and frame is not self.root:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            if stack:
+                self.samples.append((self.phase(stack), [self.frame_index(code) for code in reversed(stack)], now - sampled_at))
+            sampled_at = now
+
+    def frame_index(self, code):
+        key = (code.co_qualname, code.co_filename, code.co_firstlineno)
+        if key not in self.frames:
+            self.frames[key] = len(self.frames)
+        return self.frames[key]
+
+    def phase(self, stack):
+        for code in stack:
+            location = f"{code.co_filename}:{code.co_qualname}"
+            for phase, patterns in PROFILE_PHASES:
+                if any(pattern in location for pattern in patterns):
+                    return phase
+        return "App"
+
+    def phases(self):
+        seconds = Counter()
+        for phase, _, weight in self.samples:
+            seconds[phase] += weight
+        return seconds.most_common()
+
+    def speedscope(self):
+        # https://www.speedscope.app/file-format-schema.json, one sampled profile per rerun
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "wybeai",
+            "shared": {"frames": [{"name": name, "file": file_name, "line": line} for name, file_name, line in self.frames]},
+            "profiles": [{
+                "type": "sampled",
+                "name": self.name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": self.ended_at - self.started_at,
+                "samples": [stack for _, stack, _ in self.samples],
+                "weights": [weight for _, _, weight in self.samples],
+            }],
+        }
 
-def main():
+    def write(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        slug = re.sub(r'[^a-z0-9]+', '-', self.name.lower()).strip("-")
+        session = re.sub(r'[^A-Za-z0-9]', '', get_session_id())[:8]
+        path = os.path.join(directory, f"{datetime.now():%Y%m%d-%H%M%S}-{slug}-{session}.speedscope.json")
+        with open(path, "w") as f:
+            json.dump(self.speedscope(), f)
+        return path
+
+def profiling_requested(name):
+    # WYBEAI_PROFILE=1 profiles every section, or list the sections, e.g. "Performance Pulse,Market Mood Monitor"
+    setting = os.getenv("WYBEAI_PROFILE", "")
+    if setting == "1" or name in [section.strip() for section in setting.split(",")]:
+        return True
+
+    # Admins can profile a page on demand with ?profile=<WYBEAI_PROFILE_TOKEN> in the URL
+    token = os.getenv("WYBEAI_PROFILE_TOKEN")
+    return bool(token) and hmac.compare_digest(st.query_params.get("profile", ""), token)
+
+def profile_section(name, run, *args):
+    # Unprofiled reruns pay for one env lookup, nothing else
+    if not profiling_requested(name):
+        return run(*args)
+
+    profiler = SectionProfiler(name, interval=float(os.getenv("WYBEAI_PROFILE_INTERVAL_MS", "5")) / 1000)
+    try:
+        with profiler:
+            result = run(*args)
+    finally:
+        # Reruns and st.stop() leave through here too, their profile is still worth keeping
+        try:
+            path = profiler.write(os.getenv("WYBEAI_PROFILE_DIR", ".wybeai/profiles"))
+        except OSError as e:
+            print(f"Could not write profile: {name}")
+            print(f"Error: {str(e)}")
+            path = None
+    display_profile(profiler, path)
+    return result
+
+def display_profile(profiler, path):
+    elapsed = profiler.ended_at - profiler.started_at
+    sampled = sum(weight for _, _, weight in profiler.samples) or 1.0
+    with st.expander(f"Profile: {profiler.name} took {elapsed:.2f}s"):
+        st.table(pd.DataFrame(
+            [(phase, f"{seconds:.3f}", f"{seconds / sampled:.0%}") for phase, seconds in profiler.phases()],
+            columns=["Phase", "Seconds", "Share"]
+        ))
+        st.caption(f"{len(profiler.samples)} samples every {profiler.interval * 1000:.0f} ms of this rerun's thread, analyses running in the background are not included.")
+        if path:
+            st.caption(f"Flamegraph written to {path}, open it at https://www.speedscope.app")
+
+def main(s3_client=None, model_client=None):
     st.set_page_config(layout="wide")
-    aws_operations = AWSOperations()
-    ai_response_generator = AIResponseGenerator(ANTHROPIC_API_KEY)
-    document_fetcher = DocumentFetcher(aws_operations)
-    market_mood_monitor = MarketMoodMonitor(aws_operations, ai_response_generator, "hedgefund_general_insights.json", document_fetcher)
-    sources_section = SourcesSection(aws_operations)
-    performance_pulse = PerformancePulse(aws_operations, ai_response_generator, document_fetcher)
-    specific_funds_section = SpecificFundsSection(aws_operations, ai_response_generator, document_fetcher)
-    vc_document_fetcher = VCDocumentFetcher(aws_operations)
-    specific_vc_funds_section = SpecificVCFundsSection(aws_operations, ai_response_generator, vc_document_fetcher)
-    vc_opportunity_scout = VCOpportunityScout(aws_operations) 
+    shared_cache = get_shared_cache()
+    single_flight = get_single_flight()
+    letter_store = get_letter_store()
+    aws_operations = AWSOperations(shared_cache, single_flight=single_flight, latency_guard=get_s3_latency_guard(), s3_client=s3_client, letter_store=letter_store)
+    fund_registry = load_fund_registry(aws_operations)
+    job_runner = get_job_runner()
+    rate_governor = get_rate_governor()
+    model_router = get_model_router()
+    ai_response_generator = AIResponseGenerator(ANTHROPIC_API_KEY, fund_registry, rate_governor, model_router, shared_cache, single_flight, model_client=model_client)
+    document_fetcher = DocumentFetcher(aws_operations, fund_registry, letter_store)
+    insight_store = load_insight_store(aws_operations, fund_registry)
+    market_mood_monitor = MarketMoodMonitor(aws_operations, ai_response_generator, document_fetcher, fund_registry, job_runner, insight_store)
+    letter_compactor = LetterCompactor(aws_operations, fund_registry)
+    letter_ingestor = LetterIngestor(aws_operations, fund_registry, letter_compactor)
+    sources_section = SourcesSection(aws_operations, fund_registry, job_runner, letter_ingestor, letter_compactor, letter_store)
+    performance_pulse = PerformancePulse(aws_operations, ai_response_generator, document_fetcher, fund_registry, job_runner, insight_store)
+    sector_cube = load_sector_cube(insight_store)
+    specific_funds_section = SpecificFundsSection(aws_operations, ai_response_generator, document_fetcher, fund_registry, job_runner, sector_cube, insight_store, get_semantic_cache())
+    vc_document_fetcher = VCDocumentFetcher(aws_operations, fund_registry)
+    specific_vc_funds_section = SpecificVCFundsSection(aws_operations, ai_response_generator, vc_document_fetcher, fund_registry, insight_store, get_semantic_cache())
+    vc_opportunity_scout = VCOpportunityScout(aws_operations, fund_registry, insight_store)
 
     selected_option = st.sidebar.radio(
         "Navigation",
-        ("Home", "Bird's-Eye View", "Specific Funds", "Sources")
+        ("Home", "Bird's-Eye View", "Specific Funds", "Company Search", "Sources")
     )
 
     if selected_option == "Home":
@@ -1180,8 +2898,8 @@ def main():
                 fund_insights_path = None
 
             if fund_insights_path:
-                selected_funds = select_funds(aws_operations, bucket_name, fund_insights_path)
-                formatted_selected_funds = format_fund_names(selected_funds, fund_type)
+                selected_funds = select_funds(fund_registry, fund_type)
+                formatted_selected_funds = format_fund_names(fund_registry, selected_funds)
             else:
                 formatted_selected_funds = []
         else:
@@ -1189,28 +2907,28 @@ def main():
 
         if asset_allocator_option == "Opportunity Scout":
             if fund_type == "Hedge Funds":
-                opportunity_scout = OpportunityScout(aws_operations, bucket_name)
+                opportunity_scout = OpportunityScout(aws_operations, bucket_name, fund_registry, sector_cube, insight_store)
                 st.title("Opportunity Scout")
                 st.subheader(f"Extract Key Insights about your {fund_type} Performance")
                 st.write("The Opportunity Scout allows you to filter and analyze companies from the selected hedge funds based on sectors, date range, and investment status (pitched or exited).")
-                opportunity_scout.run(fund_type, formatted_selected_funds)
+                profile_section("Opportunity Scout", opportunity_scout.run, fund_type, formatted_selected_funds)
             elif fund_type == "Venture Capital Funds":
                 st.title("Opportunity Scout")
                 st.subheader(f"Extract Key Insights about your {fund_type} Performance")
-                vc_opportunity_scout.run(fund_type, formatted_selected_funds)
+                profile_section("VC Opportunity Scout", vc_opportunity_scout.run, fund_type, formatted_selected_funds)
             else:
                 st.write("This feature is not available for the selected fund type.")
         elif asset_allocator_option == "Performance Pulse":
             st.title("Performance Pulse")
             st.subheader(f"Extract Key Insights about your {fund_type} Performance")
             st.write("Performance Pulse provides an overview of the quarterly performance of the selected funds. It fetches performance data from the database and sends it to GenAI for analysis.")
-            performance_pulse.run(selected_funds)
+            profile_section("Performance Pulse", performance_pulse.run, selected_funds)
         elif asset_allocator_option == "Strategy Scanner":
             st.write("Implement the logic for 'Strategy Scanner'")
         elif asset_allocator_option == "Market Mood Monitor":
             st.title("Market Mood Monitor")
             st.write("Market Mood Monitor allows you to analyze the sentiment and perspectives of the selected hedge funds on various market commentary themes, asset classes, or geographies. It fetches relevant data from the partner letters and sends it to the GenAI model, which extracts insights and provides a detailed overview of the funds' views on the selected themes.")
-            market_mood_monitor.run(selected_funds)
+            profile_section("Market Mood Monitor", market_mood_monitor.run, selected_funds)
         elif asset_allocator_option == "Compliance Compass":
             st.write("Implement the logic for 'Compliance Compass'")
 
@@ -1281,38 +2999,35 @@ def main():
         bucket_name = get_bucket_name(fund_type)
         
         if bucket_name:
-            fund_info_path = "hedgefund_general_insights.json" if fund_type == "Hedge Funds" else "vc_performance_insights.json"
-            fund_names = fetch_fund_names(aws_operations, bucket_name, fund_info_path)
+            fund_names = fund_registry.fund_names(fund_type)
             selected_fund = st.sidebar.selectbox(f"Select a {fund_type}", fund_names)
             
             if fund_type == "Hedge Funds":
-                specific_funds_section.run(selected_fund)
+                profile_section("Specific Funds", specific_funds_section.run, selected_fund)
             elif fund_type == "Venture Capital Funds":
-                specific_vc_funds_section.run(selected_fund)
+                profile_section("Specific VC Funds", specific_vc_funds_section.run, selected_fund)
             else:  # Private Equity Funds
                 st.write("Logic for PE funds will come soon!")
             
+    elif selected_option == "Company Search":
+        company_search_section = CompanySearchSection(load_mention_index(aws_operations), fund_registry)
+        profile_section("Company Search", company_search_section.run)
+
     elif selected_option == "Sources":
-        sources_section.run()
+        profile_section("Sources", sources_section.run)
 
 def get_bucket_name(fund_type):
-    bucket_map = {
-        "Hedge Funds": "hedgefunds",
-        "Venture Capital Funds": "venturecapitalfunds"
-    }
-    return bucket_map.get(fund_type)
+    bucket, _ = FUND_SOURCES.get(fund_type, (None, None))
+    return bucket
 
-def select_funds(aws_operations, bucket_name, fund_insights_path):
-    fund_names = fetch_fund_names(aws_operations, bucket_name, fund_insights_path)
-    fund_names_list = list(fund_names)
+def select_funds(fund_registry, fund_type):
+    fund_names_list = fund_registry.fund_names(fund_type)
     selected_funds = st.sidebar.multiselect("Select Funds", fund_names_list)
     return selected_funds
 
-def format_fund_names(fund_names, fund_type):
-    if fund_type == "Hedge Funds":
-        return [fund.lower().replace(" ", "") for fund in fund_names]
-    else:
-        return fund_names
+def format_fund_names(fund_registry, fund_names):
+    # Map the selected display names onto their stable registry ids
+    return [fund_registry.resolve(fund).fund_id for fund in fund_names]
 
 def display_selected_funds(selected_funds):
     if selected_funds:
@@ -1323,4 +3038,8 @@ def display_selected_funds(selected_funds):
         st.write("No funds selected.")
 
 if __name__ == '__main__':
+    # "python testv14_without_API.py analyze ..." runs headless, anything else is the Streamlit app
+    # A script run context means Streamlit is executing the app, whatever argv says
+    if get_script_run_ctx() is None and len(sys.argv) > 1 and sys.argv[1].lstrip("-") in CLI_COMMANDS + ("json",):
+        sys.exit(cli_main(sys.argv[1:]))
     main()
\ No newline at end of file
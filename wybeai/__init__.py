@@ -0,0 +1 @@
+# Subsystems of the Streamlit app that do not depend on Streamlit, the app imports them from here
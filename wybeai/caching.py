@@ -0,0 +1,227 @@
+import os
+import time
+import sqlite3
+import threading
+import numpy as np
+import botocore.exceptions
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED, TimeoutError as FutureTimeoutError
+
+# Bump when the layout of cached tables or answers changes, older entries are then ignored
+SHARED_CACHE_SCHEMA = "2"
+
+class SharedCache:
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.counters = Counter()
+
+        # One SQLite file per host, every server process reads and writes the same entries
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache_entries (namespace TEXT, key TEXT, version TEXT, value BLOB, size INTEGER, stored_at REAL, PRIMARY KEY (namespace, key))")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_entries_stored_at ON cache_entries (stored_at)")
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def count(self, namespace, outcome):
+        with self.lock:
+            self.counters[(namespace, outcome)] += 1
+
+    def get(self, namespace, key, version=None):
+        # Returns (value, version, stored_at), entries written for another version count as a miss
+        try:
+            with self.connect() as conn:
+                row = conn.execute("SELECT value, version, stored_at FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, key)).fetchone()
+        except sqlite3.Error as e:
+            print(f"Shared cache read failed: {namespace} {key}")
+            print(f"Error: {str(e)}")
+            row = None
+
+        if row is None or (version is not None and row[1] != version):
+            self.count(namespace, "misses")
+            return None
+        self.count(namespace, "hits")
+        return bytes(row[0]), row[1], row[2]
+
+    def version(self, namespace, key):
+        try:
+            with self.connect() as conn:
+                row = conn.execute("SELECT version, stored_at FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, key)).fetchone()
+        except sqlite3.Error:
+            return None
+        return row
+
+    def put(self, namespace, key, value, version=""):
+        # The replace and any eviction commit together, readers see the old entry or the new one
+        try:
+            with self.connect() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.execute("INSERT OR REPLACE INTO cache_entries VALUES (?, ?, ?, ?, ?, ?)", (namespace, key, version, sqlite3.Binary(value), len(value), time.time()))
+                    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache_entries").fetchone()[0]
+                    if total > self.max_bytes:
+                        self.evict(conn, total - self.max_bytes)
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+        except sqlite3.Error as e:
+            print(f"Shared cache write failed: {namespace} {key}")
+            print(f"Error: {str(e)}")
+
+    def evict(self, conn, excess):
+        # Oldest entries go first
+        freed = 0
+        for namespace, key, size in conn.execute("SELECT namespace, key, size FROM cache_entries ORDER BY stored_at").fetchall():
+            if freed >= excess:
+                break
+            conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, key))
+            freed += size
+            self.count(namespace, "evictions")
+
+    def touch(self, namespace, key):
+        try:
+            with self.connect() as conn:
+                conn.execute("UPDATE cache_entries SET stored_at = ? WHERE namespace = ? AND key = ?", (time.time(), namespace, key))
+        except sqlite3.Error:
+            pass
+
+    def invalidate(self, namespace, key):
+        try:
+            with self.connect() as conn:
+                conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, key))
+        except sqlite3.Error:
+            pass
+
+    def stats(self):
+        with self.connect() as conn:
+            rows = conn.execute("SELECT namespace, COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries GROUP BY namespace").fetchall()
+        with self.lock:
+            counters = dict(self.counters)
+        return {
+            namespace: {
+                "entries": entries,
+                "bytes": size,
+                "hits": counters.get((namespace, "hits"), 0),
+                "misses": counters.get((namespace, "misses"), 0),
+                "evictions": counters.get((namespace, "evictions"), 0)
+            }
+            for namespace, entries, size in rows
+        }
+
+class S3LatencyGuard:
+    def __init__(self, hedge=False, hedge_min_delay=0.2, stale_timeout=2.0, max_workers=16):
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.stale_timeout = stale_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="wybeai-s3")
+        # Revalidations wait on GETs, so they get their own pool and can never starve it
+        self.background = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="wybeai-s3-revalidate")
+        self.latencies = deque(maxlen=500)
+        self.lock = threading.Lock()
+        self.counters = Counter()
+
+    def timed(self, request):
+        started_at = time.time()
+        result = request()
+        with self.lock:
+            self.latencies.append(time.time() - started_at)
+        return result
+
+    def hedge_delay(self):
+        # Send the duplicate once the primary is slower than 95% of recent GETs
+        with self.lock:
+            latencies = list(self.latencies)
+        if len(latencies) < 20:
+            return max(self.hedge_min_delay, 1.0)
+        return max(self.hedge_min_delay, float(np.percentile(latencies, 95)))
+
+    def get(self, request):
+        if not self.hedge:
+            return self.timed(request)
+
+        primary = self.executor.submit(self.timed, request)
+        done, _ = wait([primary], timeout=self.hedge_delay())
+        if done:
+            return primary.result()
+
+        # First successful response wins, the slower one is left to finish on its own
+        with self.lock:
+            self.counters["hedged"] += 1
+        backup = self.executor.submit(self.timed, request)
+        pending = {primary, backup}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is backup:
+                        with self.lock:
+                            self.counters["hedge_wins"] += 1
+                    return future.result()
+        return primary.result()
+
+    def revalidate(self, revalidation, stale_value, label):
+        # Revalidation gets a short deadline, after that the stale copy is served and the request finishes in the background
+        future = self.background.submit(revalidation)
+        try:
+            return future.result(timeout=self.stale_timeout)
+        except FutureTimeoutError:
+            print(f"Serving stale copy while revalidating: {label}")
+        except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+            if isinstance(e, botocore.exceptions.ClientError) and e.response['Error']['Code'] == 'NoSuchKey':
+                raise e
+            print(f"Serving stale copy after a failed revalidation: {label}")
+            print(f"Error: {str(e)}")
+        with self.lock:
+            self.counters["stale_served"] += 1
+        return stale_value
+
+    def stats(self):
+        with self.lock:
+            latencies = list(self.latencies)
+            counters = dict(self.counters)
+        return {
+            "requests": len(latencies),
+            "p50": float(np.percentile(latencies, 50)) if latencies else 0.0,
+            "p95": float(np.percentile(latencies, 95)) if latencies else 0.0,
+            "hedged": counters.get("hedged", 0),
+            "hedge_wins": counters.get("hedge_wins", 0),
+            "stale_served": counters.get("stale_served", 0)
+        }
+
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.counters = Counter()
+
+    def do(self, key, fn):
+        # The first caller for a key runs fn, identical calls arriving meanwhile wait for its result
+        with self.lock:
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.in_flight[key] = future
+            self.counters["calls" if leader else "coalesced"] += 1
+
+        if not leader:
+            return future.result()
+
+        # Anything fn raises, KeyboardInterrupt and SystemExit included, is handed to the waiters and re-raised here
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+        return future.result()
+
+    def stats(self):
+        with self.lock:
+            return {"in_flight": len(self.in_flight), "calls": self.counters["calls"], "coalesced": self.counters["coalesced"]}
@@ -0,0 +1,249 @@
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import botocore.exceptions
+
+# Extra columns pulled out of each record so they can be filtered and indexed, the full record stays in "data"
+INSIGHT_TABLES = {
+    "performance": {"net_return": ("Quarterly Performance Net of Fees", "REAL")},
+    "general_insights": {"macro": ("Macro", "TEXT"), "asset_classes": ("Asset Classes", "TEXT"), "geographies": ("Geographies", "TEXT")},
+    "vc_performance": {},
+    "equities": {"sector": ("Sector", "TEXT"), "position_open": ("PositionOpen", "TEXT"), "position_close": ("PositionClose", "TEXT")},
+    "vc_investments": {"investment_type": ("Type of Investment", "TEXT"), "amount": ("Amount Invested", "REAL"), "fair_value": ("Fair Value of the Investment", "TEXT")},
+}
+
+# Datasets that live in one file per bucket, the per-fund ones are listed by the registry
+INSIGHT_DATASETS = {
+    "performance": ("hedgefunds", "hedgefund_performance_insights.json"),
+    "general_insights": ("hedgefunds", "hedgefund_general_insights.json"),
+    "vc_performance": ("venturecapitalfunds", "vc_performance_insights.json"),
+}
+
+class InsightStore:
+    def __init__(self, aws_operations, fund_registry, refresh_interval=300):
+        self.aws_operations = aws_operations
+        self.fund_registry = fund_registry
+        self.refresh_interval = refresh_interval
+        self.refreshed_at = 0.0
+        self.lock = threading.RLock()
+        # Held for a whole refresh so only one thread fetches from S3 at a time, queries only take self.lock
+        self.refresh_lock = threading.Lock()
+        self.generation = 0
+        self.derived_values = {}
+        self.etags = {}
+
+        # In-memory SQLite, loaded from the JSON datasets and reloaded per file when its content changes
+        self.conn = sqlite3.connect(":memory:", check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("CREATE TABLE sources (source TEXT PRIMARY KEY, version TEXT)")
+        for table, columns in INSIGHT_TABLES.items():
+            extra_columns = "".join(f", {column} {column_type}" for column, (_, column_type) in columns.items())
+            self.conn.execute(f"CREATE TABLE {table} (source TEXT, position INTEGER, fund_id TEXT, fund_name TEXT, quarter TEXT{extra_columns}, data TEXT)")
+            self.conn.execute(f"CREATE INDEX {table}_fund_quarter ON {table} (fund_id, quarter)")
+            self.conn.execute(f"CREATE INDEX {table}_quarter ON {table} (quarter)")
+
+    def sources(self):
+        sources = [(table, bucket, file_name, None) for table, (bucket, file_name) in INSIGHT_DATASETS.items()]
+        for record in self.fund_registry.funds.values():
+            if record.fund_type == "Hedge Funds":
+                sources.append(("equities", record.bucket, record.equities_key(), record))
+            elif record.fund_type == "Venture Capital Funds":
+                sources.append(("vc_investments", record.bucket, record.investments_key(), record))
+        return sources
+
+    def use_registry(self, fund_registry):
+        # The registry is reloaded hourly and the new one can add or drop funds, the store follows it
+        if fund_registry is self.fund_registry:
+            return self
+        with self.lock:
+            self.fund_registry = fund_registry
+            # Clearing the versions makes the next refresh parse every file again against the new registry
+            with self.conn:
+                self.conn.execute("UPDATE sources SET version = ''")
+            self.refreshed_at = 0.0
+        return self
+
+    def is_stale(self):
+        return time.time() - self.refreshed_at >= self.refresh_interval
+
+    def refresh(self, force=False):
+        # Waits for the store to be current, used when it is first loaded
+        self.refresh_lock.acquire()
+        if not force and not self.is_stale():
+            self.refresh_lock.release()
+            return self
+        self.reload()
+        return self
+
+    def refresh_in_background(self):
+        # Queries never wait on S3, one thread refreshes a stale store while they keep reading the loaded rows
+        if not self.is_stale() or not self.refresh_lock.acquire(blocking=False):
+            return
+        threading.Thread(target=self.reload, name="wybeai-insights", daemon=True).start()
+
+    def reload(self):
+        # Runs with self.refresh_lock held by the caller and releases it. Files are fetched without the store's
+        # lock, each changed file is then swapped in on its own
+        try:
+            sources = self.sources()
+            for table, bucket, file_name, record in sources:
+                fetched = self.fetch_source(bucket, file_name)
+                if fetched is not None:
+                    with self.lock:
+                        self.load_source(table, bucket, file_name, record, *fetched)
+            with self.lock:
+                self.drop_sources(set(f"{bucket}/{file_name}" for _, bucket, file_name, _ in sources))
+                self.refreshed_at = time.time()
+        except Exception as e:
+            print("Could not refresh insight tables")
+            print(f"Error: {str(e)}")
+        finally:
+            self.refresh_lock.release()
+
+    def fetch_source(self, bucket, file_name):
+        # The ETag of the body that was read, a restarted worker revalidates its snapshot against it
+        try:
+            return self.aws_operations.fetch_versioned(file_name, bucket)
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchKey':
+                print(f"Could not refresh dataset: {bucket}/{file_name}")
+                print(f"Error: {str(e)}")
+                return None
+            return "[]", None
+
+    def drop_sources(self, current):
+        # Files of funds no longer in the registry are removed with their rows
+        dropped = [row["source"] for row in self.conn.execute("SELECT source FROM sources") if row["source"] not in current]
+        if not dropped:
+            return
+        with self.conn:
+            for source in dropped:
+                for table in INSIGHT_TABLES:
+                    self.conn.execute(f"DELETE FROM {table} WHERE source = ?", (source,))
+                self.conn.execute("DELETE FROM sources WHERE source = ?", (source,))
+                self.etags.pop(source, None)
+        self.generation += 1
+
+    def load_source(self, table, bucket, file_name, record, text, etag):
+        # Called under self.lock with the file's current text, the ETag is what a restarted worker checks its snapshot against
+        source = f"{bucket}/{file_name}"
+        self.etags[source] = etag
+        version = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        row = self.conn.execute("SELECT version FROM sources WHERE source = ?", (source,)).fetchone()
+        if row and row[0] == version:
+            return
+
+        try:
+            items = json.loads(text)
+        except ValueError as e:
+            print(f"Could not parse dataset: {source}")
+            print(f"Error: {str(e)}")
+            return
+
+        columns = INSIGHT_TABLES[table]
+        rows = []
+        for position, obj in enumerate(items):
+            fund_record = record or self.fund_registry.resolve(obj.get('Fund Name', ''))
+            fund_id = fund_record.fund_id if fund_record else self.fund_registry.normalize(obj.get('Fund Name', ''))
+            fund_name = obj.get('Fund Name') or (fund_record.display_name if fund_record else None)
+            values = [self.column_value(obj.get(key), column_type) for key, column_type in columns.values()]
+            rows.append([source, position, fund_id, fund_name, obj.get('Date')] + values + [json.dumps(obj)])
+
+        # Swap the file's rows in one transaction, queries never see it half loaded
+        placeholders = ", ".join("?" * (6 + len(columns)))
+        with self.conn:
+            self.conn.execute(f"DELETE FROM {table} WHERE source = ?", (source,))
+            self.conn.executemany(f"INSERT INTO {table} (source, position, fund_id, fund_name, quarter{''.join(', ' + column for column in columns)}, data) VALUES ({placeholders})", rows)
+            self.conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?)", (source, version))
+        self.generation += 1
+
+    def snapshot_tables(self):
+        # Every table's rows as columns, plus the content version and ETag of each source file
+        with self.lock:
+            tables = {}
+            for table, columns in INSIGHT_TABLES.items():
+                names = ["source", "position", "fund_id", "fund_name", "quarter"] + list(columns) + ["data"]
+                rows = self.conn.execute(f"SELECT {', '.join(names)} FROM {table} ORDER BY source, position").fetchall()
+                tables[table] = {name: [row[i] for row in rows] for i, name in enumerate(names)}
+            sources = {row["source"]: {"version": row["version"], "etag": self.etags.get(row["source"])} for row in self.conn.execute("SELECT source, version FROM sources")}
+            return tables, sources
+
+    def restore(self, tables, sources):
+        # Load rows parsed by an earlier worker, the sources keep their versions so later refreshes skip unchanged files
+        with self.lock:
+            with self.conn:
+                for table, columns in tables.items():
+                    names = list(columns)
+                    self.conn.executemany(f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})", zip(*columns.values()))
+                self.conn.executemany("INSERT OR REPLACE INTO sources VALUES (?, ?)", [(source, entry["version"]) for source, entry in sources.items()])
+            self.etags.update({source: entry["etag"] for source, entry in sources.items()})
+            self.refreshed_at = time.time()
+            self.generation += 1
+        return self
+
+    def column_value(self, value, column_type):
+        if value is None:
+            return None
+        if column_type == "REAL":
+            try:
+                return float(value)
+            except (ValueError, TypeError):
+                return None
+        return str(value)
+
+    def query(self, sql, params=()):
+        # The one entry point every section goes through
+        self.refresh_in_background()
+        with self.lock:
+            return [dict(row) for row in self.conn.execute(sql, params).fetchall()]
+
+    def fund_ids(self, fund_names):
+        fund_ids = []
+        for name in fund_names:
+            record = self.fund_registry.resolve(name)
+            fund_ids.append(record.fund_id if record else self.fund_registry.normalize(name))
+        return fund_ids
+
+    def records(self, table, fund_names=None, start_quarter=None, end_quarter=None, where=None, params=()):
+        # Returns the original records, in dataset order, for the given funds and inclusive quarter range
+        clauses = []
+        clause_params = []
+        if fund_names is not None:
+            fund_ids = self.fund_ids(fund_names)
+            clauses.append(f"fund_id IN ({', '.join('?' * len(fund_ids)) or 'NULL'})")
+            clause_params.extend(fund_ids)
+        if start_quarter:
+            clauses.append("quarter >= ?")
+            clause_params.append(start_quarter)
+        if end_quarter:
+            clauses.append("quarter <= ?")
+            clause_params.append(end_quarter)
+        if where:
+            clauses.append(where)
+            clause_params.extend(params)
+
+        sql = f"SELECT data FROM {table}"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY source, position"
+        return [json.loads(row["data"]) for row in self.query(sql, clause_params)]
+
+    def derived(self, name, build):
+        # Values computed from the tables are rebuilt only after a reload changed the data
+        self.refresh_in_background()
+        with self.lock:
+            cached = self.derived_values.get(name)
+            if cached and cached[0] == self.generation:
+                return cached[1]
+            value = build(self)
+            self.derived_values[name] = (self.generation, value)
+            return value
+
+    def distinct_values(self, table, column):
+        # Comma separated lists are split, so every individual value is returned once
+        values = set()
+        for row in self.query(f"SELECT DISTINCT {column} FROM {table} WHERE {column} IS NOT NULL"):
+            values.update(row[column].split(", "))
+        return sorted(values)
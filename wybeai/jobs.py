@@ -0,0 +1,184 @@
+import os
+import json
+import uuid
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_RETENTION_HOURS = float(os.getenv("WYBEAI_JOB_RETENTION_HOURS", "72"))
+JOB_HISTORY_LIMIT = int(os.getenv("WYBEAI_JOB_HISTORY_LIMIT", "500"))
+
+class Job:
+    def __init__(self, job_id, kind, label):
+        self.job_id = job_id
+        self.kind = kind
+        self.label = label
+        # Sessions that submitted this job, a deduplicated job belongs to each of them
+        self.sessions = set()
+        self.status = "queued"
+        self.progress = 0.0
+        self.message = "Waiting for a worker"
+        self.result = None
+        self.error = None
+        self.created_at = datetime.now()
+        self.updated_at = self.created_at
+        self.lock = threading.Lock()
+
+    def update(self, progress=None, message=None):
+        # Called from worker threads (and boto3 transfer threads) while the job runs
+        with self.lock:
+            if progress is not None:
+                self.progress = min(1.0, max(0.0, progress))
+            if message is not None:
+                self.message = message
+            self.updated_at = datetime.now()
+
+    def is_active(self):
+        return self.status in ("queued", "running")
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "label": self.label,
+            "sessions": sorted(self.sessions),
+            "status": self.status,
+            "message": self.message,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat()
+        }
+
+    @staticmethod
+    def from_dict(data):
+        job = Job(data["job_id"], data["kind"], data["label"])
+        job.sessions = set(data.get("sessions", []))
+        job.status = data["status"]
+        job.message = data["message"]
+        job.result = data["result"]
+        job.error = data["error"]
+        job.progress = 1.0 if job.status == "done" else 0.0
+        job.created_at = datetime.fromisoformat(data["created_at"])
+        job.updated_at = datetime.fromisoformat(data["updated_at"])
+        return job
+
+class JobRunner:
+    def __init__(self, max_workers=4, store_dir=None, retention_hours=JOB_RETENTION_HOURS, max_jobs=JOB_HISTORY_LIMIT):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="wybeai-job")
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.store_dir = store_dir
+        self.retention = timedelta(hours=retention_hours)
+        self.max_jobs = max_jobs
+
+        if self.store_dir:
+            os.makedirs(self.store_dir, exist_ok=True)
+            self.load_jobs()
+        with self.lock:
+            expired = self.evict()
+        self.forget(expired)
+
+    def load_jobs(self):
+        for file_name in os.listdir(self.store_dir):
+            if not file_name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.store_dir, file_name), encoding="utf-8") as f:
+                    job = Job.from_dict(json.load(f))
+            except (ValueError, KeyError, OSError) as e:
+                print(f"Could not load job record: {file_name}")
+                print(f"Error: {str(e)}")
+                continue
+
+            # Jobs that were still running when the process stopped will never finish
+            if job.is_active():
+                job.status = "failed"
+                job.error = "Interrupted by a server restart"
+            self.jobs[job.job_id] = job
+
+    def evict(self):
+        # Called under self.lock: finished jobs past the retention window go first, then the oldest beyond the cap
+        cutoff = datetime.now() - self.retention
+        finished = sorted((job for job in self.jobs.values() if not job.is_active()), key=lambda job: job.updated_at)
+        expired = [job for job in finished if job.updated_at < cutoff]
+        remaining = [job for job in finished if job.updated_at >= cutoff]
+        expired += remaining[:max(0, len(self.jobs) - len(expired) - self.max_jobs)]
+        for job in expired:
+            del self.jobs[job.job_id]
+        return expired
+
+    def forget(self, expired):
+        if not self.store_dir:
+            return
+
+        for job in expired:
+            try:
+                os.remove(os.path.join(self.store_dir, f"{job.job_id}.json"))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Could not remove job record: {job.job_id}")
+                print(f"Error: {str(e)}")
+
+    def persist(self, job):
+        if not self.store_dir:
+            return
+
+        # Write to a temporary file first so readers never see a half-written record
+        path = os.path.join(self.store_dir, f"{job.job_id}.json")
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(job.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    def submit(self, kind, label, fn, *args, dedup_key=None, session_id=None):
+        # Identical requests share one job, whether it is still running or already done
+        job_id = hashlib.sha256(dedup_key.encode("utf-8")).hexdigest()[:32] if dedup_key else uuid.uuid4().hex
+        with self.lock:
+            existing = self.jobs.get(job_id)
+            if existing and existing.status != "failed":
+                joined = session_id is not None and session_id not in existing.sessions
+                if joined:
+                    existing.sessions.add(session_id)
+            else:
+                job = Job(job_id, kind, label)
+                if session_id is not None:
+                    job.sessions.add(session_id)
+                self.jobs[job.job_id] = job
+                existing = None
+            expired = self.evict()
+
+        self.forget(expired)
+        if existing:
+            if joined:
+                self.persist(existing)
+            return existing
+
+        self.persist(job)
+        self.executor.submit(self.run_job, job, fn, args)
+        return job
+
+    def run_job(self, job, fn, args):
+        job.status = "running"
+        job.update(message="Running")
+        try:
+            job.result = fn(job, *args)
+            job.status = "done"
+            job.update(1.0, "Done")
+        except Exception as e:
+            print(f"Job failed: {job.kind} {job.label}")
+            print(f"Error: {str(e)}")
+            job.error = str(e)
+            job.status = "failed"
+            job.update(message="Failed")
+        self.persist(job)
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list_jobs(self, kind=None, session_id=None):
+        with self.lock:
+            jobs = [job for job in self.jobs.values() if (kind is None or job.kind == kind) and (session_id is None or session_id in job.sessions)]
+        return sorted(jobs, key=lambda job: job.created_at, reverse=True)
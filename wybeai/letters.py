@@ -0,0 +1,154 @@
+import os
+import time
+import uuid
+import mmap
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+
+from wybeai.routing import estimate_tokens
+
+class LetterStore:
+    def __init__(self, max_bytes, mirror_dir=None, ttl=3600):
+        self.max_bytes = max_bytes
+        self.mirror_dir = mirror_dir
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.resident_bytes = 0
+        self.mapped_bytes = 0
+        self.counters = Counter()
+
+    def get(self, bucket, file_name, fetch):
+        # Letters are kept as UTF-8 bytes (or a read-only mapping of the local mirror), never as decoded strings
+        key = (bucket, file_name)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and time.time() - entry[1] < self.ttl and self.mirror_current(bucket, file_name, entry[1]):
+                self.entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return entry[0]
+            self.counters["misses"] += 1
+
+        data = self.load(bucket, file_name, fetch)
+        with self.lock:
+            self.discard(key)
+            self.entries[key] = (data, time.time())
+            if isinstance(data, mmap.mmap):
+                self.mapped_bytes += len(data)
+            else:
+                self.resident_bytes += len(data)
+            self.evict()
+        return data
+
+    def load(self, bucket, file_name, fetch):
+        if not self.mirror_dir:
+            return bytes(fetch())
+
+        # The mirror is shared by every worker on the host, mapped pages come from the OS page cache
+        path = self.mirror_path(bucket, file_name)
+        try:
+            fresh = time.time() - os.path.getmtime(path) < self.ttl
+        except OSError:
+            fresh = False
+        if not fresh:
+            data = fetch()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            if not data:
+                return b""
+
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def mirror_path(self, bucket, file_name):
+        return os.path.join(self.mirror_dir, bucket, file_name)
+
+    def mirror_current(self, bucket, file_name, loaded_at):
+        # Another worker on the host removes or rewrites the mirror file when the letter is uploaded again
+        if not self.mirror_dir:
+            return True
+        try:
+            return os.path.getmtime(self.mirror_path(bucket, file_name)) <= loaded_at
+        except OSError:
+            return False
+
+    def invalidate(self, bucket, file_name):
+        # An uploaded letter must not be served from memory or from the host mirror afterwards
+        with self.lock:
+            self.discard((bucket, file_name))
+        if not self.mirror_dir:
+            return
+        try:
+            os.remove(self.mirror_path(bucket, file_name))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Could not remove mirrored letter: {bucket}/{file_name}")
+            print(f"Error: {str(e)}")
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        # Mappings are closed once the last prompt still holding a view drops it
+        if isinstance(entry[0], mmap.mmap):
+            self.mapped_bytes -= len(entry[0])
+        else:
+            self.resident_bytes -= len(entry[0])
+
+    def evict(self):
+        # Least recently used letters go first until the store fits its budget again
+        while self.resident_bytes + self.mapped_bytes > self.max_bytes and len(self.entries) > 1:
+            self.discard(next(iter(self.entries)))
+            self.counters["evictions"] += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                "letters": len(self.entries),
+                "resident_bytes": self.resident_bytes,
+                "mapped_bytes": self.mapped_bytes,
+                "budget_bytes": self.max_bytes,
+                "hits": self.counters["hits"],
+                "misses": self.counters["misses"],
+                "evictions": self.counters["evictions"],
+                "eviction_rate": self.counters["evictions"] / lookups if lookups else 0.0
+            }
+
+def letter_text(letter):
+    # For the few places that need to work on the words of a letter rather than pass it through
+    return letter if isinstance(letter, str) else str(letter, "utf-8")
+
+class PromptContent:
+    # The documents of one request as separate content parts, one per tagged letter or block of insights. Requests
+    # are identified by each part's tag and the ETag of its body, so keys never copy the letters into one string
+    def __init__(self, text=None):
+        self.parts = []
+        self.identities = []
+        self.tokens = 0
+        if text:
+            self.add_part(text, ["text", hashlib.md5(text.encode("utf-8")).hexdigest()])
+
+    def add_letter(self, tag, letter):
+        # The MD5 S3 reports as the ETag of a single-part upload, taken over the letter's buffer without a copy
+        data = letter.encode("utf-8") if isinstance(letter, str) else letter
+        self.add_part(f"<{tag}>\n{letter_text(letter)}\n</{tag}>", [tag, hashlib.md5(data).hexdigest()])
+
+    def add_part(self, text, identity):
+        self.parts.append(text)
+        self.identities.append(identity)
+        self.tokens += estimate_tokens(text)
+
+    def __len__(self):
+        return len(self.parts)
+
+    @staticmethod
+    def of(content):
+        return content if isinstance(content, PromptContent) else PromptContent(content)
@@ -0,0 +1,220 @@
+import re
+import io
+import json
+import hashlib
+import botocore.exceptions
+from datetime import datetime
+from collections import Counter, deque
+
+MENTION_INDEX = "mention_index.json"
+COMPANY_LIST = "companies.json"
+COMPANY_SUFFIX = re.compile(r"[,.]?\s+(inc|incorporated|corp|corporation|co|company|ltd|limited|plc|holdings|group|sa|ag|nv|se|llc|lp)\.?$", re.IGNORECASE)
+COMPANY_DESCRIPTOR = re.compile(r"\s+(platforms|technologies|technology|systems|networks|software|international|industries|enterprises|brands|therapeutics|pharmaceuticals|communications|labs)$", re.IGNORECASE)
+# Bump when the matching rules change, every letter is then rescanned
+MENTION_MATCHING_VERSION = 2
+
+def company_aliases(name):
+    # "Apple Inc." is mostly written "Apple" and "Meta Platforms" "Meta", strip legal suffixes and then generic
+    # descriptors, keeping aliases long enough to be distinctive
+    aliases = {name.strip()}
+    stripped = name.strip()
+    while COMPANY_SUFFIX.search(stripped):
+        stripped = COMPANY_SUFFIX.sub("", stripped).strip()
+    if len(stripped) >= 3:
+        aliases.add(stripped)
+    short = stripped
+    while COMPANY_DESCRIPTOR.search(short):
+        short = COMPANY_DESCRIPTOR.sub("", short).strip()
+    if len(short) >= 3:
+        aliases.add(short)
+    return sorted(alias for alias in aliases if alias)
+
+class MentionAutomaton:
+    # Aho-Corasick over lowercased aliases, one pass over a letter finds every alias at once
+    def __init__(self, patterns):
+        # patterns maps an alias, as it is written, to (company, case_sensitive)
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for pattern, payload in patterns.items():
+            state = 0
+            for char in pattern.lower():
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].append((pattern, payload))
+
+        # Breadth first, so every state's failure link points at an already finished shallower state
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def find(self, text):
+        # Leftmost-longest whole-word matches as (start, end, company)
+        lowered = text.lower()
+        matches = []
+        state = 0
+        for end, char in enumerate(lowered, 1):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for pattern, (company, case_sensitive) in self.output[state]:
+                start = end - len(pattern)
+                if (start > 0 and lowered[start - 1].isalnum()) or (end < len(lowered) and lowered[end].isalnum()):
+                    continue
+                # Names keep the capital they are written with, so "price target" or "building block" are no mentions
+                if text[start] != pattern[0] or (case_sensitive and text[start:end] != pattern):
+                    continue
+                matches.append((start, end, company))
+
+        accepted = []
+        covered_until = 0
+        for start, end, company in sorted(matches, key=lambda match: (match[0], -match[1])):
+            if start >= covered_until:
+                accepted.append((start, end, company))
+                covered_until = end
+        return accepted
+
+class MentionIndexer:
+    # Positional postings of company and ticker mentions per letter, kept in the bucket's mention index
+    # and only rescanned for letters that changed, or for all of them when the company list changed
+    def __init__(self, aws_operations, snippet_chars=100):
+        self.aws_operations = aws_operations
+        self.snippet_chars = snippet_chars
+
+    def read_json(self, file_name, bucket, default):
+        try:
+            return json.loads(self.aws_operations.get_object(file_name, bucket)[0])
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] == 'NoSuchKey':
+                return default
+            raise e
+
+    def companies(self, bucket, listing):
+        # Every company in the bucket's holdings files, plus the hand-maintained list that can add tickers
+        companies = {}
+        holdings_keys = [key for key, _ in listing if key.endswith("_equities.json") or key.endswith("_investments.json")]
+        for entry in self.read_json(COMPANY_LIST, bucket, []) + [row for key in holdings_keys for row in self.read_json(key, bucket, [])]:
+            name = (entry.get("Company") or "").strip()
+            if not name:
+                continue
+            company = companies.setdefault(name, {"aliases": company_aliases(name), "ticker": None})
+            if entry.get("Ticker"):
+                company["ticker"] = entry["Ticker"].strip().upper()
+        return dict(sorted(companies.items()))
+
+    def automaton(self, companies):
+        # Names match from their first letter as written, tickers only in capitals so "ON" or "ALL" don't fire on ordinary words
+        patterns = {}
+        for name, company in companies.items():
+            for alias in company["aliases"]:
+                patterns.setdefault(alias, (name, False))
+            if company["ticker"] and len(company["ticker"]) >= 2:
+                patterns.setdefault(company["ticker"], (name, True))
+        return MentionAutomaton(patterns)
+
+    def scan(self, automaton, text):
+        mentions = []
+        for start, end, company in automaton.find(text):
+            snippet = " ".join(text[max(0, start - self.snippet_chars):end + self.snippet_chars].split())
+            mentions.append([company, start, snippet])
+        return mentions
+
+    def update(self, bucket, letters, force=False):
+        listing = self.aws_operations.list_objects(bucket)
+        companies = self.companies(bucket, listing)
+        companies_hash = hashlib.sha256(json.dumps([MENTION_MATCHING_VERSION, companies], sort_keys=True).encode("utf-8")).hexdigest()
+
+        index = self.read_json(MENTION_INDEX, bucket, {})
+        rescan = force or index.get("companies_hash") != companies_hash
+        entries = {} if rescan else index.get("letters", {})
+        automaton = self.automaton(companies)
+
+        scanned = 0
+        for letter in letters:
+            entry = entries.get(letter["key"])
+            if entry and entry["etag"] == letter["etag"]:
+                continue
+            text = letter.get("text") or self.aws_operations.get_object(letter["key"], bucket)[0].decode("utf-8")
+            entries[letter["key"]] = {"fund": letter["fund"], "quarter": letter["quarter"], "etag": letter["etag"], "mentions": self.scan(automaton, text)}
+            scanned += 1
+
+        listed = {letter["key"] for letter in letters}
+        entries = {key: entry for key, entry in entries.items() if key in listed}
+        if scanned or rescan or len(entries) != len(index.get("letters", {})):
+            index = {"companies_hash": companies_hash, "companies": companies, "letters": entries, "built_at": datetime.now().isoformat()}
+            self.aws_operations.upload_object(io.BytesIO(json.dumps(index).encode("utf-8")), MENTION_INDEX, bucket, content_type="application/json")
+        return {"companies": len(companies), "scanned": scanned, "mentions": sum(len(entry["mentions"]) for entry in entries.values())}
+
+class MentionIndex:
+    # The mention indexes of every bucket held in memory, answering company lookups without touching the letters
+    def __init__(self, indexes):
+        self.companies = {}
+        self.postings = {}
+        self.letters = 0
+        for index in indexes:
+            self.companies.update(index.get("companies", {}))
+            self.letters += len(index.get("letters", {}))
+            for entry in index.get("letters", {}).values():
+                for company, offset, snippet in entry["mentions"]:
+                    self.postings.setdefault(company, []).append((entry["quarter"], entry["fund"], offset, snippet))
+        for postings in self.postings.values():
+            postings.sort()
+        self.build_lookup()
+
+    def rows(self):
+        # Plain JSON values, what workers share instead of the built object
+        return {"companies": self.companies, "postings": self.postings, "letters": self.letters}
+
+    @staticmethod
+    def from_rows(rows):
+        index = MentionIndex([])
+        index.companies = rows["companies"]
+        index.postings = {company: [tuple(posting) for posting in postings] for company, postings in rows["postings"].items()}
+        index.letters = rows["letters"]
+        index.build_lookup()
+        return index
+
+    def build_lookup(self):
+        self.lookup = {}
+        for name, company in self.companies.items():
+            for alias in company["aliases"]:
+                self.lookup.setdefault(self.normalize(alias), name)
+            if company["ticker"]:
+                self.lookup.setdefault(self.normalize(company["ticker"]), name)
+
+    def normalize(self, text):
+        return re.sub(r'[^a-z0-9]', '', text.lower())
+
+    def match(self, query, limit=20):
+        # An exact name, alias or ticker wins, otherwise every company whose name contains the query
+        key = self.normalize(query)
+        if not key:
+            return []
+        if key in self.lookup:
+            return [self.lookup[key]]
+        matches = {name for alias, name in self.lookup.items() if key in alias}
+        return sorted(matches, key=lambda name: (-len(self.postings.get(name, [])), name))[:limit]
+
+    def mentions(self, company, fund_names=None):
+        postings = self.postings.get(company, [])
+        if fund_names:
+            postings = [posting for posting in postings if posting[1] in fund_names]
+        return postings
+
+    def counts(self, postings):
+        # Mentions per quarter and fund, quarters in order as the chart's x axis
+        counts = Counter((quarter, fund) for quarter, fund, _, _ in postings)
+        quarters = sorted({quarter for quarter, _ in counts})
+        funds = sorted({fund for _, fund in counts})
+        return quarters, {fund: [counts.get((quarter, fund), 0) for quarter in quarters] for fund in funds}
@@ -0,0 +1,131 @@
+import time
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+
+class RateGovernor:
+    def __init__(self, requests_per_minute, tokens_per_minute, state_path=None):
+        self.capacity = {"requests": float(requests_per_minute), "tokens": float(tokens_per_minute)}
+        self.levels = dict(self.capacity)
+        self.refilled_at = time.time()
+        self.state_path = state_path
+        self.condition = threading.Condition()
+        self.queues = OrderedDict()
+        self.wait_times = deque(maxlen=200)
+
+        if self.state_path:
+            # The bucket levels live in SQLite so every process on the host draws from the same budget
+            with self.connect() as conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS rate_buckets (name TEXT PRIMARY KEY, level REAL, refilled_at REAL)")
+                for name, capacity in self.capacity.items():
+                    conn.execute("INSERT OR IGNORE INTO rate_buckets VALUES (?, ?, ?)", (name, capacity, time.time()))
+
+    def connect(self):
+        return sqlite3.connect(self.state_path, timeout=30, isolation_level=None)
+
+    def refill(self, level, capacity, elapsed):
+        return min(capacity, level + elapsed * capacity / 60.0)
+
+    def seconds_until(self, levels, cost):
+        # How long until both buckets hold enough for this request
+        waits = [max(0.0, (cost[name] - levels[name]) * 60.0 / self.capacity[name]) for name in cost]
+        return max(waits)
+
+    def try_reserve(self, cost):
+        # Returns 0 when the cost was taken from the buckets, otherwise the seconds to wait
+        now = time.time()
+        if not self.state_path:
+            elapsed = now - self.refilled_at
+            self.refilled_at = now
+            for name in self.levels:
+                self.levels[name] = self.refill(self.levels[name], self.capacity[name], elapsed)
+            wait = self.seconds_until(self.levels, cost)
+            if wait == 0:
+                for name in cost:
+                    self.levels[name] -= cost[name]
+            return wait
+
+        with self.connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                levels = {}
+                for name, level, refilled_at in conn.execute("SELECT name, level, refilled_at FROM rate_buckets"):
+                    levels[name] = self.refill(level, self.capacity[name], now - refilled_at)
+                wait = self.seconds_until(levels, cost)
+                if wait == 0:
+                    for name in cost:
+                        levels[name] -= cost[name]
+                for name, level in levels.items():
+                    conn.execute("UPDATE rate_buckets SET level = ?, refilled_at = ? WHERE name = ?", (level, now, name))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return wait
+
+    def acquire(self, session_id, estimated_tokens):
+        # A request larger than the whole bucket would never fit, so cap it at the capacity
+        cost = {"requests": 1.0, "tokens": min(float(estimated_tokens), self.capacity["tokens"])}
+        ticket = object()
+        enqueued_at = time.time()
+
+        with self.condition:
+            self.queues.setdefault(session_id, deque()).append(ticket)
+            try:
+                while True:
+                    # Sessions take turns, so one analyst's burst can't starve everyone else
+                    head_session = next(iter(self.queues))
+                    if self.queues[head_session][0] is not ticket:
+                        self.condition.wait(timeout=1.0)
+                        continue
+                    if self.state_path:
+                        # Only the head ticket gets here, so the SQLite transaction can run without holding the lock
+                        self.condition.release()
+                        try:
+                            wait = self.try_reserve(cost)
+                        finally:
+                            self.condition.acquire()
+                    else:
+                        wait = self.try_reserve(cost)
+                    if wait == 0:
+                        break
+                    self.condition.wait(timeout=min(wait, 5.0))
+            finally:
+                # Leave the queue even when reserving failed, the sessions behind this ticket would wait forever otherwise
+                session_queue = self.queues[session_id]
+                session_queue.remove(ticket)
+                if session_queue:
+                    self.queues.move_to_end(session_id)
+                else:
+                    del self.queues[session_id]
+                self.condition.notify_all()
+            self.wait_times.append(time.time() - enqueued_at)
+
+        return cost["tokens"]
+
+    def settle(self, reserved_tokens, actual_tokens):
+        # Give back what the estimate over-reserved once the real usage is known
+        refund = reserved_tokens - actual_tokens
+        if refund <= 0:
+            return
+
+        if self.state_path:
+            # SQLite serialises the processes itself, the condition is only taken to wake the waiters
+            with self.connect() as conn:
+                conn.execute("UPDATE rate_buckets SET level = MIN(?, level + ?) WHERE name = 'tokens'", (self.capacity["tokens"], refund))
+        with self.condition:
+            if not self.state_path:
+                self.levels["tokens"] = min(self.capacity["tokens"], self.levels["tokens"] + refund)
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            queue_depth = sum(len(queue) for queue in self.queues.values())
+            waiting_sessions = len(self.queues)
+            wait_times = list(self.wait_times)
+        return {
+            "queue_depth": queue_depth,
+            "waiting_sessions": waiting_sessions,
+            "average_wait": sum(wait_times) / len(wait_times) if wait_times else 0.0,
+            "max_wait": max(wait_times) if wait_times else 0.0
+        }
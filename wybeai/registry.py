@@ -0,0 +1,194 @@
+import os
+import re
+import json
+import threading
+import botocore.exceptions
+
+FUND_SOURCES = {
+    "Hedge Funds": ("hedgefunds", "hedgefund_general_insights.json"),
+    "Venture Capital Funds": ("venturecapitalfunds", "vc_performance_insights.json"),
+}
+
+class FundRecord:
+    def __init__(self, fund_id, display_name, fund_type, bucket, prefix):
+        self.fund_id = fund_id
+        self.display_name = display_name
+        self.fund_type = fund_type
+        self.bucket = bucket
+        self.prefix = prefix
+        self.source_names = set()
+        self.quarters = []
+        self.compaction = {}
+
+    def letter_key(self, quarter):
+        return f"{self.prefix}/cleaned/{self.display_name} {quarter}.txt"
+
+    def compact_key(self, quarter):
+        return f"{self.prefix}/compact/{self.display_name} {quarter}.txt"
+
+    def preferred_letter_key(self, quarter):
+        # Use the boilerplate-free variant when one has been built for this quarter
+        if USE_COMPACT_LETTERS and quarter in self.compaction.get("letters", {}):
+            return self.compact_key(quarter)
+        return self.letter_key(quarter)
+
+    def equities_key(self):
+        return f"{self.prefix}/{self.prefix}_equities.json"
+
+    def investments_key(self):
+        return f"{self.prefix}/{self.prefix}_investments.json"
+
+    def letter_tag(self, quarter):
+        year, quarter_label = quarter.split(" ")
+        return f"{self.fund_id}_{year}_{quarter_label.lower()}"
+
+UPLOADED_LETTERS_CATALOG = "uploaded_letters.json"
+COMPACTION_REPORT = "compaction_report.json"
+USE_COMPACT_LETTERS = os.getenv("WYBEAI_COMPACT_LETTERS", "1") == "1"
+
+class FundRegistry:
+    def __init__(self):
+        # Both tables are replaced rather than changed in place, so readers use them without taking the lock
+        self.funds = {}
+        self.aliases = {}
+        # ETag of every registry file as it was loaded, the table snapshot revalidates against them
+        self.etags = {}
+        self.lock = threading.Lock()
+
+    def normalize(self, name):
+        # The one canonical string transform, every other spelling maps onto this
+        return re.sub(r'[^a-z0-9]', '', name.lower())
+
+    def make_record(self, fund_type, source_name):
+        bucket = FUND_SOURCES[fund_type][0]
+        display_name = source_name.replace(", LP", "")
+        fund_id = self.normalize(display_name)
+
+        # Hedge fund objects live under the squashed name, VC funds under their first word
+        if fund_type == "Hedge Funds":
+            prefix = display_name.lower().replace(" ", "")
+        else:
+            prefix = display_name.split(" ")[0].lower()
+        return FundRecord(fund_id, display_name, fund_type, bucket, prefix)
+
+    def register(self, fund_type, source_name, quarter=None):
+        with self.lock:
+            funds, aliases = dict(self.funds), dict(self.aliases)
+            record = self.add(funds, aliases, fund_type, source_name, quarter)
+            self.funds, self.aliases = funds, aliases
+        return record
+
+    def add(self, funds, aliases, fund_type, source_name, quarter):
+        # Records other threads may hold get new sets and lists instead of being changed in place
+        record = self.lookup(funds, aliases, source_name)
+        if record is None:
+            record = self.make_record(fund_type, source_name)
+            funds[record.fund_id] = record
+
+        if source_name not in record.source_names:
+            record.source_names = record.source_names | {source_name}
+        if quarter and quarter not in record.quarters:
+            record.quarters = sorted(record.quarters + [quarter])
+
+        for alias in (record.fund_id, record.display_name, source_name, record.prefix):
+            aliases.setdefault(alias, record.fund_id)
+        return record
+
+    def load(self, aws_operations):
+        # Loaded into copies that replace the tables in one step, a background reload never resizes a table being read
+        with self.lock:
+            funds, aliases, etags = dict(self.funds), dict(self.aliases), dict(self.etags)
+            for fund_type, (bucket, fund_info_path) in FUND_SOURCES.items():
+                try:
+                    fund_info_data = self.fetch_json(aws_operations, bucket, fund_info_path, etags)
+                except Exception as e:
+                    print(f"Could not load fund information: {fund_info_path}")
+                    print(f"Error: {str(e)}")
+                    continue
+                for obj in fund_info_data:
+                    self.add(funds, aliases, fund_type, obj['Fund Name'], obj.get('Date'))
+
+                # Letters uploaded through the Sources page are listed in a separate catalog
+                for obj in self.fetch_json(aws_operations, bucket, UPLOADED_LETTERS_CATALOG, etags, missing=[]):
+                    self.add(funds, aliases, fund_type, obj['Fund Name'], obj['Date'])
+
+                # Funds with compacted letters are listed in the bucket's compaction report
+                for fund_id, report in self.fetch_json(aws_operations, bucket, COMPACTION_REPORT, etags, missing={}).items():
+                    if fund_id in funds:
+                        funds[fund_id].compaction = report
+            self.funds, self.aliases, self.etags = funds, aliases, etags
+        return self
+
+    def fetch_json(self, aws_operations, bucket, file_name, etags, missing=None):
+        # Records the ETag of what was read, a file that does not exist yet is recorded without one
+        try:
+            text, etag = aws_operations.fetch_versioned(file_name, bucket)
+        except botocore.exceptions.ClientError as e:
+            if missing is None or e.response['Error']['Code'] != 'NoSuchKey':
+                raise e
+            etags[f"{bucket}/{file_name}"] = None
+            return missing
+        etags[f"{bucket}/{file_name}"] = etag
+        return json.loads(text)
+
+    def fetch_uploaded_letters(self, aws_operations, bucket):
+        try:
+            return json.loads(aws_operations.fetch_object(UPLOADED_LETTERS_CATALOG, bucket))
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] == 'NoSuchKey':
+                return []
+            raise e
+
+    def fetch_compaction_report(self, aws_operations, bucket):
+        try:
+            return json.loads(aws_operations.fetch_object(COMPACTION_REPORT, bucket))
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] == 'NoSuchKey':
+                return {}
+            raise e
+
+    def snapshot_rows(self):
+        return [
+            {"fund_id": record.fund_id, "display_name": record.display_name, "fund_type": record.fund_type, "bucket": record.bucket, "prefix": record.prefix,
+             "source_names": json.dumps(sorted(record.source_names)), "quarters": json.dumps(record.quarters), "compaction": json.dumps(record.compaction)}
+            for record in self.funds.values()
+        ]
+
+    def restore(self, rows, etags=None):
+        self.etags = dict(etags or {})
+        for row in rows:
+            record = FundRecord(row["fund_id"], row["display_name"], row["fund_type"], row["bucket"], row["prefix"])
+            record.source_names = set(json.loads(row["source_names"]))
+            record.quarters = json.loads(row["quarters"])
+            record.compaction = json.loads(row["compaction"])
+            self.funds[record.fund_id] = record
+            for alias in [record.fund_id, record.display_name, record.prefix] + sorted(record.source_names):
+                self.aliases.setdefault(alias, record.fund_id)
+        return self
+
+    def resolve(self, name):
+        return self.lookup(self.funds, self.aliases, name)
+
+    def lookup(self, funds, aliases, name):
+        # Exact spellings hit the alias table directly, anything else is normalized once
+        fund_id = aliases.get(name)
+        if fund_id is None:
+            fund_id = aliases.get(self.normalize(name))
+        return funds.get(fund_id)
+
+    def resolve_letter(self, fund_name_date):
+        # Split "Fund Name 2023 Q4" into the fund record and the quarter
+        parts = fund_name_date.split()
+        return self.resolve(" ".join(parts[:-2])), " ".join(parts[-2:])
+
+    def fund_names(self, fund_type):
+        return sorted(record.display_name for record in self.funds.values() if record.fund_type == fund_type)
+
+    def source_names(self, names):
+        # Every spelling the datasets use for the given funds
+        source_names = set()
+        for name in names:
+            record = self.resolve(name)
+            if record:
+                source_names.update(record.source_names)
+        return source_names
@@ -0,0 +1,157 @@
+import os
+import re
+import json
+import html
+import uuid
+import time
+import hashlib
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+class BulkReport:
+    # A quarterly pack of the standard Specific Funds analyses for many funds. Every (fund, analysis)
+    # piece runs at once, the shared rate governor decides what actually goes out, and each finished
+    # piece is checkpointed so a rerun with the same settings only does what is left
+    def __init__(self, analyst, funds, analyses, start_quarter=None, end_quarter=None, out_dir=os.path.join(".wybeai", "reports"), workers=16):
+        self.analyst = analyst
+        self.funds = [analyst.resolve_fund(fund) for fund in funds]
+        self.analyses = list(analyses)
+        self.start_quarter = start_quarter
+        self.end_quarter = end_quarter
+        self.workers = workers
+
+        # The settings name the report directory, so a different range or fund list never reuses stale pieces. An open
+        # range is resolved to the quarters it covers now, a newly added quarter then starts a new report
+        self.quarters = {record.fund_id: analyst.quarter_range(record.quarters, start_quarter, end_quarter) if record.quarters else [] for record in self.funds}
+        settings = json.dumps([sorted(self.quarters.items()), self.analyses])
+        self.report_id = hashlib.sha256(settings.encode("utf-8")).hexdigest()[:12]
+        self.report_dir = os.path.join(out_dir, self.report_id)
+        self.pieces_dir = os.path.join(self.report_dir, "pieces")
+        os.makedirs(self.pieces_dir, exist_ok=True)
+
+    def piece_path(self, record, option):
+        slug = re.sub(r'[^a-z0-9]+', '-', option.lower()).strip("-")
+        return os.path.join(self.pieces_dir, f"{record.fund_id}-{slug}.json")
+
+    def load_piece(self, record, option):
+        try:
+            with open(self.piece_path(record, option), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save_piece(self, record, option, piece):
+        # Write to a temporary file first so a crash never leaves a half-written checkpoint behind
+        path = self.piece_path(record, option)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(piece, f)
+        os.replace(tmp_path, path)
+
+    def run_piece(self, record, option):
+        started_at = time.time()
+        piece = self.analyst.analyze_fund(record.fund_id, option, self.start_quarter, self.end_quarter)
+        piece.update(started_at=started_at, ended_at=time.time())
+        # Only answers are checkpointed, a piece that came back with an error is tried again on the next run
+        if piece.get("answer") is not None:
+            self.save_piece(record, option, piece)
+        return piece
+
+    def run(self):
+        pieces = {}
+        pending = []
+        for record in self.funds:
+            for option in self.analyses:
+                piece = self.load_piece(record, option)
+                if piece:
+                    pieces[(record.fund_id, option)] = piece
+                else:
+                    pending.append((record, option))
+        resumed = len(pieces)
+        print(f"Report {self.report_id}: {resumed} pieces already done, {len(pending)} to run")
+
+        # Failed pieces are not checkpointed, so the next run retries exactly those
+        failures = []
+        started_at = time.time()
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(pending) or 1)), thread_name_prefix="wybeai-report") as executor:
+            futures = {executor.submit(self.run_piece, record, option): (record, option) for record, option in pending}
+            for future in futures:
+                record, option = futures[future]
+                try:
+                    piece = future.result()
+                    pieces[(record.fund_id, option)] = piece
+                    if piece.get("answer") is None:
+                        print(f"Report piece has no answer: {record.display_name} / {option}")
+                        print(f"Error: {piece.get('error')}")
+                        failures.append({"fund": record.display_name, "option": option, "error": piece.get("error")})
+                    else:
+                        print(f"Done: {record.display_name} / {option}")
+                except Exception as e:
+                    print(f"Report piece failed: {record.display_name} / {option}")
+                    print(f"Error: {str(e)}")
+                    failures.append({"fund": record.display_name, "option": option, "error": str(e)})
+        wall_time = time.time() - started_at
+
+        # A fund takes as long as its slowest piece, the whole run should take about as long as the slowest fund
+        fund_seconds = {}
+        for (fund_id, _), piece in pieces.items():
+            if piece.get("started_at") and piece["started_at"] >= started_at:
+                fund_seconds[fund_id] = max(fund_seconds.get(fund_id, 0.0), piece["ended_at"] - piece["started_at"])
+
+        result = {
+            "report_id": self.report_id,
+            "pieces": len(pieces),
+            "resumed": resumed,
+            "failures": failures,
+            "wall_time": round(wall_time, 2),
+            "slowest_fund": round(max(fund_seconds.values()), 2) if fund_seconds else None,
+        }
+        result.update(self.write(pieces))
+        return result
+
+    def sections(self, pieces):
+        for record in sorted(self.funds, key=lambda record: record.display_name):
+            yield record, [(option, pieces.get((record.fund_id, option))) for option in self.analyses]
+
+    def markdown(self, pieces):
+        lines = [f"# Quarterly pack: {self.start_quarter or 'earliest'} to {self.end_quarter or 'latest'}", "", f"Generated {datetime.now():%Y-%m-%d %H:%M}", ""]
+        for record, entries in self.sections(pieces):
+            lines += [f"## {record.display_name}", ""]
+            for option, piece in entries:
+                lines += [f"### {option}", ""]
+                if piece is None:
+                    lines += ["_Not generated, rerun the report to retry._", ""]
+                    continue
+                if piece.get("letters"):
+                    lines += [f"_Letters: {', '.join(piece['letters'])}_", ""]
+                lines += [piece.get("answer") or piece.get("error") or "", ""]
+        return "\n".join(lines)
+
+    def html(self, pieces):
+        title = f"Quarterly pack: {self.start_quarter or 'earliest'} to {self.end_quarter or 'latest'}"
+        parts = [f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>{html.escape(title)}</title>",
+                 "<style>body{font-family:sans-serif;max-width:900px;margin:auto}.answer{white-space:pre-wrap}.letters{color:#666}</style></head><body>",
+                 f"<h1>{html.escape(title)}</h1><p>Generated {datetime.now():%Y-%m-%d %H:%M}</p>"]
+        for record, entries in self.sections(pieces):
+            parts.append(f"<h2>{html.escape(record.display_name)}</h2>")
+            for option, piece in entries:
+                parts.append(f"<h3>{html.escape(option)}</h3>")
+                if piece is None:
+                    parts.append("<p><em>Not generated, rerun the report to retry.</em></p>")
+                    continue
+                if piece.get("letters"):
+                    parts.append(f"<p class=\"letters\">Letters: {html.escape(', '.join(piece['letters']))}</p>")
+                parts.append(f"<div class=\"answer\">{html.escape(piece.get('answer') or piece.get('error') or '')}</div>")
+        parts.append("</body></html>")
+        return "\n".join(parts)
+
+    def write(self, pieces):
+        paths = {}
+        for kind, render in (("markdown", self.markdown), ("html", self.html)):
+            path = os.path.join(self.report_dir, f"report.{'md' if kind == 'markdown' else 'html'}")
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(render(pieces))
+            os.replace(tmp_path, path)
+            paths[kind] = path
+        return paths
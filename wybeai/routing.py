@@ -0,0 +1,71 @@
+import math
+import threading
+
+CLAUDE_HAIKU = "claude-3-haiku-20240307"
+CLAUDE_SONNET = "claude-3-sonnet-20240229"
+
+def estimate_tokens(text):
+    # Rough local estimate, Claude averages about 4 characters per token on English prose
+    return math.ceil(len(text) / 4)
+
+# Prices are per million tokens, speeds are starting points that get replaced by observed latencies
+MODEL_PROFILES = {
+    CLAUDE_HAIKU: {"input_price": 0.25, "output_price": 1.25, "overhead": 1.0, "input_tokens_per_second": 20000.0, "output_tokens_per_second": 120.0},
+    CLAUDE_SONNET: {"input_price": 3.0, "output_price": 15.0, "overhead": 2.0, "input_tokens_per_second": 8000.0, "output_tokens_per_second": 50.0}
+}
+
+# Output budgets per task type: extraction pulls facts out of one fund's letters, synthesis compares across funds and quarters
+TASK_OUTPUT_BUDGETS = {"qa": 2000, "extraction": 2000, "synthesis": 3000}
+
+class ModelRouter:
+    def __init__(self, target="balanced", latency_target=45.0, cost_target=0.10):
+        self.target = target
+        self.latency_target = latency_target
+        self.cost_target = cost_target
+        self.output_rates = {model: profile["output_tokens_per_second"] for model, profile in MODEL_PROFILES.items()}
+        self.observations = {model: 0 for model in MODEL_PROFILES}
+        self.lock = threading.Lock()
+
+    def predict_latency(self, model, input_tokens, max_tokens):
+        # Assume the answer uses about 60% of its budget
+        profile = MODEL_PROFILES[model]
+        return profile["overhead"] + input_tokens / profile["input_tokens_per_second"] + 0.6 * max_tokens / self.output_rates[model]
+
+    def predict_cost(self, model, input_tokens, max_tokens):
+        profile = MODEL_PROFILES[model]
+        return (input_tokens * profile["input_price"] + max_tokens * profile["output_price"]) / 1000000
+
+    def route(self, task, input_tokens, question_tokens=0):
+        max_tokens = TASK_OUTPUT_BUDGETS.get(task, 2000)
+
+        # Short free-text questions get a smaller budget and always take the fastest model
+        if task == "qa":
+            if question_tokens and question_tokens < 100:
+                max_tokens = 1000
+            return CLAUDE_HAIKU, max_tokens
+
+        if self.target == "latency" or task != "synthesis":
+            return CLAUDE_HAIKU, max_tokens
+
+        # Comparative synthesis benefits from the larger model when it fits the latency and cost targets
+        if self.target == "quality":
+            return CLAUDE_SONNET, max_tokens
+        within_latency = self.predict_latency(CLAUDE_SONNET, input_tokens, max_tokens) <= self.latency_target
+        within_cost = self.predict_cost(CLAUDE_SONNET, input_tokens, max_tokens) <= self.cost_target
+        if within_latency and within_cost:
+            return CLAUDE_SONNET, max_tokens
+        return CLAUDE_HAIKU, max_tokens
+
+    def record(self, model, latency, input_tokens, output_tokens):
+        # Back out the generation speed from the observed latency and keep a moving average of it
+        profile = MODEL_PROFILES[model]
+        generation_time = latency - profile["overhead"] - input_tokens / profile["input_tokens_per_second"]
+        if output_tokens <= 0 or generation_time <= 0:
+            return
+        with self.lock:
+            self.output_rates[model] = 0.8 * self.output_rates[model] + 0.2 * output_tokens / generation_time
+            self.observations[model] += 1
+
+    def stats(self):
+        with self.lock:
+            return {model: {"output_tokens_per_second": round(self.output_rates[model], 1), "observations": self.observations[model]} for model in MODEL_PROFILES}
@@ -0,0 +1,151 @@
+import re
+import zlib
+import time
+import hashlib
+import threading
+import numpy as np
+from collections import Counter, OrderedDict
+
+# Words that change how a question is phrased but not what it asks
+QUESTION_FILLER = {
+    "a", "an", "the", "and", "or", "of", "to", "in", "on", "for", "about", "with", "by", "at", "from", "as",
+    "is", "are", "was", "were", "be", "been", "do", "does", "did", "has", "have", "had", "its",
+    "they", "their", "them", "this", "that", "these", "those", "what", "which", "how", "can", "could",
+    "please", "tell", "me", "say", "said", "says", "any", "some", "there", "fund", "funds", "letter", "letters",
+    "my", "we", "our", "you", "your", "anything", "regarding", "give", "explain", "describe", "summarize", "summary",
+    "comment", "comments", "commentary", "view", "views", "thoughts", "think", "mention", "mentioned", "discuss", "discussed",
+}
+
+# Bump to invalidate every stored answer when prompts or normalization change
+SEMANTIC_CACHE_VERSION = 2
+
+def normalize_question(question):
+    # Lowercase words without punctuation or filler, so rephrasings of the same question line up
+    words = re.findall(r"[a-z0-9]+", question.lower())
+    kept = [word for word in words if word not in QUESTION_FILLER]
+    return " ".join(kept or words)
+
+def same_word(word, other):
+    # Inflections of one word ("exit", "exited", "exits") share a long prefix, different words ("added", "exited") don't
+    if word == other:
+        return True
+    prefix = 0
+    for a, b in zip(word, other):
+        if a != b:
+            break
+        prefix += 1
+    return prefix >= max(4, min(len(word), len(other)) - 2) or (prefix == min(len(word), len(other)) and prefix >= 3)
+
+def same_content(words, other_words):
+    # Every content word needs a counterpart in the other question, a single differing word can reverse the meaning
+    covered = lambda left, right: all(any(same_word(word, other) for other in right) for word in left)
+    return covered(words, other_words) and covered(other_words, words)
+
+class SemanticAnswerCache:
+    # Ask Anything answers keyed by what was asked rather than the exact wording. Questions are
+    # compared as TF-IDF vectors of hashed character trigrams, and only within the same fund,
+    # letter set and cache version, so an answer is never reused against different source text
+    def __init__(self, threshold=0.8, max_entries=5000, dimensions=4096):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.dimensions = dimensions
+        self.entries = OrderedDict()
+        self.scopes = {}
+        self.document_frequency = np.zeros(dimensions)
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "stored": 0}
+
+    def features(self, normalized):
+        # Term counts over trigrams of each padded word plus the whole words themselves
+        counts = Counter()
+        for word in normalized.split():
+            padded = f" {word} "
+            for i in range(len(padded) - 2):
+                counts[zlib.crc32(padded[i:i + 3].encode("utf-8")) % self.dimensions] += 1
+            counts[zlib.crc32(f"w:{word}".encode("utf-8")) % self.dimensions] += 1
+        return counts
+
+    def scope(self, kind, fund_id, names, letters):
+        # Answers only carry over between questions asked of the same letters. The letters may be text, bytes or
+        # mapped files, each is hashed from its content with its length in front so boundaries count
+        digest = hashlib.sha256()
+        for letter in letters:
+            if letter is None:
+                digest.update(b"-")
+                continue
+            data = letter.encode("utf-8") if isinstance(letter, str) else memoryview(letter)
+            digest.update(f"{len(data)}:".encode("utf-8"))
+            digest.update(data)
+        return (kind, str(fund_id), tuple(names), digest.hexdigest(), SEMANTIC_CACHE_VERSION)
+
+    def vector(self, counts):
+        # Sparse (indexes, weights) with smoothed IDF, so a term seen in every stored question still counts a little
+        indexes = np.fromiter(counts.keys(), dtype=int, count=len(counts))
+        weights = np.fromiter(counts.values(), dtype=float, count=len(counts))
+        idf = np.log((1 + len(self.entries)) / (1 + self.document_frequency[indexes])) + 1
+        weights = (1 + np.log(weights)) * idf if len(counts) else weights
+        norm = np.linalg.norm(weights)
+        return indexes, weights / norm if norm else weights
+
+    def lookup(self, scope, question):
+        normalized = normalize_question(question)
+        with self.lock:
+            keys = self.scopes.get(scope, [])
+            if not keys:
+                self.counters["misses"] += 1
+                return None
+
+            # Stored vectors keep the weights they had when they were written, only the question is weighted here
+            words = normalized.split()
+            query_indexes, query_weights = self.vector(self.features(normalized))
+            query = np.zeros(self.dimensions)
+            query[query_indexes] = query_weights
+            best_key, best_similarity = None, 0.0
+            for key in keys:
+                entry = self.entries[key]
+                if entry["normalized"] == normalized:
+                    similarity = 1.0
+                elif same_content(words, entry["words"]):
+                    indexes, weights = entry["vector"]
+                    similarity = float(query[indexes] @ weights)
+                else:
+                    continue
+                if similarity > best_similarity:
+                    best_key, best_similarity = key, similarity
+
+            if best_key is None or best_similarity < self.threshold:
+                self.counters["misses"] += 1
+                return None
+            self.entries.move_to_end(best_key)
+            self.counters["hits"] += 1
+            entry = self.entries[best_key]
+            return {"question": entry["question"], "answer": entry["answer"], "similarity": round(best_similarity, 3), "stored_at": entry["stored_at"]}
+
+    def store(self, scope, question, answer):
+        normalized = normalize_question(question)
+        key = (scope, normalized)
+        with self.lock:
+            # A rephrasing that normalizes identically replaces the earlier answer
+            if key in self.entries:
+                self.forget(key)
+            counts = self.features(normalized)
+            self.document_frequency[list(counts.keys())] += 1
+            self.entries[key] = {"question": question, "normalized": normalized, "words": normalized.split(), "answer": answer,
+                                 "counts": counts, "vector": self.vector(counts), "stored_at": time.time()}
+            self.scopes.setdefault(scope, []).append(key)
+            self.counters["stored"] += 1
+
+            while len(self.entries) > self.max_entries:
+                self.forget(next(iter(self.entries)))
+
+    def forget(self, key):
+        entry = self.entries.pop(key)
+        self.document_frequency[list(entry["counts"].keys())] -= 1
+        keys = self.scopes[key[0]]
+        keys.remove(key)
+        if not keys:
+            del self.scopes[key[0]]
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries), scopes=len(self.scopes), threshold=self.threshold)
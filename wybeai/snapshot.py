@@ -0,0 +1,183 @@
+import os
+import json
+import uuid
+import time
+import hashlib
+import threading
+import botocore.exceptions
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from wybeai.registry import FUND_SOURCES, UPLOADED_LETTERS_CATALOG, COMPACTION_REPORT, FundRegistry
+from wybeai.insights import INSIGHT_TABLES
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+SNAPSHOT_SCHEMA = "1"
+
+class TableSnapshot:
+    # The parsed insight tables and fund registry as uncompressed Arrow IPC files, so a restarted worker maps
+    # them instead of downloading and parsing every dataset. Each write goes to a new generation directory and
+    # the manifest is swapped last, readers never mix files from two writes
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.manifest = None
+        self.tables = None
+        self.registry_restored = False
+
+    def layout(self):
+        # Changes to the table columns make older snapshots unusable
+        return hashlib.sha256(json.dumps([SNAPSHOT_SCHEMA, INSIGHT_TABLES]).encode("utf-8")).hexdigest()
+
+    def registry_sources(self):
+        return [(bucket, file_name) for bucket, fund_info_path in FUND_SOURCES.values() for file_name in (fund_info_path, UPLOADED_LETTERS_CATALOG, COMPACTION_REPORT)]
+
+    def read(self):
+        # Maps the current generation once, later calls reuse the mapped tables
+        with self.lock:
+            if self.tables is not None or pa is None:
+                return self.tables
+            try:
+                with open(os.path.join(self.directory, "manifest.json"), encoding="utf-8") as f:
+                    manifest = json.load(f)
+                if manifest.get("layout") != self.layout():
+                    print(f"Ignoring snapshot written for another table layout: {self.directory}")
+                    return None
+                started_at = time.perf_counter()
+                generation_dir = os.path.join(self.directory, manifest["generation"])
+                tables = {}
+                for name in list(INSIGHT_TABLES) + ["registry"]:
+                    tables[name] = pa.ipc.open_file(pa.memory_map(os.path.join(generation_dir, f"{name}.arrow"), "r")).read_all()
+                print(f"Mapped table snapshot {manifest['generation']} in {(time.perf_counter() - started_at) * 1000:.1f} ms")
+            except FileNotFoundError:
+                return None
+            except Exception as e:
+                print(f"Could not read table snapshot: {self.directory}")
+                print(f"Error: {str(e)}")
+                return None
+            self.manifest = manifest
+            self.tables = tables
+            return tables
+
+    def restore_registry(self):
+        # Only the first registry of a worker comes from the snapshot, the validation keeps it current after that
+        if self.registry_restored or self.read() is None:
+            return None
+        self.registry_restored = True
+        return FundRegistry().restore(self.tables["registry"].to_pylist(), self.manifest["registry_sources"])
+
+    def restore_insights(self, insight_store):
+        if self.read() is None:
+            return False
+        started_at = time.perf_counter()
+        insight_store.restore({name: self.tables[name].to_pydict() for name in INSIGHT_TABLES}, self.manifest["sources"])
+        print(f"Restored insight tables from snapshot in {(time.perf_counter() - started_at) * 1000:.1f} ms")
+        return True
+
+    def start(self, target, *args):
+        threading.Thread(target=target, args=args, name="wybeai-snapshot", daemon=True).start()
+
+    def arrow_table(self, columns, column_types):
+        return pa.table({name: pa.array(values, type=column_types.get(name, pa.string())) for name, values in columns.items()})
+
+    def write(self, aws_operations, fund_registry, insight_store):
+        if pa is None:
+            return None
+        try:
+            tables, sources = insight_store.snapshot_tables()
+            # ETags before rows, a reload publishing in between leaves newer rows that the next start simply reloads
+            registry_etags = {f"{bucket}/{file_name}": fund_registry.etags.get(f"{bucket}/{file_name}") for bucket, file_name in self.registry_sources()}
+            registry_rows = fund_registry.snapshot_rows()
+
+            # Named so they sort in the order they were written, pruning keeps the newest ones
+            generation = f"{datetime.now():%Y%m%d-%H%M%S-%f}-{uuid.uuid4().hex[:8]}"
+            generation_dir = os.path.join(self.directory, generation)
+            os.makedirs(generation_dir, exist_ok=True)
+            arrow_tables = {}
+            for table, columns in INSIGHT_TABLES.items():
+                column_types = {"position": pa.int64(), **{column: pa.float64() if column_type == "REAL" else pa.string() for column, (_, column_type) in columns.items()}}
+                arrow_tables[table] = self.arrow_table(tables[table], column_types)
+            registry_columns = {name: [row[name] for row in registry_rows] for name in ("fund_id", "display_name", "fund_type", "bucket", "prefix", "source_names", "quarters", "compaction")}
+            arrow_tables["registry"] = self.arrow_table(registry_columns, {})
+
+            size = 0
+            for name, table in arrow_tables.items():
+                path = os.path.join(generation_dir, f"{name}.arrow")
+                with pa.OSFile(path, "wb") as sink:
+                    with pa.ipc.new_file(sink, table.schema) as writer:
+                        writer.write_table(table)
+                size += os.path.getsize(path)
+
+            # Swapping the manifest publishes the generation, older ones are removed once nothing points at them
+            manifest = {"layout": self.layout(), "generation": generation, "written_at": datetime.now().isoformat(), "sources": sources, "registry_sources": registry_etags}
+            tmp_path = os.path.join(self.directory, f"manifest.json.{uuid.uuid4().hex}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            os.replace(tmp_path, os.path.join(self.directory, "manifest.json"))
+            self.prune(generation)
+            print(f"Wrote table snapshot {generation} ({size / 1e6:.1f} MB)")
+            return {"generation": generation, "path": generation_dir, "bytes": size, "rows": {name: table.num_rows for name, table in arrow_tables.items()}}
+        except Exception as e:
+            print(f"Could not write table snapshot: {self.directory}")
+            print(f"Error: {str(e)}")
+            return None
+
+    def prune(self, current, keep=2):
+        # Keep the previous generation too, another worker may still have it mapped
+        generations = sorted(name for name in os.listdir(self.directory) if os.path.isdir(os.path.join(self.directory, name)))
+        for name in generations[:-keep]:
+            if name != current:
+                for file_name in os.listdir(os.path.join(self.directory, name)):
+                    os.remove(os.path.join(self.directory, name, file_name))
+                os.rmdir(os.path.join(self.directory, name))
+
+    def changed(self, aws_operations, bucket, file_name, etag):
+        # A conditional GET per object, unchanged objects cost a 304 and no body. Returns None when unchanged
+        try:
+            body, new_etag = aws_operations.get_object(file_name, bucket, etag)
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] == 'NoSuchKey':
+                return None if etag is None else (b"[]", None)
+            raise e
+        return (body, new_etag) if body is not None else None
+
+    def validate(self, aws_operations, fund_registry, insight_store):
+        started_at = time.perf_counter()
+        stale = []
+        try:
+            for bucket, file_name in self.registry_sources():
+                source = f"{bucket}/{file_name}"
+                if self.changed(aws_operations, bucket, file_name, fund_registry.etags.get(source)) is not None:
+                    stale.append(source)
+            if stale:
+                # New funds or quarters, the reload is additive and swaps the tables in, so sections holding the registry see them too
+                fund_registry.load(aws_operations)
+
+            # The conditional GETs go out together, only reloading the changed files takes the store's lock
+            sources = insight_store.sources()
+            with ThreadPoolExecutor(max_workers=16, thread_name_prefix="wybeai-snapshot") as executor:
+                results = list(executor.map(lambda item: self.changed(aws_operations, item[1], item[2], insight_store.etags.get(f"{item[1]}/{item[2]}")), sources))
+
+            with insight_store.lock:
+                for (table, bucket, file_name, record), result in zip(sources, results):
+                    source = f"{bucket}/{file_name}"
+                    if result is None:
+                        continue
+                    generation = insight_store.generation
+                    insight_store.load_source(table, bucket, file_name, record, result[0].decode("utf-8"), result[1])
+                    stale.append(source)
+                    if insight_store.generation != generation:
+                        print(f"Snapshot was stale for: {source}")
+                insight_store.refreshed_at = time.time()
+        except Exception as e:
+            print("Could not validate table snapshot")
+            print(f"Error: {str(e)}")
+            return
+
+        print(f"Validated table snapshot in {time.perf_counter() - started_at:.2f}s, {len(stale)} of {len(self.registry_sources()) + len(sources)} objects changed")
+        if stale:
+            self.write(aws_operations, fund_registry, insight_store)
@@ -0,0 +1,58 @@
+import os
+import io
+import uuid
+import hashlib
+import botocore.exceptions
+
+class LocalS3:
+    # The slice of the S3 client the app uses, backed by a directory laid out as <root>/<bucket>/<key>
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def path(self, bucket, key):
+        path = os.path.abspath(os.path.join(self.root, bucket, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Key escapes the storage directory: {key}")
+        return path
+
+    def error(self, code, status, operation):
+        return botocore.exceptions.ClientError({"Error": {"Code": code, "Message": code}, "ResponseMetadata": {"HTTPStatusCode": status}}, operation)
+
+    def etag(self, body):
+        return f'"{hashlib.md5(body).hexdigest()}"'
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        try:
+            with open(self.path(Bucket, Key), "rb") as f:
+                body = f.read()
+        except FileNotFoundError:
+            raise self.error("NoSuchKey", 404, "GetObject")
+        etag = self.etag(body)
+        if IfNoneMatch == etag:
+            raise self.error("304", 304, "GetObject")
+        return {"Body": io.BytesIO(body), "ETag": etag}
+
+    def upload_fileobj(self, fileobj, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        # Write to a temporary file first so readers never see a half-written object, like an S3 PUT
+        path = self.path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        body = fileobj.read()
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+        if Callback:
+            Callback(len(body))
+
+    def list_objects_v2(self, Bucket, Prefix="", ContinuationToken=None):
+        bucket_root = os.path.join(self.root, Bucket)
+        contents = []
+        for directory, _, files in os.walk(bucket_root):
+            for file_name in files:
+                if file_name.endswith(".tmp"):
+                    continue
+                key = os.path.relpath(os.path.join(directory, file_name), bucket_root).replace(os.sep, "/")
+                if key.startswith(Prefix):
+                    with open(os.path.join(directory, file_name), "rb") as f:
+                        contents.append({"Key": key, "ETag": self.etag(f.read())})
+        return {"Contents": sorted(contents, key=lambda item: item["Key"]), "IsTruncated": False}